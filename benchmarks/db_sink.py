@@ -0,0 +1,195 @@
+"""
+How long source >> destination takes to write 100,000 rows to a database,
+with a template that sends every action in its own transaction, and with one that writes through a DBSink
+
+python benchmarks/db_sink.py                  # 100,000 source rows, sqlite file in a temporary directory
+python benchmarks/db_sink.py 20000 --batch-size 500 --rows-per-insert 50
+
+The destination starts with 40% of the source's rows (every tenth with another username) and 10% of its own,
+and 50 of the rows the source adds are in the database already, so their inserts fail and the sink has to send around them.
+Both templates must end with the same rows in the database and the same counts of successes and failures.
+A transaction per action costs a sync to disk each, so on a slow disk that half of the run can take many minutes
+"""
+
+import argparse
+import io
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy import create_engine, text
+from dss.datastore.branch import DataStoreBranches
+from dss.datastore.tree import DataStoreTree, DataStoreTreeMeta
+from dss.importers import DBSink, DefaultImporter
+from dss.models.base import Base
+from dss.templates import DefaultTemplate
+
+ROWS = 100000
+
+
+class User(Base):
+    pass
+
+
+def source_rows():
+    for i in range(ROWS):
+        yield dict(idnumber=str(i), firstname='First{}'.format(i % 300), lastname='Last{}'.format(i % 400), username='user{}'.format(i))
+
+
+def dest_rows():
+    for i in range(ROWS * 4 // 10):
+        yield dict(idnumber=str(i), firstname='First{}'.format(i % 300), lastname='Last{}'.format(i % 400), username='other' if i % 10 == 0 else 'user{}'.format(i))
+    for i in range(ROWS // 10):
+        yield dict(idnumber='gone{}'.format(i), firstname='Gone', lastname='Gone', username='gone{}'.format(i))
+
+
+class SourceImporter(DefaultImporter):
+
+    def readin(self):
+        return source_rows()
+
+
+class DestImporter(DefaultImporter):
+
+    def readin(self):
+        return dest_rows()
+
+
+class SourceBranches(DataStoreBranches):
+    _importer = __name__ + '.SourceImporter'
+
+
+class DestBranches(DataStoreBranches):
+    _importer = __name__ + '.DestImporter'
+
+
+class SourceUsers(SourceBranches):
+    _branchname = 'users'
+    _klass = __name__ + '.User'
+
+
+class DestUsers(DestBranches):
+    _branchname = 'users'
+    _klass = __name__ + '.User'
+
+
+class Source(DataStoreTree):
+    _branches = __name__ + '.SourceBranches'
+
+
+class Dest(DataStoreTree):
+    _branches = __name__ + '.DestBranches'
+
+
+class CountingTemplate(DefaultTemplate):
+    engine = None
+    succeeded = failed = 0
+
+    def result_bool(self, result):
+        return result is True
+
+    def success(self, action, result):
+        self.__class__.succeeded += 1
+
+    def fail(self, action, result):
+        self.__class__.failed += 1
+
+
+class PerActionTemplate(CountingTemplate):
+
+    def write(self, sql, params):
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(text(sql), params)
+        except Exception as error:
+            return error
+        return True
+
+    def new_users(self, action):
+        source = action.source
+        return self.write("INSERT INTO users (idnumber, firstname, lastname, username) VALUES (:p0, :p1, :p2, :p3)",
+                          dict(p0=action.idnumber, p1=source.firstname, p2=source.lastname, p3=source.username))
+
+    def update_username(self, action):
+        return self.write("UPDATE users SET username = :p0 WHERE idnumber = :key", dict(p0=action.source.username, key=action.idnumber))
+
+    def old_users(self, action):
+        return self.write("DELETE FROM users WHERE idnumber = :key", dict(key=action.idnumber))
+
+
+class SinkTemplate(CountingTemplate):
+    batch_size = 1000
+    rows_per_insert = 1
+
+    def __init__(self):
+        self.sink = DBSink(self.engine, self, batch_size=self.batch_size, rows_per_insert=self.rows_per_insert)
+
+    def new_users(self, action):
+        source = action.source
+        return self.sink.insert('users', {'idnumber': action.idnumber, 'firstname': source.firstname, 'lastname': source.lastname, 'username': source.username}, action)
+
+    def update_username(self, action):
+        return self.sink.update('users', action.idnumber, {'username': action.source.username}, action)
+
+    def old_users(self, action):
+        return self.sink.delete('users', action.idnumber, action)
+
+
+def prepare(path):
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine('sqlite:///' + path)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE users (idnumber TEXT PRIMARY KEY, firstname TEXT, lastname TEXT, username TEXT)"))
+        connection.execute(text("INSERT INTO users VALUES (:idnumber, :firstname, :lastname, :username)"), list(dest_rows()))
+        connection.execute(text("INSERT INTO users (idnumber) VALUES (:idnumber)"), [{'idnumber': str(ROWS - 1 - i)} for i in range(50)])
+    return engine
+
+
+def run(template, path):
+    DataStoreTreeMeta._store.clear()
+    DataStoreTreeMeta._storeobjects.clear()
+    template.engine = engine = prepare(path)
+    template.succeeded = template.failed = 0
+    source, dest = Source(), Dest()
+    dest._template = template
+    with contextlib.redirect_stdout(io.StringIO()):
+        +source
+        +dest
+        started = time.perf_counter()
+        source >> dest
+        elapsed = time.perf_counter() - started
+    with engine.connect() as connection:
+        rows = sorted(connection.execute(text("SELECT idnumber, username FROM users")).fetchall())
+    engine.dispose()
+    return elapsed, template.succeeded, template.failed, rows
+
+
+def main(argv=None):
+    global ROWS
+    parser = argparse.ArgumentParser(description="Writes through a DBSink against a transaction per action")
+    parser.add_argument('rows', nargs='?', type=int, default=ROWS)
+    parser.add_argument('--batch-size', type=int, default=SinkTemplate.batch_size)
+    parser.add_argument('--rows-per-insert', type=int, default=SinkTemplate.rows_per_insert)
+    args = parser.parse_args(argv)
+    ROWS = args.rows
+    SinkTemplate.batch_size, SinkTemplate.rows_per_insert = args.batch_size, args.rows_per_insert
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'users.sqlite')
+        results = {}
+        for name, template in (('per action', PerActionTemplate), ('sink', SinkTemplate)):
+            elapsed, succeeded, failed, rows = results[name] = run(template, path)
+            print("{:<12} {:7.2f}s  {} succeeded, {} failed".format(name, elapsed, succeeded, failed))
+    (per_action, *per_action_counts), (sink, *sink_counts) = results['per action'], results['sink']
+    if per_action_counts != sink_counts:
+        sys.exit("The sink didn't end with the same rows and counts as a transaction per action")
+    print("{:.1f}x faster".format(per_action / sink))
+
+
+if __name__ == "__main__":
+    main()
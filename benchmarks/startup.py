@@ -0,0 +1,75 @@
+"""
+How long a fresh interpreter takes to import dss and define a tree with branches, against a budget
+
+python benchmarks/startup.py                   # 20 runs, fails if the median is over 0.25s more than a bare interpreter
+python benchmarks/startup.py --runs 50 --budget 0.1
+
+Each run is a new interpreter, so nothing is in sys.modules already; what is reported is the time over
+starting a bare one (python -c pass), which is what importing and defining the tree add.
+The importers are loaded when first used (see dss.importers), so this is also a check that none of them is loaded here
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BUDGET = 0.25
+
+DEFINE_TREE = """
+import sys
+from dss.datastore.branch import DataStoreBranches
+from dss.datastore.tree import DataStoreTree
+from dss.models.base import Base
+
+class User(Base):
+    pass
+
+class Branches(DataStoreBranches):
+    _importer = 'dss.importers.CSVImporter'
+
+class Users(Branches):
+    _branchname = 'users'
+    _klass = '__main__.User'
+
+class Groups(Branches):
+    _branchname = 'groups'
+    _klass = '__main__.User'
+
+class Tree(DataStoreTree):
+    _branches = '__main__.Branches'
+
+tree = Tree()
+assert set(tree.branch_names) >= {'users', 'groups'}, tree.branch_names
+assert 'sqlalchemy' not in sys.modules
+"""
+
+
+def timed(code):
+    started = time.perf_counter()
+    subprocess.check_call([sys.executable, '-c', code], cwd=ROOT)
+    return time.perf_counter() - started
+
+
+def median(code, runs):
+    return statistics.median(timed(code) for _ in range(runs))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Times importing dss and defining a tree in a fresh interpreter")
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--budget', type=float, default=BUDGET, help="seconds over a bare interpreter")
+    args = parser.parse_args(argv)
+
+    bare = median('pass', args.runs)
+    startup = median(DEFINE_TREE, args.runs)
+    print("bare interpreter {:.3f}s, import dss and define a tree {:.3f}s: {:.3f}s over".format(bare, startup, startup - bare))
+    if startup - bare > args.budget:
+        sys.exit("Over the budget of {:.3f}s".format(args.budget))
+
+
+if __name__ == "__main__":
+    main()
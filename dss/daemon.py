@@ -0,0 +1,329 @@
+"""
+Keeps the trees of a sync in memory and syncs them on a schedule, instead of starting from nothing every time
+
+python -m dss.daemon mysync.Source mysync.Destination --interval 300 --socket /tmp/mysync.sock --max-rss-mb 2048 \
+    --limit old_users=100 --limit update_username=:500 --limit new_users=1:
+python -m dss.daemon --send status /tmp/mysync.sock      # or refresh, reload, stop
+
+With --query-socket, the trees are also served by a dss.query.QueryService, published after every refresh
+
+Each cycle calls refresh on both trees, which only imports again what has changed (see DataStoreTree.refresh),
+then source >> destination. With limits, the cycle is refused if source.plan(destination) is out of range.
+
+The status is served as a JSON line to any of these commands written to the Unix socket:
+status, refresh (start a cycle now), reload, stop
+Anyone who can connect can stop the sync, so the sockets are made readable and writable by the owner only (--socket-mode to change)
+
+Reload (the reload command, SIGHUP, or a change to the source of any module the trees are made from)
+waits for the cycle to finish, then starts the process again with the same arguments:
+the trees are classes made when their modules are imported, so new model code needs a new interpreter.
+If the process grows past max_rss, objects that nothing holds any more are dropped,
+and if that isn't enough it restarts the same way
+"""
+
+import argparse
+import gc
+import importlib
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from dss.utils import bind_unix_server, split_import_specifier
+from dss.query import QueryService
+
+COMMANDS = ('status', 'refresh', 'reload', 'stop')
+
+
+def resident_memory():
+    """
+    Bytes of memory the process has now, or at its peak where /proc isn't available
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on linux, bytes on mac
+        return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def load(specifier):
+    if not isinstance(specifier, str):
+        return specifier
+    mod, clss = split_import_specifier(specifier)
+    return getattr(importlib.import_module(mod), clss)
+
+
+def parse_limit(text):
+    """
+    NAME=MAX or NAME=MIN:MAX (either may be left out) from the command line, as (func_name, limit) for Plan.check
+    """
+    func_name, _, limit = text.partition('=')
+    if not func_name or not limit:
+        raise argparse.ArgumentTypeError("{} isn't NAME=MAX or NAME=MIN:MAX".format(text))
+    try:
+        if ':' in limit:
+            low, high = limit.split(':', 1)
+            return func_name, (int(low) if low else None, int(high) if high else None)
+        return func_name, int(limit)
+    except ValueError:
+        raise argparse.ArgumentTypeError("{} isn't NAME=MAX or NAME=MIN:MAX".format(text))
+
+
+def send(socket_path, command='status', timeout=10):
+    """
+    Sends a command to a running daemon, returns its answer
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path)
+        client.sendall(command.encode('utf-8') + b'\n')
+        with client.makefile('r') as f:
+            return json.loads(f.readline())
+
+
+class StatusHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        daemon = self.server.sync_daemon
+        for line in self.rfile:
+            command = line.decode('utf-8').strip()
+            if command not in COMMANDS:
+                answer = {'error': "Unknown command {}, use one of {}".format(command, ", ".join(COMMANDS))}
+            else:
+                if command != 'status':
+                    daemon.request(command)
+                answer = daemon.status()
+            self.wfile.write(json.dumps(answer, default=str).encode('utf-8') + b'\n')
+
+
+class StatusServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class SyncDaemon:
+
+    def __init__(self, source, dest, interval=300, socket_path=None, max_rss=None, limits=None, watch=(), tree_kwargs=None, query_socket=None, socket_mode=0o600):
+        """
+        source, dest: the tree classes, or import specifiers for them
+        interval: seconds between the start of one cycle and the next
+        max_rss: bytes, see module docstring
+        limits: passed to Plan.check before each >>
+        watch: more files whose change should reload the daemon
+        tree_kwargs: passed to both trees (ie cache, ordered)
+        query_socket: path of the socket to serve queries about the trees on, see dss.query
+        socket_mode: permissions of both sockets
+        """
+        self.source_class, self.dest_class = load(source), load(dest)
+        self.interval = interval
+        self.socket_path = socket_path
+        self.max_rss = max_rss
+        self.limits = limits
+        self.extra_watch = list(watch)
+        self.tree_kwargs = tree_kwargs or {}
+        self.query_socket = query_socket
+        self.socket_mode = socket_mode
+        self.query = None
+
+        self.source = self.source_class(**self.tree_kwargs)
+        self.dest = self.dest_class(**self.tree_kwargs)
+        self.watched = self.watched_files()
+
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+        self.pending = None      # 'reload' or 'stop'
+        self.server = None
+        self.info = {
+            'pid': os.getpid(),
+            'started': time.time(),
+            'cycles': 0,
+            'state': 'starting',
+            'last_cycle': None,
+            'last_duration': None,
+            'last_refreshed': None,
+            'last_error': None,
+            'pruned': 0,
+        }
+
+    def watched_files(self):
+        """
+        {path: mtime} of the modules that the trees, their branches, models and importers come from
+        """
+        modules = set()
+        for tree in (self.source, self.dest):
+            modules.add(tree.__class__.__module__)
+            for branch in tree.branches:
+                modules.add(branch.__module__)
+                if branch.klass is not None:
+                    modules.add(branch.klass.__module__)
+                importer = getattr(branch, '_importer', None)
+                if importer:
+                    modules.add(split_import_specifier(importer)[0])
+        paths = [getattr(sys.modules.get(name), '__file__', None) for name in modules] + self.extra_watch
+        watched = {}
+        for path in paths:
+            if path and os.path.exists(path):
+                watched[path] = os.stat(path).st_mtime
+        return watched
+
+    def code_changed(self):
+        for path, mtime in self.watched.items():
+            try:
+                if os.stat(path).st_mtime != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def request(self, command):
+        """
+        Called from the socket (and signals): refresh wakes the loop now, reload and stop happen after the cycle
+        """
+        with self.lock:
+            if command in ('reload', 'stop') and self.pending != 'stop':
+                self.pending = command
+        self.wake.set()
+
+    def status(self):
+        with self.lock:
+            info = dict(self.info)
+        info['rss'] = resident_memory()
+        info['pending'] = self.pending
+        info['branches'] = {
+            branch.fullname: len(branch.keys()) for tree in (self.source, self.dest) for branch in tree.branches
+        }
+        return info
+
+    def update(self, **kwargs):
+        with self.lock:
+            self.info.update(kwargs)
+
+    def cycle(self):
+        started = time.time()
+        self.update(state='refreshing')
+        refreshed = {
+            self.source.__class__.__name__: self.source.refresh(),
+            self.dest.__class__.__name__: self.dest.refresh(),
+        }
+        if self.query is not None:
+            self.query.publish(changed={
+                tree.__class__.__name__ + '.' + name for tree in (self.source, self.dest) for name in refreshed[tree.__class__.__name__]
+            })
+        if self.limits:
+            self.update(state='planning')
+            self.source.plan(self.dest).check(self.limits)
+        self.update(state='syncing')
+        self.source >> self.dest
+        self.update(state='idle', cycles=self.info['cycles'] + 1, last_cycle=started, last_duration=time.time() - started, last_refreshed=refreshed, last_error=None)
+
+    def check_memory(self):
+        if not self.max_rss or resident_memory() <= self.max_rss:
+            return
+        pruned = self.source.prune_storeobjects()
+        gc.collect()
+        self.update(pruned=self.info['pruned'] + pruned)
+        if resident_memory() > self.max_rss:
+            print("Using {} bytes, more than {}, restarting".format(resident_memory(), self.max_rss))
+            self.request('reload')
+
+    def serve(self):
+        if self.query_socket is not None:
+            self.query = QueryService([self.source, self.dest], self.query_socket, self.socket_mode).start()
+        if self.socket_path is None:
+            return
+        self.server = bind_unix_server(StatusServer, self.socket_path, StatusHandler, self.socket_mode)
+        self.server.sync_daemon = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def shutdown(self):
+        if self.query is not None:
+            self.query.stop()
+            self.query = None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.request('stop'))
+        signal.signal(signal.SIGHUP, lambda signum, frame: self.request('reload'))
+        self.serve()
+        try:
+            while True:
+                self.wake.clear()
+                try:
+                    self.cycle()
+                except Exception:
+                    traceback.print_exc()
+                    self.update(state='idle', last_error=traceback.format_exc())
+                self.check_memory()
+                if self.code_changed():
+                    print("Model code has changed, reloading")
+                    self.request('reload')
+                if self.pending is None:
+                    self.wake.wait(max(0, self.interval - (time.time() - self.info['last_cycle'] if self.info['last_cycle'] else 0)))
+                if self.pending is not None:
+                    break
+        except KeyboardInterrupt:
+            self.pending = 'stop'
+        finally:
+            self.update(state=self.pending or 'stopped')
+            self.shutdown()
+        if self.pending == 'reload':
+            self.reload()
+
+    @staticmethod
+    def reload():
+        sys.stdout.flush()
+        sys.stderr.flush()
+        argv = getattr(sys, 'orig_argv', None) or [sys.executable] + sys.argv
+        os.execv(sys.executable, [sys.executable] + argv[1:])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep a sync's trees in memory and sync them on a schedule")
+    parser.add_argument('source', nargs='?', help="import specifier of the source tree, ie mysync.Source")
+    parser.add_argument('dest', nargs='?', help="import specifier of the destination tree")
+    parser.add_argument('--interval', type=float, default=300, help="seconds between cycles")
+    parser.add_argument('--socket', dest='socket_path', help="path of the Unix socket for status and commands")
+    parser.add_argument('--max-rss-mb', type=float, help="restart when the process grows past this")
+    parser.add_argument('--watch', action='append', default=[], help="more files whose change reloads the daemon")
+    parser.add_argument('--query-socket', help="path of a Unix socket to serve queries about the trees on, see dss.query")
+    parser.add_argument('--cache', help="directory for the importer cache, see dss.importers.cache")
+    parser.add_argument('--limit', type=parse_limit, action='append', default=[], metavar='NAME=MAX|NAME=MIN:MAX',
+                        help="refuse the cycle if the plan has more (or fewer) actions with this func_name, can be given more than once")
+    parser.add_argument('--socket-mode', type=lambda text: int(text, 8), default=0o600, help="permissions of the sockets, in octal (default 600)")
+    parser.add_argument('--send', metavar='COMMAND', choices=COMMANDS, help="send a command to a running daemon at the socket given as the only argument")
+    args = parser.parse_args(argv)
+
+    if args.send:
+        print(json.dumps(send(args.source or args.socket_path, args.send), indent=2, default=str))
+        return
+    if not args.source or not args.dest:
+        parser.error("source and dest are required")
+
+    # so that the specifiers can refer to modules in the current directory, as with python -c
+    sys.path.insert(0, os.getcwd())
+    SyncDaemon(
+        args.source, args.dest,
+        interval=args.interval,
+        socket_path=args.socket_path,
+        max_rss=args.max_rss_mb * 1024 * 1024 if args.max_rss_mb else None,
+        limits=dict(args.limit) or None,
+        watch=args.watch,
+        tree_kwargs={'cache': args.cache} if args.cache else None,
+        query_socket=args.query_socket,
+        socket_mode=args.socket_mode,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
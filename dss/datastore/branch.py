@@ -9,14 +9,39 @@ Every object should have an 'idnumber', and every object is
 """
 
 from dss.utils import split_import_specifier
+from dss.datastore.snapshot import Overlay, copy_object
 import importlib
-import json
+import itertools
+from collections import defaultdict
+
+# numbers the snapshots so that each one has its own place in the datastore
+_snapshot_numbers = itertools.count(1)
+
+
+class RawRow(tuple):
+    """
+    Compact form of an imported row kept by lazy branches until the object is needed
+    row[0] is the column tuple shared by every row with the same columns, the rest are the values
+    """
+    __slots__ = ()
+
+    def kwargs(self):
+        return dict(zip(self[0], self[1:]))
+
 
 class DataStoreBranchMeta(type):
     displaynum = 3
 
     def __init__(cls, name, bases, attrs):
         klass = attrs.get('_klass')
+        # column tuples shared by the RawRows of a lazy branch
+        cls._columns = {}
+        # attribute -> {member: [objects]}, see containing
+        cls._member_indexes = {}
+        # attribute -> {idnumber: target idnumber(s)}, and target idnumber -> [(branch, attribute, idnumber)]
+        # filled in by DataStoreTree.resolve_references
+        cls._forward_references = {}
+        cls._reverse_references = defaultdict(list)
         if klass:
             # Doing this at this level means that it cannot be changed,
             # only delcarative methods are possible
@@ -55,8 +80,25 @@ class DataStoreBranchMeta(type):
 class DataStoreBranches(metaclass=DataStoreBranchMeta):
     """
     Branches are reponsible for making the instances, which by default does so by calling DataStoreBranches.make
+
+    Set _lazy = True on a branch to keep the imported rows in compact form, see make_later
+
+    Declare which attributes refer to objects in other branches of the same tree with _references:
+    _references = {'user': 'users', 'members': 'users'}
+    and the tree resolves them all once it has imported, see DataStoreTree.resolve_references
+
+    Declare the types of columns with _types, ie {'grade': int, 'groups': ('list', ',')}, see dss.datastore.converters
     """
     order = 10000
+    _lazy = False
+    _references = None
+
+    # Every subclass, in the order they are defined, which is how trees find their branches
+    _registry = []
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        DataStoreBranches._registry.append(cls)
 
     def __init__(self, idnumber):
         pass
@@ -76,6 +118,7 @@ class DataStoreBranches(metaclass=DataStoreBranchMeta):
 
     @classmethod
     def values(cls):
+        cls.materialize_all()
         return cls.store.values()
 
     @classmethod
@@ -84,12 +127,21 @@ class DataStoreBranches(metaclass=DataStoreBranchMeta):
 
     @classmethod
     def items(cls):
-        yield from cls.store.items()
+        yield from cls.iter_items()
 
     @classmethod
     def del_key(cls, key):
+        cls._member_indexes.clear()
         del cls.store[key]
 
+    @classmethod
+    def clear(cls):
+        """
+        Empty the branch, ie before it is imported again
+        """
+        cls._member_indexes.clear()
+        cls.store.clear()
+
     @classmethod
     def del_all_keys(cls, key):
         for key in cls.keys():
@@ -97,15 +149,22 @@ class DataStoreBranches(metaclass=DataStoreBranchMeta):
 
     @classmethod
     def iter(cls):
-        for key, value in cls.store.items():
+        for key, value in cls.iter_items():
             yield value
 
     @classmethod
     def iter_items(cls):
-        yield from cls.store.items()
+        if not cls._lazy:
+            yield from cls.store.items()
+            return
+        for key, value in cls.store.items():
+            if isinstance(value, RawRow):
+                value = cls.materialize(key, value)
+            yield key, value
 
     @classmethod
     def get_objects(cls):
+        cls.materialize_all()
         return cls.store.values()
 
     @classmethod
@@ -114,11 +173,24 @@ class DataStoreBranches(metaclass=DataStoreBranchMeta):
 
     @classmethod
     def get(cls, key):
-        return cls.store.get(key)
+        value = cls.store.get(key)
+        if cls._lazy and isinstance(value, RawRow):
+            return cls.materialize(key, value)
+        return value
 
     @classmethod
-    def get_from_attribute(cls, attr, value):
+    def scanned(cls):
+        """
+        The objects that get_from_attribute and friends look through,
+        without the stubs that only have an idnumber (see make_key_only), as they don't have the attributes
+        """
         for item in cls.get_objects():
+            if not getattr(item, '_key_only', False):
+                yield item
+
+    @classmethod
+    def get_from_attribute(cls, attr, value):
+        for item in cls.scanned():
             if getattr(item, attr) == value:
                 return item
         return None
@@ -130,21 +202,21 @@ class DataStoreBranches(metaclass=DataStoreBranchMeta):
     @classmethod
     def get_all_from_attribute(cls, attr, value):
         l = []
-        for item in cls.get_objects():
+        for item in cls.scanned():
             if getattr(item, attr) == value:
                 l.append(item)
         return l
 
     @classmethod
     def find_one_with_callback(cls, callback):
-        for item in cls.get_objects():
+        for item in cls.scanned():
             if callback(item):
                 return item
 
     @classmethod
     def find_many_with_callback(cls, callback):
         ret = []
-        for item in cls.get_objects():
+        for item in cls.scanned():
             if callback(item):
                 ret.append(item)
         return ret
@@ -155,8 +227,65 @@ class DataStoreBranches(metaclass=DataStoreBranchMeta):
             value._branchname = cls._branchname
         if not hasattr(value, '_origtreename'):
             value._origtreename = cls._treename
+        if cls._member_indexes:
+            cls._member_indexes.clear()
         cls.datastore[cls.fullname][key] = value
 
+    @classmethod
+    def peek(cls, key, attribute, default=None):
+        """
+        The attribute of object `key`, without making the object if the branch is lazy and it hasn't been made yet
+        """
+        value = cls.store.get(key)
+        if isinstance(value, RawRow):
+            return value.kwargs().get(attribute, default)
+        return getattr(value, attribute, default)
+
+    @classmethod
+    def referenced(cls, key, attribute):
+        """
+        The object(s) that `attribute` of object `key` refers to, as declared in _references
+        A list if the attribute holds several idnumbers, None for any that are dangling
+        """
+        target = cls._tree.branch(cls._references[attribute])
+        refs = cls._forward_references.get(attribute, {}).get(key)
+        if isinstance(refs, tuple):
+            return [target.get(ref) for ref in refs]
+        return target.get(refs)
+
+    @classmethod
+    def referrers(cls, key, branch=None, attribute=None):
+        """
+        The objects in other branches that refer to object `key` of this branch,
+        optionally only those from one branch, or through one attribute
+        """
+        ret = []
+        for from_branch, from_attribute, from_key in cls._reverse_references.get(key, ()):
+            if branch is not None and from_branch != branch:
+                continue
+            if attribute is not None and from_attribute != attribute:
+                continue
+            ret.append(cls._tree.branch(from_branch).get(from_key))
+        return ret
+
+    @classmethod
+    def containing(cls, attribute, member):
+        """
+        The objects in this branch whose list/set/Members `attribute` has `member` in it,
+        ie which groups is this user in: groups.containing('members', user.idnumber)
+
+        Uses an inverse index, member -> objects, made for the attribute on first use
+        and thrown away whenever the branch changes
+        """
+        index = cls._member_indexes.get(attribute)
+        if index is None:
+            index = defaultdict(list)
+            for obj in cls.scanned():
+                for each in getattr(obj, attribute, None) or ():
+                    index[each].append(obj)
+            cls._member_indexes[attribute] = index
+        return index.get(member, [])
+
     @classmethod
     def will_make_new(cls, new, *args, **kwargs):
         pass
@@ -228,3 +357,101 @@ class DataStoreBranches(metaclass=DataStoreBranchMeta):
             cls.will_return_old(old, **all_properties)
             return old
 
+    @classmethod
+    def snapshot(cls, treename=None, klass=None):
+        """
+        A copy-on-write copy of the branch: a subclass whose store is an Overlay of this one's,
+        so nothing is copied until it is written to, see dss.datastore.snapshot
+        treename: the name of the tree it is part of (DataStoreTree.snapshot passes its own)
+        klass: a model class that the objects are seen as in the snapshot, a copy of each is made as it is read
+        """
+        if treename is None:
+            treename = '{}Snapshot{}'.format(cls._treename, next(_snapshot_numbers))
+        snap = type(cls)(cls.__name__, (cls, ), {})
+        # it isn't a declared branch, so trees shouldn't pick it up
+        DataStoreBranches._registry.remove(snap)
+        snap.klass = klass or cls.klass
+        snap._treename = treename
+        snap._qualname = cls._qualname
+        snap._forward_references = cls._forward_references
+        snap._reverse_references = cls._reverse_references
+        view = None
+        if klass is not None:
+            def view(value):
+                return value if isinstance(value, RawRow) else copy_object(value, klass)
+        cls.datastore[snap.fullname] = Overlay(cls.store, view)
+        return snap
+
+    @classmethod
+    def modify(cls, key):
+        """
+        The object to make changes to: in a snapshot, a copy that only the snapshot has (made on first call)
+        Anywhere else the object itself
+        """
+        value = cls.get(key)
+        store = cls.store
+        if value is not None and isinstance(store, Overlay) and not store.owns(key):
+            value = copy_object(value)
+            cls.set_key(key, value)
+        return value
+
+    @classmethod
+    def make_key_only(cls, idnumber):
+        """
+        Stores an instance of klass that only has its idnumber, without calling __init__ or the hooks,
+        and without going through the dedup in `make`. See DataStoreTree.import_overlap
+        It is marked _key_only, and left out of get_from_attribute and friends, see scanned
+        """
+        obj = cls.klass.__new__(cls.klass)
+        obj.idnumber = idnumber
+        obj._key_only = True
+        cls.set_key(idnumber, obj)
+        return obj
+
+    @classmethod
+    def make_later(cls, idnumber, **kwargs):
+        """
+        Used by the tree instead of `make` when the branch is _lazy
+        Stores the row as a RawRow, against a column tuple shared by the branch,
+        and the klass instance is only made when get, iter (and friends) or the diff asks for it
+
+        Semantics in this mode:
+        Dedup against the objects already in the datastore happens when the object is materialised, not on import
+        will_make_new, did_make_new and will_return_old are called at that point too,
+        so rows that are never looked at never reach the hooks
+        A later row with the same idnumber replaces the earlier one, just as `make` does
+        """
+        if callable(idnumber):
+            idnumber = idnumber()
+        columns = tuple(kwargs)
+        columns = cls._columns.setdefault(columns, columns)
+        cls.datastore[cls.fullname][idnumber] = RawRow((columns,) + tuple(kwargs.values()))
+
+    @classmethod
+    def materialize(cls, idnumber, row):
+        """
+        Make the object from a RawRow with `make`, which puts it in place of the row
+        """
+        return cls.make(idnumber, **row.kwargs())
+
+    @classmethod
+    def materialize_all(cls):
+        if not cls._lazy:
+            return
+        for key, value in list(cls.store.items()):
+            if isinstance(value, RawRow):
+                cls.materialize(key, value)
+
+    @classmethod
+    def transient(cls, idnumber, row):
+        """
+        The object for a RawRow, to be looked at once and thrown away (see DataStoreTree.plan):
+        made without storing it, deduping it or calling the hooks, so the branch stays lazy
+        If the branch has hooks they might change the object, so then it is materialised after all
+        """
+        if cls.klass is None or any(getattr(cls, hook).__func__ is not getattr(DataStoreBranches, hook).__func__ for hook in ('will_make_new', 'did_make_new', 'will_return_old')):
+            return cls.materialize(idnumber, row)
+        obj = cls.klass(idnumber, **row.kwargs())
+        obj._branchname = cls._branchname
+        obj._origtreename = cls._treename
+        return obj
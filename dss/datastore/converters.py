@@ -0,0 +1,174 @@
+"""
+Declared column types, compiled into one function that converts each imported row
+
+class Students(OurBranches):
+    _types = {
+        'grade': int,
+        'enrolled': 'date',                      # ISO, or ('date', '%d/%m/%Y')
+        'kind': Kind,                            # an Enum, by value or by name
+        'groups': ('list', ','),                 # split on the delimiter, blanks dropped
+        'courses': ('set', ';', int),            # and each member converted
+    }
+
+Also 'int', 'float', 'bool', 'datetime', str, float, bool, or any callable that takes the value.
+Values that already have the type (ie from a DB importer) are left alone, and blanks become None (or empty lists and sets).
+The tree runs the converter on every row after the kwargs_preprocessor, so the names are the model's attribute names,
+and the objects get typed values: a CSV tree and a DB tree declaring the same types compare equal
+instead of giving err_integrity actions, and properties don't have to convert strings every time they are read
+"""
+
+import datetime
+import enum
+
+TRUE = {'true', 't', 'yes', 'y', '1'}
+FALSE = {'false', 'f', 'no', 'n', '0', ''}
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _scalar(convert, kind):
+    def converter(value):
+        if isinstance(value, kind):
+            return value
+        if _blank(value):
+            return None
+        return convert(value.strip() if isinstance(value, str) else value)
+    return converter
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        lowered = value.lower()
+        if lowered in TRUE:
+            return True
+        if lowered in FALSE:
+            return False
+        raise ValueError("{!r} isn't a boolean".format(value))
+    return bool(value)
+
+
+def _to_enum(klass):
+    def convert(value):
+        try:
+            return klass(value)
+        except ValueError:
+            return klass[value]
+    return _scalar(convert, klass)
+
+
+def _to_date(date_format=None):
+    if date_format is None:
+        convert = datetime.date.fromisoformat
+    else:
+        def convert(value):
+            return datetime.datetime.strptime(value, date_format).date()
+
+    def converter(value):
+        if isinstance(value, datetime.datetime):
+            return value.date()
+        if isinstance(value, datetime.date):
+            return value
+        if _blank(value):
+            return None
+        return convert(value.strip())
+    return converter
+
+
+def _to_datetime(date_format=None):
+    if date_format is None:
+        convert = datetime.datetime.fromisoformat
+    else:
+        def convert(value):
+            return datetime.datetime.strptime(value, date_format)
+    return _scalar(convert, datetime.datetime)
+
+
+def _to_collection(collection, delimiter, member=None):
+    member = compile_type(member) if member is not None else None
+
+    def converter(value):
+        if isinstance(value, (list, set, tuple)):
+            values = value
+        elif _blank(value):
+            values = ()
+        else:
+            values = (each.strip() for each in value.split(delimiter))
+            values = [each for each in values if each]
+        if member is not None:
+            values = [member(each) for each in values]
+        return collection(values)
+    return converter
+
+
+def compile_type(spec):
+    """
+    The function that converts a single value according to its declared type
+    """
+    if spec is int or spec == 'int':
+        return _scalar(int, int)
+    if spec is float or spec == 'float':
+        return _scalar(float, float)
+    if spec is bool or spec == 'bool':
+        return _scalar(_to_bool, bool)
+    if spec is str or spec == 'str':
+        return lambda value: value if value is None or isinstance(value, str) else str(value)
+    if spec == 'date':
+        return _to_date()
+    if spec == 'datetime':
+        return _to_datetime()
+    if isinstance(spec, type) and issubclass(spec, enum.Enum):
+        return _to_enum(spec)
+    if isinstance(spec, tuple):
+        kind, args = spec[0], spec[1:]
+        if kind == 'date':
+            return _to_date(*args)
+        if kind == 'datetime':
+            return _to_datetime(*args)
+        if kind == 'list':
+            return _to_collection(list, *args)
+        if kind == 'set':
+            return _to_collection(set, *args)
+    if callable(spec):
+        return spec
+    raise ValueError("Unknown column type {!r}".format(spec))
+
+
+def compile_types(types):
+    """
+    One function that converts the declared columns of a row (a dict) in place and returns it
+    None if no types are declared
+    """
+    if not types:
+        return None
+    converters = tuple( (column, compile_type(spec)) for column, spec in types.items() )
+
+    def convert_row(row):
+        for column, converter in converters:
+            if column in row:
+                try:
+                    row[column] = converter(row[column])
+                except (ValueError, KeyError, TypeError) as error:
+                    raise ValueError("Can't convert {}={!r} of {} to the declared type: {}".format(column, row[column], row.get('idnumber'), error))
+        return row
+
+    return convert_row
+
+
+def compile_key(types):
+    """
+    The converter for the declared type of idnumber on its own, for the keys that importers give without the rest of the row
+    (readin_keys, readin_hashes), so they compare equal to the idnumbers of the imported objects. None if it isn't declared
+    """
+    if not types or 'idnumber' not in types:
+        return None
+    convert = compile_type(types['idnumber'])
+
+    def convert_key(key):
+        try:
+            return convert(key)
+        except (ValueError, KeyError, TypeError) as error:
+            raise ValueError("Can't convert idnumber {!r} to the declared type: {}".format(key, error))
+
+    return convert_key
@@ -0,0 +1,44 @@
+"""
+Estimates of how far two trees have drifted apart, from a deterministic sample of the idnumbers, see DataStoreTree.estimate_drift
+
+drift = Source().estimate_drift(Destination(), rate=0.02)
+for branch, estimates in drift.items():
+    print(branch, estimates['changed'])     # Estimate(count=412.0, low=371.5, high=456.2, exact=False)
+
+The sample is chosen by hashing the branch name and idnumber, so both trees (and every run) pick the same records
+"""
+
+import hashlib
+import math
+from collections import namedtuple
+
+Estimate = namedtuple("Estimate", ['count', 'low', 'high', 'exact'])
+
+
+def in_sample(branch_name, idnumber, rate):
+    """
+    Whether the record is in the sample of the branch, the same answer in any process and on any run
+    """
+    if rate >= 1:
+        return True
+    digest = hashlib.md5('{}\x1f{}'.format(branch_name, idnumber).encode('utf-8')).digest()
+    return int.from_bytes(digest[:4], 'big') < rate * 0x100000000
+
+
+def exact(count):
+    return Estimate(float(count), float(count), float(count), True)
+
+
+def estimate(hits, sampled, population, z=1.96):
+    """
+    Scales hits out of sampled records up to the population, with the Wilson score interval for the proportion
+    """
+    if sampled == 0:
+        return Estimate(0.0, 0.0, float(population), False)
+    if sampled >= population:
+        return exact(hits)
+    p = hits / sampled
+    denominator = 1 + z * z / sampled
+    centre = (p + z * z / (2 * sampled)) / denominator
+    half = z * math.sqrt(p * (1 - p) / sampled + z * z / (4 * sampled * sampled)) / denominator
+    return Estimate(p * population, max(0.0, centre - half) * population, min(1.0, centre + half) * population, False)
@@ -0,0 +1,177 @@
+"""
+Interning of the values of low-cardinality attributes, so that every object with homeroom '10B' holds the same string
+
+class Students(OurBranches):
+    _intern = ['homeroom', 'kind']       # these attributes of this branch
+    _intern_threshold = 500              # give up on an attribute once it has more distinct values than this
+
+class SIS(DataStoreTree):
+    _intern = True                       # every string attribute of every branch of the tree
+
+A branch's own _intern wins over the tree's. Each branch keeps a table per attribute of the values it has interned,
+and the values themselves come from a pool per attribute name that all the branches (and trees) share,
+so a source and a destination importing the same homeroom end up with the same object, and the diff's identity check
+finds them equal without comparing them. Values are only shared with values of the same type: 1, 1.0 and True stay apart.
+An attribute of a branch with more distinct values than the threshold isn't worth it, its table is dropped and its values
+are left alone from then on, for that branch only. A branch's tables go when the branch is removed (-tree),
+or when DataStoreTree.prune_storeobjects finds it isn't in the store any more, and with them the values of the pool that no other branch holds.
+Members of list and set values are interned too.
+
+A tree with its own Interner keeps its values to itself, ie so that they can be cleared between imports:
+
+class Scratch(DataStoreTree):
+    _interner = Interner()
+
+print(interning.interner) reports, per branch and attribute, how many values were replaced by one already held and the bytes that saved
+"""
+
+import sys
+
+DEFAULT_THRESHOLD = 1000
+
+
+class Interner:
+
+    def __init__(self):
+        # (branch, attribute) -> {(type, value): value}
+        self.tables = {}
+        self.disabled = set()
+        # attribute -> {(type, value): [value, number of tables that have it]}
+        self.pool = {}
+        # (branch, attribute) -> [values seen, values replaced, bytes saved]
+        self.stats = {}
+
+    def value(self, attribute, value, threshold=DEFAULT_THRESHOLD, branch=None):
+        """
+        The value held for this one, after adding it to the branch's table for the attribute if it's new there
+        branch: the fullname of the branch the value is from
+        """
+        table_key = (branch, attribute)
+        table = self.tables.get(table_key)
+        if table is None:
+            if table_key in self.disabled:
+                return value
+            table = self.tables[table_key] = {}
+        # by type as well, 1 == 1.0 == True but they aren't the same value
+        key = (type(value), value)
+        try:
+            existing = table.get(key)
+        except TypeError:
+            return value
+        stats = self.stats.get(table_key)
+        if stats is None:
+            stats = self.stats[table_key] = [0, 0, 0]
+        stats[0] += 1
+        if existing is None:
+            if len(table) >= threshold:
+                self.disabled.add(table_key)
+                self.drop(table_key)
+                return value
+            held = self.pool.setdefault(attribute, {}).get(key)
+            if held is None:
+                held = self.pool[attribute][key] = [value, 0]
+            held[1] += 1
+            existing = table[key] = held[0]
+        if existing is not value:
+            stats[1] += 1
+            stats[2] += sys.getsizeof(value)
+        return existing
+
+    def drop(self, table_key):
+        """
+        Remove a table, and the values of the pool that no other table has
+        """
+        pool = self.pool.get(table_key[1], {})
+        for key in self.tables.pop(table_key, ()):
+            held = pool[key]
+            held[1] -= 1
+            if not held[1]:
+                del pool[key]
+
+    def clear_branch(self, branch):
+        """
+        Forget the tables, the disabled attributes and the stats of the branch (fullname)
+        """
+        for table_key in [table_key for table_key in set(self.tables) | self.disabled | set(self.stats) if table_key[0] == branch]:
+            self.drop(table_key)
+            self.disabled.discard(table_key)
+            self.stats.pop(table_key, None)
+
+    def branches(self):
+        return set(table_key[0] for table_key in set(self.tables) | self.disabled | set(self.stats))
+
+    def row_function(self, attributes=None, threshold=DEFAULT_THRESHOLD, branch=None):
+        """
+        A function that interns the values of a row (a dict) in place and returns it
+        attributes: the attributes to intern, None for every attribute with a string value
+        branch: the fullname of the branch the rows are for
+        """
+        value = self.value
+        disabled = self.disabled
+
+        def intern_row(row):
+            for attribute in (row if attributes is None else attributes):
+                if attribute == 'idnumber' or (branch, attribute) in disabled or attribute not in row:
+                    continue
+                current = row[attribute]
+                if isinstance(current, list):
+                    row[attribute] = [value(attribute, each, threshold, branch) for each in current]
+                elif isinstance(current, set):
+                    row[attribute] = {value(attribute, each, threshold, branch) for each in current}
+                elif isinstance(current, str) or (attributes is not None and current is not None):
+                    row[attribute] = value(attribute, current, threshold, branch)
+            return row
+
+        return intern_row
+
+    def for_branch(self, tree, branch):
+        """
+        The row function for the branch, from the branch's _intern, or the tree's; None if neither declares it
+        """
+        declared = getattr(branch, '_intern', None)
+        owner = branch
+        if declared is None:
+            declared = getattr(tree, '_intern', None)
+            owner = tree
+        if not declared:
+            return None
+        threshold = getattr(owner, '_intern_threshold', DEFAULT_THRESHOLD)
+        return self.row_function(None if declared is True else list(declared), threshold, branch.fullname)
+
+    def saved_bytes(self):
+        return sum(stats[2] for stats in self.stats.values())
+
+    def report(self):
+        """
+        {(branch, attribute): {'distinct', 'seen', 'replaced', 'saved_bytes', 'disabled'}}
+        """
+        return {
+            table_key: {
+                'distinct': len(self.tables.get(table_key, ())),
+                'seen': seen,
+                'replaced': replaced,
+                'saved_bytes': saved,
+                'disabled': table_key in self.disabled,
+            }
+            for table_key, (seen, replaced, saved) in self.stats.items()
+        }
+
+    def clear(self):
+        self.tables.clear()
+        self.disabled.clear()
+        self.pool.clear()
+        self.stats.clear()
+
+    def __str__(self):
+        lines = ["Interning saved {} bytes".format(self.saved_bytes())]
+        for (branch, attribute), info in sorted(self.report().items(), key=lambda item: (str(item[0][0]), item[0][1])):
+            attribute = attribute if branch is None else "{}.{}".format(branch, attribute)
+            if info['disabled']:
+                lines.append("    {}: more distinct values than the threshold, not interned".format(attribute))
+            else:
+                lines.append("    {}: {} distinct values, {} of {} replaced, {} bytes saved".format(attribute, info['distinct'], info['replaced'], info['seen'], info['saved_bytes']))
+        return "\n".join(lines)
+
+
+# The one shared by every tree
+interner = Interner()
@@ -0,0 +1,270 @@
+"""
+Append-only journal of the actions that `>>` applies, so that a sync that dies halfway through can be resumed
+
+The journal is a JSONL file:
+{"object": 1, "idnumber": ..., ...}      each object the actions are about, once, before the first action that has it
+{"seq": 1, "action": {...}}              one line per action, all written before any is applied (the plan),
+                                         with its source and dest as the numbers of their object lines
+{"planned": 200000}                      the plan is complete
+{"seq": 1, "results": ["success"]}       what the template did with action 1: success, fail, not_implemented or deferred,
+                                         or skipped if it wasn't in the diff any more when the sync was resumed
+{"checkpoint": 500}                      everything before this line has been flushed and synced to disk
+
+A result is written after the template has been called, and synced to disk straight away if the template changed anything,
+so if the process dies in between, that one action will be applied again on resume.
+A line cut short by the crash is cut off before anything is appended to the journal
+"""
+
+import json
+import os
+import importlib
+from dss.utils import ActionItem, encode_object, split_import_specifier
+
+SUCCESS, FAIL, NOT_IMPLEMENTED, DEFERRED, SKIPPED = 'success', 'fail', 'not_implemented', 'deferred', 'skipped'
+
+
+class RecordedObject:
+    """
+    Stand-in for a model object when the journal is replayed without the trees,
+    has the tracked properties that were recorded when the action was planned
+    """
+
+    def __init__(self, idnumber, properties, branchname=None, origtreename=None):
+        self.__dict__.update(properties)
+        self.idnumber = idnumber
+        self._branchname = branchname
+        self._origtreename = origtreename
+
+    def __repr__(self):
+        return "<recorded {}.{}.get('{}')>".format(self._origtreename, self._branchname, self.idnumber)
+
+
+def _encode_object(obj):
+    if obj is None:
+        return None
+    # round trip so anything json can't handle is converted now, not when writing the line
+    return json.loads(encode_object(obj))
+
+
+def _decode_object(data):
+    if data is None:
+        return None
+    return RecordedObject(data['idnumber'], data['properties'], data['branch'], data['tree'])
+
+
+class ActionJournal:
+
+    def __init__(self, path, checkpoint_every=500):
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self._file = None
+        self._since_checkpoint = 0
+        self.read()
+
+    def entries(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # a line cut short by the crash
+                    return
+
+    def read(self):
+        """
+        Load what an earlier run left behind: whether the plan is complete and the results recorded so far
+        The actions themselves stay on disk and are streamed back by recorded_actions
+        """
+        self.planned = None
+        self.results = {}
+        for entry in self.entries():
+            if 'results' in entry:
+                self.results[entry['seq']] = entry['results']
+            elif 'planned' in entry:
+                self.planned = entry['planned']
+
+    def recorded_actions(self):
+        """
+        Yields (seq, recorded action) from the plan, with the source and dest as the recorded objects
+        """
+        objects = {}
+        for entry in self.entries():
+            if 'planned' in entry:
+                return
+            if 'object' in entry:
+                objects[entry.pop('object')] = entry
+            elif 'action' in entry:
+                recorded = entry['action']
+                for side in ('source', 'dest'):
+                    if isinstance(recorded[side], int):
+                        recorded[side] = objects[recorded[side]]
+                yield entry['seq'], recorded
+
+    @staticmethod
+    def key(recorded):
+        """
+        (branch name, idnumber) that the recorded action is about
+        """
+        obj = recorded['source'] or recorded['dest']
+        return obj['branch'], recorded['idnumber']
+
+    @property
+    def can_resume(self):
+        """
+        The plan was written out completely but not every action has a result yet
+        """
+        return self.planned is not None and len(self.results) < self.planned
+
+    def pending(self):
+        for seq, recorded in self.recorded_actions():
+            if seq not in self.results:
+                yield seq, recorded
+
+    def planned_messages(self, keys):
+        """
+        {(branch name, idnumber): set of messages} that the plan has for these keys
+        """
+        planned = {key: set() for key in keys}
+        for seq, recorded in self.recorded_actions():
+            messages = planned.get(self.key(recorded))
+            if messages is not None:
+                messages.add(recorded['message'])
+        return planned
+
+    def _write(self, entry):
+        # default=str for any attribute value json doesn't know about
+        self._file.write(json.dumps(entry, default=str) + '\n')
+
+    def open(self, fresh):
+        if fresh:
+            self.planned = None
+            self.results = {}
+        else:
+            self.truncate_torn_line()
+        self._file = open(self.path, 'w' if fresh else 'a')
+
+    def truncate_torn_line(self):
+        """
+        Cut off a last line that the crash left without its newline, so that what is appended starts on a line of its own
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            end = position = f.seek(0, os.SEEK_END)
+            keep = 0
+            while position > 0:
+                start = max(0, position - 4096)
+                f.seek(start)
+                newline = f.read(position - start).rfind(b'\n')
+                if newline != -1:
+                    keep = start + newline + 1
+                    break
+                position = start
+            if keep != end:
+                f.truncate(keep)
+
+    def close(self):
+        if self._file is not None:
+            self.checkpoint()
+            self._file.close()
+            self._file = None
+
+    def checkpoint(self):
+        last = max(self.results) if self.results else 0
+        self._write({'checkpoint': last})
+        self.sync()
+        self._since_checkpoint = 0
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def plan(self, actions):
+        """
+        Write out every action, then the marker saying the plan is complete
+        Each object is written once, however many actions it has (ie one per member of a membership attribute)
+        """
+        seq = 0
+        # id(obj) -> number of its object line, and the objects themselves so that no id is used again while planning
+        numbers = {}
+        held = []
+
+        def number(obj):
+            if obj is None:
+                return None
+            ref = numbers.get(id(obj))
+            if ref is None:
+                ref = numbers[id(obj)] = len(numbers) + 1
+                held.append(obj)
+                entry = {'object': ref}
+                entry.update(_encode_object(obj))
+                self._write(entry)
+            return ref
+
+        for action in actions:
+            seq += 1
+            recorded = {
+                'idnumber': action.idnumber,
+                'attribute': action.attribute,
+                'message': action.message,
+                'func_name': action.func_name,
+                'error': action.error,
+                'source': number(action.source),
+                'dest': number(action.dest),
+            }
+            self._write({'seq': seq, 'action': recorded})
+        self.planned = seq
+        self._write({'planned': seq})
+        self.checkpoint()
+
+    def record(self, seq, results):
+        """
+        Synced to disk at once if the template changed something (success), as applying that action again might not be harmless
+        The other outcomes are synced with the next checkpoint
+        """
+        self.results[seq] = results
+        self._write({'seq': seq, 'results': results})
+        self._since_checkpoint += 1
+        if self._since_checkpoint >= self.checkpoint_every:
+            self.checkpoint()
+        elif SUCCESS in results:
+            self.sync()
+
+    def record_many(self, recorded):
+        """
+        [(seq, results), ...] all written, then synced to disk once
+        """
+        for seq, results in recorded:
+            self.results[seq] = results
+            self._write({'seq': seq, 'results': results})
+        self.checkpoint()
+
+    def action(self, recorded, this_tree=None, that_tree=None):
+        """
+        Rebuild a recorded action, with the live objects from the trees if given, otherwise with RecordedObjects
+        """
+        source, dest = recorded['source'], recorded['dest']
+        if this_tree is not None and that_tree is not None:
+            if source is not None:
+                source = this_tree.branch(source['branch']).get(source['idnumber'])
+            if dest is not None:
+                dest = that_tree.branch(dest['branch']).get(dest['idnumber'])
+        else:
+            source, dest = _decode_object(source), _decode_object(dest)
+        return ActionItem(recorded['idnumber'], source, dest, recorded['attribute'], recorded['message'], recorded['func_name'], recorded['error'])
+
+    def replay(self, template, pending_only=False):
+        """
+        Run a template over the journal on its own, no trees needed
+        template is a template class (or an import specifier string for one)
+        """
+        if isinstance(template, str):
+            mod, clss = split_import_specifier(template)
+            template = getattr(importlib.import_module(mod), clss)
+        template = template()
+        recorded_actions = self.pending() if pending_only else self.recorded_actions()
+        for seq, recorded in recorded_actions:
+            action = self.action(recorded)
+            yield action, template(action)
@@ -0,0 +1,78 @@
+"""
+Count-only plan of what `left >> right` would do, see DataStoreTree.plan
+
+plan = left.plan(right, samples=5)
+print(plan)
+plan.check({'new_students': 500, 'old_students': 50, 'update_username': (0, 1000)})   # raises PlanOutOfRange
+left >> right
+
+The plan compares as much as the diff does, so it costs nearly as much, see DataStoreTree.plan
+"""
+
+from collections import OrderedDict, Counter
+
+
+class PlanOutOfRange(Exception):
+    pass
+
+
+class Plan:
+
+    def __init__(self, samples=0):
+        # branch -> Counter of func_name -> how many actions
+        self.counts = OrderedDict()
+        # branch -> func_name -> the first few idnumbers
+        self.samples = OrderedDict()
+        self.sample_size = samples
+
+    def add(self, branch, counts):
+        """
+        counts is a Counter of func_name -> how many for the branch
+        """
+        self.counts.setdefault(branch, Counter()).update(counts)
+        self.samples.setdefault(branch, {})
+
+    def sample(self, branch, func_name, idnumber):
+        sample = self.samples.setdefault(branch, {}).setdefault(func_name, [])
+        if len(sample) < self.sample_size and idnumber not in sample:
+            sample.append(idnumber)
+
+    def totals(self):
+        """
+        Counter of func_name -> how many, across the branches
+        """
+        totals = Counter()
+        for counts in self.counts.values():
+            totals.update(counts)
+        return totals
+
+    def __getitem__(self, func_name):
+        return self.totals()[func_name]
+
+    def check(self, limits):
+        """
+        Raise PlanOutOfRange if any count is out of range
+        limits is {func_name: maximum} or {func_name: (minimum, maximum)}, either may be None
+        """
+        totals = self.totals()
+        problems = []
+        for func_name, limit in limits.items():
+            low, high = limit if isinstance(limit, tuple) else (None, limit)
+            count = totals[func_name]
+            if (low is not None and count < low) or (high is not None and count > high):
+                problems.append("{}: {} not in range {}..{}".format(func_name, count, low, high))
+        if problems:
+            raise PlanOutOfRange("Plan out of range, " + "; ".join(problems))
+        return self
+
+    def __str__(self):
+        lines = []
+        for branch, counts in self.counts.items():
+            lines.append("{}:".format(branch))
+            for func_name, count in sorted(counts.items()):
+                sample = self.samples[branch].get(func_name)
+                lines.append("    {}: {}{}".format(func_name, count, " (eg {})".format(", ".join(str(s) for s in sample)) if sample else ''))
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return "<Plan {}>".format(dict(self.totals()))
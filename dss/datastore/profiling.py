@@ -0,0 +1,237 @@
+"""
+Opt-in profiling of a sync, to find out which preprocessor, derived property or template handler a slow run spends its time in
+
+tree = SIS(profile='/tmp/sis.collapsed')        # or DSS_PROFILE=/tmp/sis.collapsed in the environment
++tree
+tree >> dest                                    # print(tree.profiler) for the slowest records so far
+
+While the tree imports (+), diffs (-) or applies a template (>>), a thread samples the stack of the thread doing it
+every interval seconds. The samples are written to the path in collapsed form, one "frame;frame;frame count" per line,
+which flamegraph.pl, speedscope and the like read as they are. The root frame of each stack is the section it was taken in,
+ie "import SIS", "diff SIS-Dest" or "apply SIS-Dest".
+
+Each preprocessed row, made object, diffed object and template call is also timed,
+and the top slowest of them are kept with their idnumber, branch and handler:
+the kwargs_preprocessor, the model class, or the template's method.
+DSS_PROFILE_INTERVAL and DSS_PROFILE_TOP set those two from the environment
+"""
+
+import functools
+import heapq
+import inspect
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter, namedtuple
+
+ENV = 'DSS_PROFILE'
+
+# path -> Profiler, so that the trees of a sync write their samples to the same file
+_profilers = {}
+
+SlowRecord = namedtuple('SlowRecord', ['seconds', 'kind', 'branch', 'idnumber', 'handler'])
+
+
+def frame_name(code):
+    return "{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class Profiler:
+
+    def __init__(self, path=None, interval=0.005, top=20):
+        """
+        path: where the collapsed stacks are written when the outermost section ends, None to only keep them
+        interval: seconds between samples
+        top: how many of the slowest records of each kind (preprocess, make, diff, apply) to keep
+        """
+        self.path = path
+        self.interval = interval
+        self.top = top
+        self.stacks = Counter()
+        self.samples = 0
+        # kind -> heap of (seconds, seq, SlowRecord), the fastest of the kept ones first
+        self.slowest = {}
+        # kind -> the time a record has to beat to be kept
+        self.floors = {}
+        self._seq = itertools.count()
+        self.sections = []
+        self.target = None
+        self.thread = None
+        self.stopping = threading.Event()
+
+    @classmethod
+    def from_environment(cls, profile=None):
+        """
+        The profiler for a tree's profile argument: a Profiler, a path, True (keep, don't write), or None for the environment's
+        Trees given the same path share one. Returns None if profiling isn't asked for
+        """
+        if isinstance(profile, cls):
+            return profile
+        if profile is None:
+            profile = os.environ.get(ENV) or None
+            if profile is None:
+                return None
+        if profile is False:
+            return None
+        path = None if profile is True else profile
+        profiler = _profilers.get(path) if path is not None else None
+        if profiler is None:
+            profiler = cls(
+                path=path,
+                interval=float(os.environ.get(ENV + '_INTERVAL', 0.005)),
+                top=int(os.environ.get(ENV + '_TOP', 20)),
+            )
+            if path is not None:
+                _profilers[path] = profiler
+        return profiler
+
+    def section(self, label):
+        return _Section(self, label)
+
+    def enter(self, label):
+        self.sections.append(label)
+        if len(self.sections) == 1:
+            self.target = threading.get_ident()
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.sample, name='dss-profiler', daemon=True)
+            self.thread.start()
+
+    def exit(self):
+        label = self.sections.pop()
+        if not self.sections:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+            if self.path is not None:
+                self.write(self.path)
+            print("Profile after {}: {}".format(label, self))
+
+    def sample(self):
+        target, stacks, interval = self.target, self.stacks, self.interval
+        names = {}
+        while not self.stopping.wait(interval):
+            frame = sys._current_frames().get(target)
+            sections = self.sections
+            if frame is None or not sections:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                name = names.get(code)
+                if name is None:
+                    name = names[code] = frame_name(code)
+                stack.append(name)
+                frame = frame.f_back
+            stack.append(sections[0])
+            stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            del frame
+
+    def record(self, seconds, kind, branch, idnumber, handler):
+        """
+        Keep this one if it's among the top slowest of its kind
+        """
+        if seconds <= self.floors.get(kind, 0.0):
+            return
+        slowest = self.slowest.setdefault(kind, [])
+        entry = (seconds, next(self._seq), SlowRecord(seconds, kind, branch, idnumber, handler))
+        if len(slowest) < self.top:
+            heapq.heappush(slowest, entry)
+        else:
+            heapq.heapreplace(slowest, entry)
+        if len(slowest) >= self.top:
+            self.floors[kind] = slowest[0][0]
+
+    def timed(self, func, kind, branch, handler=None):
+        """
+        func wrapped so that each call is recorded, with the idnumber of what it returns or its one argument (a row or an action)
+        handler: the name recorded, defaults to func's
+        """
+        perf_counter, record = time.perf_counter, self.record
+        handler = handler or getattr(func, '__qualname__', repr(func))
+
+        def timed_func(arg):
+            started = perf_counter()
+            ret = func(arg)
+            seconds = perf_counter() - started
+            found = ret if isinstance(ret, dict) and 'idnumber' in ret else arg
+            record(seconds, kind, branch, found.get('idnumber') if isinstance(found, dict) else getattr(found, 'idnumber', None), handler)
+            return ret
+
+        return timed_func
+
+    def slowest_records(self, kind=None):
+        """
+        The slowest records kept, of one kind or all of them, slowest first
+        """
+        entries = self.slowest.get(kind, []) if kind is not None else [entry for heap in self.slowest.values() for entry in heap]
+        return [entry[2] for entry in sorted(entries, reverse=True)]
+
+    def collapsed(self):
+        return "".join("{} {}\n".format(stack, count) for stack, count in sorted(self.stacks.items()))
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            f.write(self.collapsed())
+
+    def clear(self):
+        self.stacks.clear()
+        self.samples = 0
+        self.slowest.clear()
+        self.floors.clear()
+
+    def __str__(self):
+        lines = ["{} samples every {}s{}".format(self.samples, self.interval, ", written to {}".format(self.path) if self.path else "")]
+        for kind in sorted(self.slowest):
+            lines.append("Slowest {}:".format(kind))
+            for record in self.slowest_records(kind):
+                lines.append("    {:.6f}s {} {} {}".format(record.seconds, record.branch, record.idnumber, record.handler))
+        return "\n".join(lines)
+
+
+class _Section:
+
+    def __init__(self, profiler, label):
+        self.profiler = profiler
+        self.label = label
+
+    def __enter__(self):
+        self.profiler.enter(self.label)
+        return self.profiler
+
+    def __exit__(self, *exc_info):
+        self.profiler.exit()
+        return False
+
+
+def _in_section(profiler, label, generator):
+    with profiler.section(label):
+        yield from generator
+
+
+def profiled(kind):
+    """
+    Decorates the tree methods that are profiled as a section, when the tree has a profiler:
+    the label is kind and the names of the trees, ie "diff SIS-Dest"
+    Generators are profiled until they are exhausted
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = getattr(self, 'profiler', None)
+            if profiler is None:
+                return method(self, *args, **kwargs)
+            names = [self.__class__.__name__]
+            if args:
+                others = args[0] if isinstance(args[0], (list, tuple)) else [args[0]]
+                names.append(",".join(other.__class__.__name__ for other in others))
+            label = "{} {}".format(kind, "-".join(names))
+            if generator:
+                return _in_section(profiler, label, method(self, *args, **kwargs))
+            with profiler.section(label):
+                return method(self, *args, **kwargs)
+        generator = inspect.isgeneratorfunction(method)
+        return wrapper
+    return decorator
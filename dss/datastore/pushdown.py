@@ -0,0 +1,201 @@
+"""
+Declarative filter and projection that importers can push down to where the rows come from
+
+Declared on the branch (and, for the predicates, on the tree, where they apply to every branch):
+
+class Students(OurBranches):
+    _fields = ['idnumber', 'firstname', 'lastname', 'homeroom']   # the columns we need, None for all
+    _where = [('kind', '==', 'student'), ('homeroom', 'in', ['10A', '10B'])]
+
+Fields and predicates refer to the columns as the importer reads them, before any kwargs_preprocessor.
+DBImporter turns them into the column list and a WHERE clause, CSVImporter drops rows before making dicts,
+and for any other importer the tree applies them to the rows as they come in.
+The importers apply the predicates when they read just the keys or hashes as well (readin_keys, readin_hashes).
+Text values (ie from a CSV) are compared the way the database would: against a number they are compared as numbers.
+Predicates and fields on columns that the rows don't have raise ValueError rather than quietly dropping everything.
+The importer's filter_out is still there for anything that can't be said this way.
+"""
+
+import datetime
+import operator
+
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda value, values: value in values,
+    'not in': lambda value, values: value not in values,
+}
+
+
+def _blank_to_none(text):
+    return text if text.strip() else None
+
+
+def _to_number(text):
+    if not text.strip():
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def _coercion(value):
+    """
+    How a text cell is converted before it is compared with the predicate's value (or the members of it for in),
+    None if it is compared as it is. Blank cells are NULL when compared with None, numbers or dates
+    """
+    if value is None:
+        return _blank_to_none
+    if isinstance(value, (list, tuple, set, frozenset)):
+        value = next(iter(value), None)
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return _to_number
+    if isinstance(value, datetime.datetime):
+        return lambda text: datetime.datetime.fromisoformat(text) if text.strip() else None
+    if isinstance(value, datetime.date):
+        return lambda text: datetime.date.fromisoformat(text) if text.strip() else None
+    return None
+
+
+def _test(test, value, coerce):
+    """
+    The predicate as a function of the cell: False if the cell can't be compared (text that isn't a number),
+    or is NULL and the value isn't None, as in SQL
+    """
+    def check(cell):
+        if coerce is not None and type(cell) is str:
+            try:
+                cell = coerce(cell)
+            except ValueError:
+                return False
+        if cell is None and value is not None:
+            return False
+        try:
+            return test(cell, value)
+        except TypeError:
+            # ie None < 5
+            return False
+    return check
+
+
+SQL_OPERATORS = {'==': '=', '!=': '<>', '<': '<', '<=': '<=', '>': '>', '>=': '>=', 'in': 'IN', 'not in': 'NOT IN'}
+
+
+class Pushdown:
+
+    def __init__(self, fields=None, where=()):
+        self.fields = list(fields) if fields else None
+        self.where = []
+        # (field, the predicate as a function of the cell)
+        self.tests = []
+        for field, op, value in where:
+            if op not in OPERATORS:
+                raise ValueError("Unknown operator {} in predicate on {}, use one of {}".format(op, field, ", ".join(OPERATORS)))
+            self.where.append( (field, op, value) )
+            self.tests.append( (field, _test(OPERATORS[op], value, _coercion(value))) )
+        self._checked = False
+
+    @classmethod
+    def for_branch(cls, tree, branch):
+        """
+        The pushdown for the branch, from its _fields and _where and the tree's _where, None if nothing is declared
+        """
+        fields = getattr(branch, '_fields', None)
+        where = list(getattr(tree, '_where', None) or ()) + list(getattr(branch, '_where', None) or ())
+        if not fields and not where:
+            return None
+        return cls(fields, where)
+
+    def __repr__(self):
+        return "<Pushdown fields={} where={}>".format(self.fields, self.where)
+
+    def unknown_fields(self, columns):
+        """
+        Raises ValueError if the predicates or fields refer to columns that aren't among these
+        """
+        declared = [field for field, _, _ in self.where] + (self.fields or [])
+        unknown = [field for field in declared if field not in columns]
+        if unknown:
+            raise ValueError("Pushdown on {}, which the rows don't have (they have {})".format(", ".join(sorted(set(unknown))), ", ".join(columns)))
+
+    def matches(self, row):
+        if not self._checked:
+            # the first row says what the columns are
+            self.unknown_fields(list(row))
+            self._checked = True
+        for field, test in self.tests:
+            if not test(row.get(field)):
+                return False
+        return True
+
+    def project(self, row):
+        if self.fields is None:
+            return row
+        return {field: row[field] for field in self.fields if field in row}
+
+    def check(self, columns):
+        """
+        A function that takes a row as a list (ie from csv.reader) with these columns and says whether it matches
+        """
+        self.unknown_fields(columns)
+        checks = [(columns.index(field), test) for field, test in self.tests]
+
+        def matches(values):
+            for index, test in checks:
+                if not test(values[index] if index < len(values) else None):
+                    return False
+            return True
+
+        return matches
+
+    def compile(self, columns):
+        """
+        A function that takes a row as a list (ie from csv.reader) with these columns,
+        and returns the projected dict if the row matches, None if it doesn't
+        """
+        matches = self.check(columns)
+        if self.fields is None:
+            keep = list(enumerate(columns))
+        else:
+            keep = [(columns.index(field), field) for field in self.fields]
+
+        def convert(values):
+            if not matches(values):
+                return None
+            return {field: values[index] if index < len(values) else None for index, field in keep}
+
+        return convert
+
+    def sql(self):
+        """
+        (column list, WHERE clause or '', params) for a SELECT
+        """
+        columns = ", ".join(self.fields) if self.fields else '*'
+        clauses = []
+        params = {}
+        for field, op, value in self.where:
+            if op in ('in', 'not in') and not value:
+                # IN () isn't valid SQL
+                clauses.append('1 = 0' if op == 'in' else '1 = 1')
+            elif op in ('in', 'not in'):
+                names = []
+                for each in value:
+                    name = 'w{}'.format(len(params))
+                    params[name] = each
+                    names.append(':' + name)
+                clauses.append("{} {} ({})".format(field, SQL_OPERATORS[op], ", ".join(names)))
+            elif value is None and op in ('==', '!='):
+                clauses.append("{} {}".format(field, 'IS NULL' if op == '==' else 'IS NOT NULL'))
+            else:
+                name = 'w{}'.format(len(params))
+                params[name] = value
+                clauses.append("{} {} :{}".format(field, SQL_OPERATORS[op], name))
+        where = " WHERE " + " AND ".join(clauses) if clauses else ''
+        return columns, where, params
@@ -0,0 +1,90 @@
+"""
+Copy-on-write views of branch stores, see DataStoreBranches.snapshot and DataStoreTree.snapshot
+
+what_if = left.snapshot(klass={'students': NewLeftStudent})   # students seen as NewLeftStudent, with a new username rule
+student = what_if.teachers.modify('1111')         # a copy of the object, only in the snapshot
+student.lastname = 'Smith'
+what_if > right                                   # diffs like any tree, left itself is untouched
+-what_if                                          # drop the snapshot's stores
+
+Making a snapshot doesn't copy anything: the overlay reads through to the store it was made from,
+and only what is written to it (set_key, del_key, modify, make) is kept in the overlay.
+Writes to the original store after the snapshot was made are seen through it, unless the snapshot has its own value
+"""
+
+from collections.abc import MutableMapping
+
+
+def copy_object(obj, klass=None):
+    """
+    Shallow copy of a model object, as an instance of klass if given, without calling __init__
+    The values kept by derived_property are not carried over
+    """
+    klass = klass or obj.__class__
+    new = klass.__new__(klass)
+    new.__dict__.update(obj.__dict__)
+    new.__dict__.pop('_derived', None)
+    return new
+
+
+class Overlay(MutableMapping):
+    """
+    Mapping over a base store (the OrderedDict of a branch) that keeps its own writes and deletions
+    With view, a function taking an object, what is read from the base is passed through it,
+    and the result is kept so that the same object comes back every time
+    """
+
+    def __init__(self, base, view=None):
+        self.base = base
+        self.view = view
+        self.changes = {}
+        self.deleted = set()
+
+    def __getitem__(self, key):
+        try:
+            return self.changes[key]
+        except KeyError:
+            pass
+        if key in self.deleted:
+            raise KeyError(key)
+        value = self.base[key]
+        if self.view is not None:
+            value = self.changes[key] = self.view(value)
+        return value
+
+    def __contains__(self, key):
+        return key in self.changes or (key not in self.deleted and key in self.base)
+
+    def __setitem__(self, key, value):
+        self.deleted.discard(key)
+        self.changes[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.changes.pop(key, None)
+        if key in self.base:
+            self.deleted.add(key)
+
+    def __iter__(self):
+        # the base's order, then whatever was added in the overlay
+        deleted = self.deleted
+        for key in self.base:
+            if key not in deleted:
+                yield key
+        for key in list(self.changes):
+            if key not in self.base:
+                yield key
+
+    def __len__(self):
+        deleted = len(self.deleted & self.base.keys()) if self.deleted else 0
+        return len(self.base) - deleted + sum(1 for key in self.changes if key not in self.base)
+
+    def owns(self, key):
+        """
+        Whether the value for key is the overlay's own, rather than read through from the base
+        """
+        return key in self.changes
+
+    def __repr__(self):
+        return "<Overlay of {} keys, {} changed, {} deleted>".format(len(self.base), len(self.changes), len(self.deleted))
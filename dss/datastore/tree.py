@@ -3,17 +3,60 @@ Defines DataStoreTree mechanism for core functionality of datastoresync
 It is responsible for keeping the store
 """
 
-import inspect, sys
-from collections import defaultdict, OrderedDict
+import sys
+import itertools
+import time
+from collections import defaultdict, OrderedDict, Counter
 import importlib
 import logging
-from dss.utils import split_import_specifier, define_action
+from dss.utils import split_import_specifier, define_action, external_sort, ExternalSorter, DanglingReference
+from dss.datastore.journal import ActionJournal, SUCCESS, FAIL, NOT_IMPLEMENTED, DEFERRED, SKIPPED
+from dss.datastore.pushdown import Pushdown
+from dss.datastore.converters import compile_types, compile_key
+from dss.datastore.interning import interner
+from dss.datastore.profiling import Profiler, profiled
+from dss.datastore.plan import Plan
+from dss.datastore.branch import RawRow
+from dss.datastore import drift
+from dss.importers.cache import ImportCache
+from dss.models.comparator import get_comparator, tracked_attributes
+from dss.models.base import Base
+from dss.templates.default_template import Deferred
 log = logging.getLogger(__name__)
 import re
 import os, pickle
+import multiprocessing
 
 verbose = False
 
+# The pair of trees being diffed by parallel_changed_keys, inherited by the forked workers
+# so that the store doesn't have to be pickled across to them
+_shard_trees = None
+
+def _changed_keys_in_shard(args):
+    """
+    Runs in a worker: goes through the keys common to both sides that belong to this shard
+    and returns, per branch, the set of keys whose objects have differences
+    """
+    shard, shards, branches = args
+    this_tree, that_tree = _shard_trees
+    changed = {}
+    for branch in branches:
+        this_branch = this_tree.branch(branch)
+        that_branch = that_tree.branch(branch)
+        keys = changed[branch] = set()
+        for item_key in this_branch.keys():
+            if hash(item_key) % shards != shard:
+                continue
+            this_item = this_branch.get(item_key)
+            that_item = that_branch.get(item_key)
+            if this_item and that_item and this_item is that_item:
+                continue
+            for action in this_item - that_item:
+                keys.add(item_key)
+                break
+    return changed
+
 class DataStoreTreeMeta(type):
 
     # The store is the actual instances that holds the data
@@ -57,35 +100,38 @@ class DataStoreTreeMeta(type):
             # Now that we have the raw information, we can go about making our branches,
             # Which we do by picking up subclasses of the classes that the developer indicated
 
-            # Cycle through all the classes that have been declared in this module, so we can augment
+            # Go through the branch classes that have been defined so far (they register themselves, see DataStoreBranches._registry)
+            # and pick up the subclasses of each declared class
             # LIMITATION: Classes have to be declared in the same module as the string name
             for mod, clss in cls._branches:
-                get_all_module_classes = inspect.getmembers(mod, inspect.isclass)
-                # Now go through all classes in this particular module
-                for class_name, class_reference in get_all_module_classes:
-                    branch_name = getattr(class_reference, '_branchname', class_reference.__name__)
-
-                    if class_reference is not clss:  # check to ensure our heuristic doesn't detect itself
-                        if issubclass(class_reference, clss): # now see if this object is subclass of class represented by `pickup`
-                            class_reference._treename = cls.__name__
-                            class_reference._tree = cls
-                            class_reference._qualname = branch_name
-                            setattr(cls, branch_name, class_reference)
-                            verbose and print("Setting attribute {} on {} to {}".format(branch_name, cls.__name__, class_reference.__name__))
-                        else:
-                            pass
-                    else:
+                for class_reference in clss._registry:
+                    if class_reference is clss or getattr(mod, class_reference.__name__, None) is not class_reference:
                         # detected itself, which will happen once per each branch
                         # this is by design incorrect, because branch classes are declared and then subclasses are picked up
-                        pass
+                        continue
+                    if issubclass(class_reference, clss): # now see if this object is subclass of class represented by `pickup`
+                        branch_name = getattr(class_reference, '_branchname', class_reference.__name__)
+                        class_reference._treename = cls.__name__
+                        class_reference._tree = cls
+                        class_reference._qualname = branch_name
+                        setattr(cls, branch_name, class_reference)
+                        verbose and print("Setting attribute {} on {} to {}".format(branch_name, cls.__name__, class_reference.__name__))
         # THIS IS NEW
         super().__init__(name, bases, attrs)
 
 class DataStoreTree(metaclass=DataStoreTreeMeta):
 
-    def __init__(self, do_import=False, read_from_disk=None, write_to_disk=None, filter_=None):
+    _snapshot_numbers = itertools.count(1)
+
+    def __init__(self, do_import=False, read_from_disk=None, write_to_disk=None, filter_=None, processes=None, ordered=False, sort_buffer=100000, journal=None, journal_checkpoint=500, cache=None, cache_max_bytes=512 * 1024 * 1024, profile=None):
         """
         Detects the sets up the declared template
+        processes: if more than 1, the diff compares objects in that many worker processes, see parallel_changed_keys
+        ordered: if True, the diff yields actions in a deterministic order, see ordered_sub
+        journal: path of a journal file that makes >> resumable, see journaled_rshift
+        cache: directory where the rows of importers that have a cache_key are kept, see dss.importers.cache
+        profile: path to write sampled stacks to while importing, diffing and applying, see dss.datastore.profiling
+                 (None to go by the DSS_PROFILE environment variable)
         """
         if hasattr(self, '_template'):
             self.set_template(self._template)
@@ -96,6 +142,16 @@ class DataStoreTree(metaclass=DataStoreTreeMeta):
         self.read_from_disk = read_from_disk
         self.write_to_disk = write_to_disk
         self.set_filter(filter_)
+        self.processes = processes
+        self.ordered = ordered
+        self.sort_buffer = sort_buffer
+        self.journal = journal
+        self.journal_checkpoint = journal_checkpoint
+        self.dangling_references = []
+        self.import_cache = ImportCache(cache, cache_max_bytes) if cache else None
+        # branch fullname -> the importer's cache_key when it was last imported, see refresh
+        self._refresh_tokens = {}
+        self.profiler = Profiler.from_environment(profile)
 
         return super().__init__()
 
@@ -191,33 +247,203 @@ class DataStoreTree(metaclass=DataStoreTreeMeta):
 
     exclude = ['output', 'wheel', 'exclude']
 
+    @profiled('apply')
     def __rshift__(self, other):   # >>
+        if isinstance(other, (list, tuple)):
+            return self.fanout(other)
         if not hasattr(other, '_template'):
             print("No template defined for me")
             return
+        if self.journal:
+            return self.journaled_rshift(other)
         template = other._template()
 
         not_implemented = set()
         for action in self - other:
-            if other._filter and len([1 for k in other._filter.keys() if getattr(action, k) == other._filter[k]]) == len(list(other._filter.keys())):
-                results = template(action)
+            self.apply(other, template, action, not_implemented)
+        self.finish_template(template)
+        print("Not implemented:\n{}".format(", ".join(list(not_implemented))))
+
+    @staticmethod
+    def finish_template(template):
+        finish = getattr(template, 'finish', None)
+        if finish is not None:
+            finish()
+        flush_sinks = getattr(template, 'flush_sinks', None)
+        if flush_sinks is not None:
+            flush_sinks()
+
+    def apply(self, other, template, action, not_implemented):
+        """
+        Call the template with the action and report the results to it
+        Returns the outcome of each result: success, fail or not_implemented,
+        or deferred for results the template reports itself later (Deferred, ie from a DBSink)
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            started = time.perf_counter()
+        if other._filter and len([1 for k in other._filter.keys() if getattr(action, k) == other._filter[k]]) == len(list(other._filter.keys())):
+            results = template(action)
+        else:
+            results = template(action)
+        if profiler is not None:
+            seconds = time.perf_counter() - started
+            if seconds > profiler.floors.get('apply', 0.0):
+                obj = action.source if action.source is not None else action.dest
+                branch = "{}.{}".format(other.__class__.__name__, getattr(obj, '_branchname', None))
+                profiler.record(seconds, 'apply', branch, action.idnumber, "{}.{}".format(type(template).__name__, action.func_name))
+        if not isinstance(results, list):
+            results = [results]
+        outcomes = []
+        for result in results:
+            if result is None:
+                not_implemented.add(action.func_name)
+                outcomes.append(NOT_IMPLEMENTED)
+            elif isinstance(result, Deferred):
+                outcomes.append(DEFERRED)
+            elif template.result_bool(result) is True:
+                template.success(action, result)
+                outcomes.append(SUCCESS)
             else:
-                results = template(action)
-            if not isinstance(results, list):
-                results = [results]
-            for result in results:
-                if result is None:
-                    not_implemented.add(action.func_name)
-                elif template.result_bool(result) is True:
-                    template.success(action, result)
+                template.fail(action, result)
+                outcomes.append(FAIL)
+        return outcomes
+
+    def fanout(self, others):
+        """
+        self >> [dest1, dest2, ...]: syncs to every destination in one walk of the source, see fanout_sub
+        Each destination's template gets that destination's actions, as with self >> dest
+        (the journal isn't used here)
+        """
+        dests = []
+        for other in others:
+            if not hasattr(other, '_template'):
+                print("No template defined for {}".format(other.__class__.__name__))
+                continue
+            dests.append( (other, other._template(), set()) )
+
+        for index, action in self.fanout_sub([other for other, _, _ in dests]):
+            other, template, not_implemented = dests[index]
+            self.apply(other, template, action, not_implemented)
+        for other, template, not_implemented in dests:
+            self.finish_template(template)
+            print("Not implemented for {}:\n{}".format(other.__class__.__name__, ", ".join(list(not_implemented))))
+
+    def fanout_sub(self, others):
+        """
+        self - other for each of others at once, yields (index of the other, action)
+        Each other gets the same actions in the same order as from self - other,
+        but each object of self is looked at once, and the values of its tracked attributes
+        (derived properties included) are read once, however many others it is diffed against
+        """
+        branches = self.sub_branch_names()
+        pairs = []
+        for branch in branches:
+            that_branches = [(index, other.branch(branch)) for index, other in enumerate(others)]
+            pairs.append( (branch, self.branch(branch), [(index, b) for index, b in that_branches if b is not None]) )
+
+        for branch, this_branch, that_branches in pairs:
+            this_keys = this_branch.keys()
+            for index, that_branch in that_branches:
+                for key in this_keys - that_branch.keys():
+                    yield index, define_action(key, this_branch.get(key), that_branch.get(key), 'idnumber', "new_{}(idnumber={})".format(branch, key), None)
+
+        for branch, this_branch, that_branches in pairs:
+            for key, this_item in this_branch.iter_items():
+                # attributes tuple -> the values, so they are read once for every destination
+                values = {}
+                for index, that_branch in that_branches:
+                    that_item = that_branch.get(key)
+                    if not that_item or this_item is that_item:
+                        continue
+                    if type(this_item).__sub__ is not Base.__sub__:
+                        # the model diffs itself its own way
+                        for action in this_item - that_item:
+                            yield index, action
+                        continue
+                    comparator = get_comparator(this_item, that_item)
+                    this_values = values.get(comparator.attributes)
+                    if this_values is None:
+                        this_values = values[comparator.attributes] = comparator.values(this_item)
+                    for action in comparator.diff_values(this_item, this_values, that_item):
+                        yield index, action
+
+        for branch, this_branch, that_branches in pairs:
+            this_keys = this_branch.keys()
+            for index, that_branch in that_branches:
+                for key in that_branch.keys() - this_keys:
+                    yield index, define_action(key, this_branch.get(key), that_branch.get(key), key, "old_{}(idnumber={})".format(branch, key), None)
+
+    def journaled_rshift(self, other):
+        """
+        >> that goes through the journal at self.journal (a path):
+        the diff is written out to the journal first, then each action is applied and its outcome recorded
+
+        If the journal holds a complete plan from an earlier run that didn't finish, and it still matches the trees,
+        the actions that already have an outcome are skipped and the rest are applied with the objects looked up in the (imported) trees
+        Only the keys that still have pending actions are compared again (see key_messages), not the whole trees:
+        pending actions that aren't in the diff of their key any more (already done, but the run stopped before it said so) are recorded as skipped,
+        and if the diff of one of those keys has actions the plan doesn't, the trees have changed since: the plan is thrown away and made again
+        Changes to keys the plan has nothing pending for are left to the next sync
+        """
+        template = other._template()
+        action_journal = ActionJournal(self.journal, self.journal_checkpoint)
+
+        messages = None
+        if action_journal.can_resume:
+            keys = set(action_journal.key(recorded) for seq, recorded in action_journal.pending())
+            planned = action_journal.planned_messages(keys)
+            messages = {key: self.key_messages(other, *key) for key in keys}
+            stale = [message for key in keys for message in messages[key] - planned[key]]
+            if stale:
+                print("The plan in {} doesn't match the trees any more ({} actions it doesn't have, eg {}), starting over".format(self.journal, len(stale), stale[0]))
+                messages = None
+        if messages is not None:
+            print("Resuming from {}, skipping {} applied actions".format(self.journal, len(action_journal.results)))
+            action_journal.open(fresh=False)
+        else:
+            action_journal.open(fresh=True)
+            action_journal.plan(self - other)
+
+        not_implemented = set()
+        # deferred outcomes are only recorded once the template has finished (flushed them),
+        # so that a run that stops before then applies them again when resumed
+        deferred = []
+        try:
+            for seq, recorded in action_journal.pending():
+                if messages is not None and recorded['message'] not in messages[action_journal.key(recorded)]:
+                    action_journal.record(seq, [SKIPPED])
+                    continue
+                action = action_journal.action(recorded, self, other)
+                outcomes = self.apply(other, template, action, not_implemented)
+                if DEFERRED in outcomes:
+                    deferred.append( (seq, outcomes) )
                 else:
-                    template.fail(action, result)
+                    action_journal.record(seq, outcomes)
+            self.finish_template(template)
+            action_journal.record_many(deferred)
+        finally:
+            action_journal.close()
         print("Not implemented:\n{}".format(", ".join(list(not_implemented))))
 
+    def key_messages(self, other, branch, key):
+        """
+        The set of messages of the actions that self - other has for one key of a branch
+        """
+        this_item = self.branch(branch).get(key)
+        that_item = other.branch(branch).get(key)
+        if this_item is None and that_item is None or this_item is that_item:
+            return set()
+        if that_item is None:
+            return {"new_{}(idnumber={})".format(branch, key)}
+        if this_item is None:
+            return {"old_{}(idnumber={})".format(branch, key)}
+        return {action.message for action in this_item - that_item}
 
     def __gt__(self, other):   # >
         self.wheel(other, template=lambda action: print(action.message))
 
+    @profiled('import')
     def __pos__(self):         # +
         """
         Cycles through the branches, discovering importers as we go:
@@ -230,6 +456,7 @@ class DataStoreTree(metaclass=DataStoreTreeMeta):
                 self.__class__._metastore._store = pickle.load(self.read_from_disk)
             else:
                 pass # already read in, no need, and results in segment fault if attempted again
+            self.resolve_references()
             return
 
         # Sort by order in order to ensure properties can be brought in
@@ -239,106 +466,476 @@ class DataStoreTree(metaclass=DataStoreTreeMeta):
         #
 
         for branch in branches:
-            importer_string = getattr(branch, '_importer', None)
-            verbose and print('Declared importer for {} branch of {} is "{}"'.format(branch.fullname, self.__class__.__name__, importer_string))
-            if importer_string is None:
-                # ensure we don't fail if there is no importer defined, just print a message for the moment
-                print('No importer?')
-                return
-            importer_mod_string, class_string = split_import_specifier(importer_string)
-            try:
-                importer_mod = importlib.import_module(importer_mod_string)
-            except ImportError:
-                raise ImportError("Datastore tried to import via string {} given by {} but failed.".format(importer_mod_string, class_string))
-            importer = getattr(importer_mod, class_string, None)
-            if not importer:
-                print("Importing defined by {} could not be imported".format(importer_string))
-            importer_inst = importer(self, branch)
-            verbose and print("Importer instance for {} branch of {}: {}...".format(branch.fullname, self.__class__.__name__, importer_inst._branch.fullname))
-            importer_inst._branchname = branch._branchname
+            importer_inst = self.importer_for(branch)
+            if importer_inst is None:
+                continue
+            self.import_branch(branch, importer_inst)
+
+        # Every order tier is in, so references between branches can be worked out
+        self.resolve_references()
+
+    def importer_for(self, branch):
+        """
+        Makes the instance of the importer declared on the branch
+        """
+        importer_string = getattr(branch, '_importer', None)
+        verbose and print('Declared importer for {} branch of {} is "{}"'.format(branch.fullname, self.__class__.__name__, importer_string))
+        if importer_string is None:
+            # ensure we don't fail if there is no importer defined, just print a message for the moment
+            print('No importer?')
+            return None
+        importer_mod_string, class_string = split_import_specifier(importer_string)
+        try:
+            importer_mod = importlib.import_module(importer_mod_string)
+        except ImportError:
+            raise ImportError("Datastore tried to import via string {} given by {} but failed.".format(importer_mod_string, class_string))
+        importer = getattr(importer_mod, class_string, None)
+        if not importer:
+            print("Importing defined by {} could not be imported".format(importer_string))
+        importer_inst = importer(self, branch)
+        verbose and print("Importer instance for {} branch of {}: {}...".format(branch.fullname, self.__class__.__name__, importer_inst._branch.fullname))
+        importer_inst._branchname = branch._branchname
+        importer_inst.pushdown = Pushdown.for_branch(self, branch)
+        importer_inst.converter = compile_types(getattr(branch, '_types', None))
+        importer_inst.key_converter = compile_key(getattr(branch, '_types', None))
+        return importer_inst
+
+    def import_branch(self, branch, importer_inst, only_keys=None, keep=None):
+        """
+        Reads in the rows from the importer and makes the objects
+        only_keys: if given, rows with other idnumbers are skipped,
+                   and the importer's readin_keys_subset is used to fetch just those if it can
+                   The importer gets them as its only_keys, as the source has them (see source_keys),
+                   unless it has a kwargs_preprocessor
+        keep: if given, a callable that takes the idnumber, rows it returns False for are skipped
+        """
+        importer_filter = getattr(importer_inst, 'filter_out', None)
+        kwargs_preprocessor = getattr(importer_inst, 'kwargs_preprocessor', None)
+        verbose and importer_filter and print("Detected importer filter")
+        verbose and kwargs_preprocessor and print("Detected kwargs preprocessor")
+        profiler = self.profiler
+        if profiler is not None and kwargs_preprocessor is not None:
+            kwargs_preprocessor = profiler.timed(kwargs_preprocessor, 'preprocess', branch.fullname)
+
+        # Readin from the importer, and 'make' the data objects as we go
+        # the built-in make method is smart about storing things correctly
+        # rows with list or set values are merged per idnumber first, see aggregate_rows
+        # Only whole imports are cached, not the subsets
+        cache_key = None
+        if self.import_cache is not None and only_keys is None and keep is None:
+            cache_key = getattr(importer_inst, 'cache_key', lambda: None)()
+        source = None
+        # a kwargs_preprocessor can change the idnumber, so then the rows can't be fetched by it
+        if only_keys is not None and kwargs_preprocessor is None:
+            source_keys = getattr(importer_inst, 'source_keys', None)
+            importer_inst.only_keys = set(source_keys.get(key, key) for key in only_keys) if source_keys else only_keys
+            readin_keys_subset = getattr(importer_inst, 'readin_keys_subset', None)
+            source = readin_keys_subset(importer_inst.only_keys) if readin_keys_subset else None
+        rows = self.read_rows(importer_inst, kwargs_preprocessor, source, cache_key)
+        # Values of the attributes declared in _intern are shared, see dss.datastore.interning
+        intern_row = getattr(self, '_interner', interner).for_branch(self, branch)
+        if intern_row is not None:
+            rows = map(intern_row, rows)
+        if only_keys is not None:
+            rows = (kwargs for kwargs in rows if kwargs['idnumber'] in only_keys)
+        if keep is not None:
+            rows = (kwargs for kwargs in rows if keep(kwargs['idnumber']))
+        if profiler is None:
+            for kwargs in self.aggregate_rows(importer_inst, rows):
+                self.make_them(branch, importer_filter, **kwargs)
+            return
+        handler = branch.klass.__name__ if branch.klass is not None else None
+        for kwargs in self.aggregate_rows(importer_inst, rows):
+            started = time.perf_counter()
+            self.make_them(branch, importer_filter, **kwargs)
+            profiler.record(time.perf_counter() - started, 'make', branch.fullname, kwargs['idnumber'], handler)
+
+    def read_keys(self, importer_inst):
+        """
+        The set of idnumbers that +self would make objects for from the importer, without making any, None if it can't give them
+        readin_keys gives them cheaply, but a kwargs_preprocessor or filter_out can change or drop rows in ways the keys don't show,
+        so for importers with either of those the rows are read in and put through them, just not made into objects
+        """
+        readin_keys = getattr(importer_inst, 'readin_keys', None)
+        if readin_keys is None:
+            return None
+        kwargs_preprocessor = getattr(importer_inst, 'kwargs_preprocessor', None)
+        importer_filter = getattr(importer_inst, 'filter_out', None)
+        if kwargs_preprocessor is None and importer_filter is None:
+            keys = readin_keys()
+            return set(self.convert_keys(importer_inst, keys)) if keys is not None else None
+        rows = self.aggregate_rows(importer_inst, self.read_rows(importer_inst, kwargs_preprocessor))
+        return set(kwargs['idnumber'] for kwargs in rows if importer_filter is None or not importer_filter(**kwargs))
+
+    def read_hashes(self, importer_inst):
+        """
+        [(idnumber, hash)] from the importer's readin_hashes, None if it can't give them
+        """
+        readin_hashes = getattr(importer_inst, 'readin_hashes', None)
+        hashes = readin_hashes() if readin_hashes else None
+        if hashes is None or importer_inst.key_converter is None:
+            return hashes
+        hashes = list(hashes)
+        keys = self.convert_keys(importer_inst, [key for key, _ in hashes])
+        return list(zip(keys, [hash_ for _, hash_ in hashes]))
+
+    @staticmethod
+    def convert_keys(importer_inst, keys):
+        """
+        The keys an importer gave on their own, converted to the declared type of idnumber the way the rows are (see key_converter)
+        Returns them as a list, and remembers what they were in the source in importer_inst.source_keys
+        """
+        convert = importer_inst.key_converter
+        if convert is None:
+            return list(keys)
+        source_keys = importer_inst.source_keys = {}
+        converted = []
+        for key in keys:
+            new = convert(key)
+            if new != key or type(new) is not type(key):
+                source_keys[new] = key
+            converted.append(new)
+        return converted
+
+    def import_overlap(self, other):
+        """
+        Alternative to +self when `other` has already been imported (ie +source; dest.import_overlap(source))
+
+        For branches whose importers offer readin_keys, the keys are read first, and only the records
+        whose keys are also in other's branch are imported in full; the importer sees these as its only_keys
+        and can use them to fetch less. Keys only on this side are stored as objects that have just the idnumber,
+        enough for the old_* actions, and keys only on other's side are new_* and don't need anything from here.
+        The keys are the ones the importer's kwargs_preprocessor and filter_out let through, see read_keys
+        Branches whose importers can't give the keys are imported as usual.
+        """
+        branches = [b for b in self.branches if b.fullname.startswith(self.__class__.__name__)]
+        branches.sort(key=lambda o: o.order)
+
+        for branch in branches:
+            importer_inst = self.importer_for(branch)
+            if importer_inst is None:
+                continue
+            other_branch = other.branch(branch.name)
+            keys = self.read_keys(importer_inst) if other_branch is not None and branch.klass is not None else None
+            if keys is None:
+                self.import_branch(branch, importer_inst)
+                continue
+            overlap = keys & set(other_branch.keys())
+            self.import_branch(branch, importer_inst, only_keys=overlap)
+            for key in keys - overlap:
+                branch.make_key_only(key)
+
+        self.resolve_references()
+
+    @staticmethod
+    def row_hash_matcher(importer_inst, branch):
+        """
+        A function (obj, hash) that says whether the row whose hash of the importer's hash_columns is `hash` (see readin_hashes)
+        would make obj in branch: obj has to be of the branch's class, and the hash_columns have to cover every attribute
+        that the diff compares and that the row has (see the importer's row_columns) or that obj got from its row
+        (derived properties are worked out from those), otherwise a change in the others would go unnoticed; the row is read in full then
+        """
+        columns = sorted(importer_inst.hash_columns)
+        hashed = set(columns) | {'idnumber'}
+        klass = branch.klass
+        row_columns = getattr(importer_inst, 'row_columns', lambda: None)()
+        if row_columns is None:
+            # can't tell what the rows would make
+            return lambda obj, hash_: False
+        include = getattr(klass, '_include', None)
+        exclude = getattr(klass, '_exclude', None) or ()
+        unhashed = [
+            column for column in row_columns
+            if column not in hashed and column == column.lstrip('_') and column not in exclude and (include is None or column in include)
+        ]
+        if unhashed:
+            verbose and print("hash_columns don't have {}, reading {} in full".format(", ".join(unhashed), branch.fullname))
+            return lambda obj, hash_: False
+        # attributes set on the instance -> whether the columns cover them
+        covered = {}
+
+        def matches(obj, hash_):
+            if obj.__class__ is not klass:
+                return False
+            layout = tuple(obj.__dict__)
+            covers = covered.get(layout)
+            if covers is None:
+                uncovered = [attribute for attribute in tracked_attributes(obj) if attribute in obj.__dict__ and attribute not in hashed]
+                covers = covered[layout] = not uncovered
+                verbose and uncovered and print("hash_columns don't have {}, reading {} in full".format(", ".join(uncovered), obj))
+            return covers and obj._row_hash(columns) == hash_
+
+        return matches
+
+    def import_changed(self, other):
+        """
+        Alternative to +self when `other` has already been imported, for trees whose importers can hash rows where they are,
+        like DBImporter with hash_columns declared (ie +source; dest.import_changed(source))
+
+        Only (idnumber, hash) comes across first. Where the hash matches the object in other, and the row would make that object here (see row_hash_matcher),
+        that object is stored here as well, just as `make` would do when the fingerprints match, unless filter_out drops it,
+        and only the rows that don't match are read in full, the importer gets them as its only_keys
+        Branches whose importers can't give the hashes, or have a kwargs_preprocessor (the rows aren't what the objects are made of), are imported as usual.
+        """
+        branches = [b for b in self.branches if b.fullname.startswith(self.__class__.__name__)]
+        branches.sort(key=lambda o: o.order)
+
+        for branch in branches:
+            importer_inst = self.importer_for(branch)
+            if importer_inst is None:
+                continue
+            other_branch = other.branch(branch.name)
+            usable = other_branch is not None and branch.klass is not None and getattr(importer_inst, 'kwargs_preprocessor', None) is None
+            hashes = self.read_hashes(importer_inst) if usable else None
+            if hashes is None:
+                self.import_branch(branch, importer_inst)
+                continue
+            matches = self.row_hash_matcher(importer_inst, branch)
             importer_filter = getattr(importer_inst, 'filter_out', None)
-            kwargs_preprocessor = getattr(importer_inst, 'kwargs_preprocessor', None)
-            verbose and importer_filter and print("Detected importer filter")
-            verbose and kwargs_preprocessor and print("Detected kwargs preprocessor")
+            mismatched = set()
+            for key, hash_ in hashes:
+                obj = other_branch.get(key)
+                if obj is not None and matches(obj, hash_):
+                    # +self would have made the same object from the row, if filter_out let it through
+                    if importer_filter is None or not importer_filter(**obj._get_all_properties()):
+                        branch.set_key(key, obj)
+                else:
+                    mismatched.add(key)
+            self.import_branch(branch, importer_inst, only_keys=mismatched)
 
-            # Readin from the importer, and 'make' the data objects as we go
-            # the built-in make method is smart about storing things correctly
+        self.resolve_references()
 
-            reader = importer_inst.reader
-            temp = defaultdict(list)
+    def refresh(self):
+        """
+        Brings the tree up to date, doing only as much work as what has changed, see dss.daemon
+        Returns the names of the branches that were imported again
 
-            if reader is None:
-                verbose and print("\t...No context manager, using generator instead")
-                i = 0
+        A branch is left alone if its importer's cache_key (see dss.importers.cache) is the same as last time.
+        Otherwise, if the importer can give (idnumber, hash) for its rows (readin_hashes), only the rows whose hash
+        doesn't match the object we have (see row_hash_matcher) are read in full, and the objects whose rows are gone are removed.
+        Anything else is emptied and imported in full, as is every branch the first time, and those whose importer has a kwargs_preprocessor
+        """
+        branches = [b for b in self.branches if b.fullname.startswith(self.__class__.__name__)]
+        branches.sort(key=lambda o: o.order)
+        tokens = self._refresh_tokens
 
-                for kwargs_in in importer_inst.readin():
-                    if kwargs_preprocessor:
-                        kwargs = kwargs_preprocessor(kwargs_in)
-                        if kwargs is None:
-                            continue
-                    else:
-                        kwargs = kwargs_in
-
-                    has_list_value = len([1 for k in kwargs.keys() if isinstance(kwargs[k], (list,set))]) > 0
-                    if not 'idnumber' in kwargs:
-                        kwargs['idnumber'] = str(i)
-                        i += 1
-                    if has_list_value:
-                        temp[kwargs['idnumber']].append(kwargs)
-                    else:
-                        self.make_them(branch, importer_filter, **kwargs)
+        refreshed = []
+        for branch in branches:
+            importer_inst = self.importer_for(branch)
+            if importer_inst is None:
+                continue
+            token = importer_inst.cache_key() if hasattr(importer_inst, 'cache_key') else None
+            if token is not None and tokens.get(branch.fullname) == token:
+                continue
+            usable = len(branch.keys()) and branch.klass is not None and getattr(importer_inst, 'kwargs_preprocessor', None) is None
+            hashes = self.read_hashes(importer_inst) if usable else None
+            if hashes is None:
+                branch.clear()
+                self.import_branch(branch, importer_inst)
+            else:
+                matches = self.row_hash_matcher(importer_inst, branch)
+                seen = set()
+                mismatched = set()
+                for key, hash_ in hashes:
+                    seen.add(key)
+                    obj = branch.get(key)
+                    if obj is None or not matches(obj, hash_):
+                        mismatched.add(key)
+                # the changed ones go too, in case filter_out drops them now
+                for key in (set(branch.keys()) - seen) | (mismatched & set(branch.keys())):
+                    branch.del_key(key)
+                if mismatched:
+                    self.import_branch(branch, importer_inst, only_keys=mismatched)
+            tokens[branch.fullname] = token
+            refreshed.append(branch.name)
+
+        if refreshed:
+            self.resolve_references()
+        return refreshed
+
+    @classmethod
+    def prune_storeobjects(cls):
+        """
+        make keeps every object it has made in _storeobjects, so that identical ones are shared,
+        and objects that have been replaced by a refresh stay there too. Drop those that no branch holds any more
+        Returns how many were dropped
+        """
+        metastore = cls._metastore
+        held = set()
+        for store in metastore._store.values():
+            held.update(id(value) for value in store.values())
+        stale = [fingerprint for fingerprint, obj in metastore._storeobjects.items() if id(obj) not in held]
+        for fingerprint in stale:
+            del metastore._storeobjects[fingerprint]
+        # and the interned values of the branches that are gone
+        branch_interner = getattr(cls, '_interner', interner)
+        for branch in branch_interner.branches() - set(metastore._store):
+            branch_interner.clear_branch(branch)
+        return len(stale)
+
+    def read_rows(self, importer_inst, kwargs_preprocessor, source=None, cache_key=None):
+        """
+        Yields the rows from the importer, through the kwargs_preprocessor if there is one,
+        making sure each one has an idnumber
+        source: rows to use instead of the importer's readin (ie from readin_keys_subset)
+        If the importer doesn't apply the pushdown itself, it is applied here before the preprocessor
+        The branch's declared _types are applied after the preprocessor, see dss.datastore.converters
+        cache_key: the rows as the importer gives them (after the pushdown) are read from the import cache under this key,
+                   or written to it, and go through the preprocessor and _types each time, see dss.importers.cache
+        """
+        pushdown = getattr(importer_inst, 'pushdown', None)
+        if pushdown is not None and not getattr(importer_inst, 'applies_pushdown', False):
+            matches, project = pushdown.matches, pushdown.project
+        else:
+            matches = project = None
+        convert = getattr(importer_inst, 'converter', None)
+        from_generator = source is not None or importer_inst.reader is None
+
+        def raw_rows():
+            if from_generator:
+                verbose and print("\t...No context manager, using generator instead")
+                yield from (importer_inst.readin() if source is None else source)
             else:
                 verbose and print("\t...Using context manager")
                 with importer_inst.reader() as reader:
-                    i = 0
-                    for kwargs_in in reader:
-                        if kwargs_preprocessor:
-                            kwargs = kwargs_preprocessor(kwargs_in)
-                            if kwargs is None:
-                                continue
-                        else:
-                            kwargs = kwargs_in
-                        has_list_value = len([1 for k in kwargs.keys() if isinstance(kwargs[k], (list,set))]) > 0
-                        if not 'idnumber' in kwargs:
-                            kwargs['idnumber'] = i
-                            i += 1
-                        if has_list_value:
-                            temp[kwargs['idnumber']].append(kwargs)
+                    yield from reader
+
+        rows = self.import_cache.get(cache_key) if cache_key is not None else None
+        if rows is not None:
+            verbose and print("\t...Rows for {} from the cache".format(importer_inst._branch.fullname))
+        else:
+            rows = raw_rows()
+            if matches is not None:
+                rows = (project(kwargs_in) for kwargs_in in rows if matches(kwargs_in))
+            if cache_key is not None:
+                rows = self.import_cache.put(cache_key, rows)
+
+        i = 0
+        for kwargs_in in rows:
+            if kwargs_preprocessor:
+                kwargs = kwargs_preprocessor(kwargs_in)
+                if kwargs is None:
+                    continue
+            else:
+                kwargs = kwargs_in
+            if convert is not None:
+                kwargs = convert(kwargs)
+            if not 'idnumber' in kwargs:
+                kwargs['idnumber'] = str(i) if from_generator else i
+                i += 1
+            yield kwargs
+
+    def aggregate_rows(self, importer_inst, rows):
+        """
+        Rows without list or set values are passed on as they come.
+        Rows with them are merged per idnumber (lists extended, sets updated, anything else from the last row)
+        and each merged record is passed on once:
+
+        If the importer says its rows are sorted_by_key, the rows of each idnumber are next to each other
+        and are merged as they stream past.
+        Otherwise they go through an ExternalSorter that spills to disk past self.sort_buffer rows,
+        grouped in the order each idnumber was first seen, and are passed on after the last row has been read
+        """
+        if getattr(importer_inst, 'sorted_by_key', False):
+            current, group = None, []
+            for kwargs in rows:
+                if not self.has_list_value(kwargs):
+                    yield kwargs
+                    continue
+                if group and kwargs['idnumber'] != current:
+                    yield self.merge_rows(group)
+                    group = []
+                current = kwargs['idnumber']
+                group.append(kwargs)
+            if group:
+                yield self.merge_rows(group)
+            return
+
+        first_seen = {}
+        sorter = ExternalSorter(self.sort_buffer, key=lambda record: record[:2])
+        for seq, kwargs in enumerate(rows):
+            if not self.has_list_value(kwargs):
+                yield kwargs
+                continue
+            first = first_seen.setdefault(kwargs['idnumber'], seq)
+            sorter.add( (first, seq, kwargs) )
+        first_seen.clear()
+        for first, records in itertools.groupby(sorter, key=lambda record: record[0]):
+            yield self.merge_rows([record[2] for record in records])
+
+    @staticmethod
+    def has_list_value(kwargs):
+        for value in kwargs.values():
+            if isinstance(value, (list, set)):
+                return True
+        return False
+
+    @staticmethod
+    def merge_rows(rows):
+        prepared = {}
+        for item in rows:
+            for key, value in item.items():
+                if isinstance(value, list):
+                    prepared.setdefault(key, []).extend(value)
+                elif isinstance(value, set):
+                    prepared.setdefault(key, set()).update(value)
+                else:
+                    prepared[key] = value
+        return prepared
+
+    def resolve_references(self):
+        """
+        Goes through the _references declared on the branches, in one pass once every branch is imported,
+        and keeps forward (branch.referenced) and reverse (target.referrers) maps of them.
+        Returns the references that point to nothing, as DanglingReference, also kept in self.dangling_references
+
+        The maps are as of the time this was called, call it again if branches are changed afterwards
+        """
+        branches = [b for b in self.branches if b.fullname.startswith(self.__class__.__name__)]
+        for branch in branches:
+            branch._forward_references.clear()
+            branch._reverse_references.clear()
+
+        dangling = []
+        for branch in branches:
+            if not branch._references:
+                continue
+            for attribute, target_name in branch._references.items():
+                target = self.branch(target_name)
+                if target is None:
+                    raise AttributeError("{} declares {} refers to branch {}, which {} doesn't have".format(branch.fullname, attribute, target_name, self.__class__.__name__))
+                target_keys = target.keys()
+                forward = branch._forward_references[attribute] = {}
+                for key in branch.keys():
+                    value = branch.peek(key, attribute)
+                    if value is None or value == '':
+                        continue
+                    if isinstance(value, (list, set, tuple)):
+                        refs = forward[key] = tuple(value)
+                    else:
+                        forward[key] = value
+                        refs = (value, )
+                    for ref in refs:
+                        if ref in target_keys:
+                            target._reverse_references[ref].append( (branch.name, attribute, key) )
                         else:
-                            self.make_them(branch, importer_filter, **kwargs)
-
-            if len(temp.keys()) > 0:
-                for idnumber in temp.keys():
-                    prepared = {}
-                    kwargs_list = temp[idnumber]
-                    for item in kwargs_list:
-                        for list_key in [k for k in item.keys() if isinstance(item[k], list)]:
-                            if list_key not in prepared:
-                                prepared[list_key] = []
-                            prepared[list_key].extend(item[list_key])
-                            del item[list_key]
-                        for set_key in [k for k in item.keys() if isinstance(item[k], set)]:
-                            if set_key not in prepared:
-                                prepared[set_key] = set()
-                            try:
-                                prepared[set_key].update(item[set_key])
-                            except AttributeError:
-                                from IPython import embed;embed();exit()
-                            del item[set_key]
- 
-                        # Add the additional ones, too
-                        prepared.update(item)
-
-                        self.make_them(branch, importer_filter, **prepared)
+                            dangling.append(DanglingReference(branch.name, key, attribute, target_name, ref))
+
+        if dangling:
+            log.warning("{} has {} dangling references".format(self.__class__.__name__, len(dangling)))
+        self.dangling_references = dangling
+        return dangling
 
     def make_them(self, branch, filter_callable, **kwargs):
         # Remove any kwargs and leave only those static ones
+        # Lazy branches keep the row as it is, and make the object when it is first needed
+        make = branch.make_later if branch._lazy and branch.klass else branch.make
 
         if filter_callable is not None:
             if not filter_callable(**kwargs):
-                obj = branch.make(**kwargs)
+                obj = make(**kwargs)
         else:
-            obj = branch.make(**kwargs)
+            obj = make(**kwargs)
 
         # # Now augment these objects with _underline properties passed in kwargs
         # for key,value in list_kwargs.items():
@@ -346,14 +943,37 @@ class DataStoreTree(metaclass=DataStoreTreeMeta):
         #         setattr(obj, key, [])
         #     getattr(obj, key).extend(value)
 
+    def snapshot(self, klass=None):
+        """
+        A copy-on-write copy of the tree: an instance of a subclass whose branches are snapshots of these,
+        see DataStoreBranches.snapshot. Diff it, apply templates to it, and drop it with -snapshot when done
+        klass: {branch name: model class} for branches whose objects should be seen as another class
+        """
+        cls = self.__class__
+        name = '{}Snapshot{}'.format(cls.__name__, next(cls._snapshot_numbers))
+        snap_class = type(cls)(name, (cls, ), {})
+        for branch in self.branches:
+            if not branch.fullname.startswith(cls.__name__ + '.'):
+                continue
+            snap_branch = branch.snapshot(name, (klass or {}).get(branch.name))
+            snap_branch._tree = snap_class
+            setattr(snap_class, branch.name, snap_branch)
+        snap = snap_class.__new__(snap_class)
+        snap.__dict__.update(self.__dict__)
+        snap.dangling_references = list(self.dangling_references)
+        return snap
+
     def __neg__(self):
         """
-        Removes the branches from the store
+        Removes the branches from the store, and their interned values
         """
+        branch_interner = getattr(self, '_interner', interner)
         for branch in self.branches:
             key = branch.fullname
             del self._metastore._store[key]
+            branch_interner.clear_branch(key)
 
+    @profiled('diff')
     def __sub__(self, other):
         """
         Mimicks syncing, yields objects
@@ -364,12 +984,11 @@ class DataStoreTree(metaclass=DataStoreTreeMeta):
         # +self
         # +other
 
-        branches = [b for b in self.branch_names if not b.startswith('_')]
+        if self.ordered:
+            yield from self.ordered_sub(other)
+            return
 
-        # filter out any branches that have been augmented to skip
-        branches = [b for b in branches if not (hasattr(self.branch(b), '_sub') and not self.branch(b)._sub)]
-        branches.sort(key=lambda b: self.branch(b).order)
-        #
+        branches = self.sub_branch_names()
 
         for branch in branches:
             this_branch = self.branch(branch)
@@ -380,11 +999,20 @@ class DataStoreTree(metaclass=DataStoreTreeMeta):
                 right = that_branch.get(key)
                 yield define_action(key, left, right, 'idnumber', "new_{}(idnumber={})".format(branch, key), None)
 
+        # With processes, the workers tell us which of the common keys have differences
+        # and we only compare those here, which keeps the order of the actions the same
+        changed = None
+        if self.processes and self.processes > 1:
+            changed = self.parallel_changed_keys(other, branches)
+
+        profiler = self.profiler
         for branch in branches:
             this_branch = self.branch(branch)
             that_branch = other.branch(branch)
 
             for item_key in this_branch.keys():
+                if changed is not None and item_key not in changed[branch]:
+                    continue
                 this_item = this_branch.get(item_key)
                 that_item = that_branch.get(item_key)
 
@@ -393,9 +1021,14 @@ class DataStoreTree(metaclass=DataStoreTreeMeta):
                     # because the datastore only creates significant unique items once
                     # so it's guaranteed that there are no differences to explore, therefore, short circuit any comparisons
                     continue
-                else:
+                elif profiler is None:
                     # Have the objects themselves compare to each other
                     yield from this_item - that_item
+                else:
+                    started = time.perf_counter()
+                    actions = list(this_item - that_item)
+                    profiler.record(time.perf_counter() - started, 'diff', this_branch.fullname, item_key, type(this_item).__name__)
+                    yield from actions
 
         for branch in branches:
             this_branch = self.branch(branch)
@@ -405,3 +1038,220 @@ class DataStoreTree(metaclass=DataStoreTreeMeta):
                 left = this_branch.get(key)
                 right = that_branch.get(key)
                 yield define_action(key, left, right, key, "old_{}(idnumber={})".format(branch, key), None)
+
+    def sub_branch_names(self):
+        """
+        The names of the branches that take part in the diff, in the order they are diffed
+        """
+        branches = [b for b in self.branch_names if not b.startswith('_')]
+
+        # filter out any branches that have been augmented to skip
+        branches = [b for b in branches if not (hasattr(self.branch(b), '_sub') and not self.branch(b)._sub)]
+        branches.sort(key=lambda b: self.branch(b).order)
+        return branches
+
+    # The tiers of ordered_sub, in the same order that __sub__ yields them
+    NEW, CHANGED, OLD = 0, 1, 2
+
+    def ordered_sub(self, other):
+        """
+        Same actions as __sub__, but in an order that doesn't depend on the order the importers gave us the rows:
+        all the new ones, then the changes, then the old ones (as __sub__ does), and within each of these
+        by branch order, then idnumber, then, for the changes, attribute and value
+
+        Only a small (tier, branch order, idnumber) record per object is sorted, using external_sort
+        which spills sorted runs to disk once sort_buffer records are held.
+        The actions themselves are made again from the store as the sorted records stream back
+        """
+        branches = self.sub_branch_names()
+
+        changed = None
+        if self.processes and self.processes > 1:
+            changed = self.parallel_changed_keys(other, branches)
+
+        def records():
+            seq = 0
+            for branch in branches:
+                this_branch = self.branch(branch)
+                that_branch = other.branch(branch)
+                order = this_branch.order
+                this_keys, that_keys = this_branch.keys(), that_branch.keys()
+                for key in this_keys - that_keys:
+                    seq += 1
+                    yield (self.NEW, order, branch, str(key), seq, key)
+                for key in this_keys:
+                    if changed is not None and key not in changed[branch]:
+                        continue
+                    if key not in that_keys or this_branch.store[key] is that_branch.store[key]:
+                        continue
+                    seq += 1
+                    yield (self.CHANGED, order, branch, str(key), seq, key)
+                for key in that_keys - this_keys:
+                    seq += 1
+                    yield (self.OLD, order, branch, str(key), seq, key)
+
+        for tier, order, branch, _, _, key in external_sort(records(), self.sort_buffer):
+            this_branch = self.branch(branch)
+            that_branch = other.branch(branch)
+            left = this_branch.get(key)
+            right = that_branch.get(key)
+            if tier == self.NEW:
+                yield define_action(key, left, right, 'idnumber', "new_{}(idnumber={})".format(branch, key), None)
+            elif tier == self.OLD:
+                yield define_action(key, left, right, key, "old_{}(idnumber={})".format(branch, key), None)
+            elif left and right and left is right:
+                # lazy branches only find out they share the object once it is made
+                continue
+            else:
+                actions = list(left - right)
+                # keep each attribute's actions together, but members of lists and sets come out of set arithmetic
+                # so put them in order too
+                first_seen = {}
+                for action in actions:
+                    first_seen.setdefault(action.func_name, len(first_seen))
+                actions.sort(key=lambda action: (first_seen[action.func_name], str(action.attribute)))
+                yield from actions
+
+    def plan(self, other, samples=0):
+        """
+        Counts what self - other would yield, per branch and func_name, without making the actions or their messages
+        With samples, keeps the first few idnumbers of each as well
+        Returns a dss.datastore.plan.Plan, whose check method can be used to refuse a sync that looks wrong
+
+        Don't expect it to be much quicker than the diff: it compares the same attributes of the same objects,
+        and with models that have derived properties (ie username) working those out is most of the time of both.
+        What it saves is making the actions and formatting their messages, about a third of the diff on the sample models
+        """
+        plan = Plan(samples)
+        branches = self.sub_branch_names()
+
+        for branch in branches:
+            this_branch = self.branch(branch)
+            that_branch = other.branch(branch)
+            # work on the stores directly, rows of lazy branches are made into objects that aren't kept
+            this_store, that_store = this_branch.store, that_branch.store
+            counts = Counter()
+
+            new_keys = this_store.keys() - that_store.keys()
+            if new_keys:
+                counts["new_{}".format(branch)] = len(new_keys)
+                for key in itertools.islice(new_keys, samples):
+                    plan.sample(branch, "new_{}".format(branch), key)
+
+            for key, this_item in this_store.items():
+                that_item = that_store.get(key)
+                if this_item is that_item or that_item is None:
+                    continue
+                if type(this_item) is RawRow:
+                    this_item = this_branch.transient(key, this_item)
+                if type(that_item) is RawRow:
+                    that_item = that_branch.transient(key, that_item)
+                if not that_item:
+                    continue
+                for func_name, how_many in get_comparator(this_item, that_item).tally(this_item, that_item):
+                    counts[func_name] += how_many
+                    if samples:
+                        plan.sample(branch, func_name, key)
+
+            old_keys = that_store.keys() - this_store.keys()
+            if old_keys:
+                counts["old_{}".format(branch)] = len(old_keys)
+                for key in itertools.islice(old_keys, samples):
+                    plan.sample(branch, "old_{}".format(branch), key)
+
+            plan.add(branch, counts)
+
+        return plan
+
+    def estimate_drift(self, other, rate=0.01, z=1.96):
+        """
+        Estimates per branch how many records are new, old and changed between self and other,
+        without importing either tree in full. Use on trees that haven't been imported:
+        only the sampled records are, and they stay in the store afterwards
+
+        The sample is the records whose idnumbers drift.in_sample picks at this rate.
+        Where the importer can give the keys (readin_keys), only the sampled ones are read in full (readin_keys_subset),
+        otherwise everything is read and the rest dropped before any object is made.
+        When both sides can give the keys, new and old are counted exactly and only changed is estimated
+
+        Changed records are the ones where Base.__sub__ has anything to say
+        Returns {branch name: {'new': Estimate, 'old': Estimate, 'changed': Estimate}}, see dss.datastore.drift
+        """
+        estimates = OrderedDict()
+        for name in self.sub_branch_names():
+            this_branch, that_branch = self.branch(name), other.branch(name)
+            if that_branch is None:
+                continue
+
+            def sampled(key, name=name):
+                return drift.in_sample(name, key, rate)
+
+            all_keys = []
+            for tree, branch in ((self, this_branch), (other, that_branch)):
+                importer_inst = tree.importer_for(branch)
+                if importer_inst is None:
+                    all_keys.append(None)
+                    continue
+                keys = tree.read_keys(importer_inst)
+                if keys is None:
+                    all_keys.append(None)
+                    tree.import_branch(branch, importer_inst, keep=sampled)
+                else:
+                    all_keys.append(keys)
+                    only_keys = set(key for key in keys if sampled(key))
+                    tree.import_branch(branch, importer_inst, only_keys=only_keys)
+
+            this_sample, that_sample = this_branch.keys(), that_branch.keys()
+            changed = 0
+            for key in this_sample & that_sample:
+                this_item, that_item = this_branch.get(key), that_branch.get(key)
+                if this_item is that_item:
+                    continue
+                for _ in this_item - that_item:
+                    changed += 1
+                    break
+
+            this_keys, that_keys = all_keys
+            if this_keys is not None and that_keys is not None:
+                common = len(this_keys & that_keys)
+                estimates[name] = {
+                    'new': drift.exact(len(this_keys - that_keys)),
+                    'old': drift.exact(len(that_keys - this_keys)),
+                    'changed': drift.estimate(changed, len(this_sample & that_sample), common, z),
+                }
+            else:
+                sampled_count = len(this_sample | that_sample)
+                population = sampled_count / rate if rate < 1 else sampled_count
+                estimates[name] = {
+                    'new': drift.estimate(len(this_sample - that_sample), sampled_count, population, z),
+                    'old': drift.estimate(len(that_sample - this_sample), sampled_count, population, z),
+                    'changed': drift.estimate(changed, sampled_count, population, z),
+                }
+        return estimates
+
+    def parallel_changed_keys(self, other, branches):
+        """
+        Partitions the keys of each branch by hash across a pool of self.processes workers,
+        which compare the objects and report back the keys with differences, as {branch: set of keys}
+
+        The workers are forked so they inherit the store, nothing is pickled on the way there
+        Where fork isn't available we return None, and the diff is done in this process as usual
+        """
+        global _shard_trees
+        try:
+            context = multiprocessing.get_context('fork')
+        except ValueError:
+            return None
+        shards = self.processes
+        _shard_trees = (self, other)
+        try:
+            with context.Pool(shards) as pool:
+                results = pool.map(_changed_keys_in_shard, [(shard, shards, branches) for shard in range(shards)])
+        finally:
+            _shard_trees = None
+
+        changed = {branch: set() for branch in branches}
+        for result in results:
+            for branch, keys in result.items():
+                changed[branch].update(keys)
+        return changed
@@ -1,4 +1,24 @@
-from dss.importers.default_importer import DefaultImporter
-from dss.importers.csv_importer import CSVImporter
-from dss.importers.db_importer import DBImporter
-__all__ = [DefaultImporter, CSVImporter, DBImporter]
+"""
+The importers are loaded when first used, so that a CSV-only sync doesn't pay for sqlalchemy
+"""
+import importlib
+
+_importers = {
+    'DefaultImporter': 'dss.importers.default_importer',
+    'CSVImporter': 'dss.importers.csv_importer',
+    'DBImporter': 'dss.importers.db_importer',
+    'SubprocessImporter': 'dss.importers.subprocess_importer',
+    # not an importer, but the DBImporter's companion for templates that write to a database
+    'DBSink': 'dss.importers.db_sink',
+}
+__all__ = list(_importers)
+
+def __getattr__(name):
+    if name in _importers:
+        value = getattr(importlib.import_module(_importers[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
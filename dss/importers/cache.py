@@ -0,0 +1,141 @@
+"""
+Cache of the rows an importer produced, kept in local files and looked up by what identifies the source
+
+tree = SIS(cache='/var/cache/dss', cache_max_bytes=256 * 1024 * 1024)
++tree                               # unchanged sources are read from the cache instead of being parsed again
+tree.import_cache.clear()           # or invalidate(key) for just one
+
+Importers say what identifies their output with cache_key (None if they can't tell, and they aren't cached):
+CSVImporter uses the path, size and modification time of the file (and its content hash with cache_content_hash),
+DBImporter the result of its change_token_query (ie SELECT max(updated_at) FROM users).
+The importer class, the branch and the pushdown are part of the key too.
+
+The rows are cached as the importer gives them, after the pushdown but before the kwargs_preprocessor, the declared _types,
+filter_out and make, so a preprocessor that looks at other branches, or a change to it or to _types, never sees stale rows
+"""
+
+import hashlib
+import itertools
+import os
+import pickle
+import tempfile
+
+# rows are written in chunks of this many, in runs that share their column tuples
+CHUNK = 1000
+
+
+def key_digest(key):
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ImportCache:
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.evict()
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key_digest(key) + '.rows')
+
+    def get(self, key):
+        """
+        Generator of the cached rows for key, None if there aren't any
+        """
+        path = self.path_for(key)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        # mark it as recently used, eviction removes the least recently used first
+        os.utime(path)
+        return self.read(f)
+
+    @staticmethod
+    def read(f):
+        with f:
+            while True:
+                try:
+                    chunk = pickle.load(f)
+                except EOFError:
+                    return
+                for columns, run in chunk:
+                    for values in run:
+                        yield dict(zip(columns, values))
+
+    def put(self, key, rows):
+        """
+        Passes the rows on while writing them to the cache,
+        the entry only appears once all of them have gone through
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.partial')
+        complete = False
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                columns_seen = {}
+                rows = iter(rows)
+                while True:
+                    # each chunk is written before its rows are passed on, so whatever is done to them afterwards isn't cached
+                    chunk = list(itertools.islice(rows, CHUNK))
+                    if not chunk:
+                        break
+                    # runs of rows with the same columns: (columns, [values, ...])
+                    runs = []
+                    for row in chunk:
+                        columns = tuple(row)
+                        if not runs or runs[-1][0] != columns:
+                            runs.append( (columns_seen.setdefault(columns, columns), []) )
+                        runs[-1][1].append(tuple(row.values()))
+                    pickle.dump(runs, f, pickle.HIGHEST_PROTOCOL)
+                    yield from chunk
+            os.replace(temp_path, self.path_for(key))
+            complete = True
+        finally:
+            if not complete and os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.evict()
+
+    def entries(self):
+        """
+        (path, size, last used) of every entry
+        """
+        ret = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.rows'):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                ret.append( (path, stat.st_size, stat.st_mtime) )
+        return ret
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is within max_bytes
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in sorted(entries, key=lambda entry: entry[2]):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def invalidate(self, key):
+        path = self.path_for(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            os.remove(path)
@@ -1,18 +1,18 @@
 """
 An alternative way to do subprocesses
 """
-
-import pexpect
+import subprocess
 
 class CLIImporter:
 	def __init__(self):
 		pass
 
-	def run(self, command):
-		sub = '/bin/bash -c "{}"'.format(command)
-		child_process = pexpect.spawn(sub)
-		child_process.expect(pexpect.EOF)
-		return child_process.before
+	def run(self, command, timeout=None):
+		"""
+		Runs the command and returns everything it wrote to stdout (as bytes)
+		To read the output as it comes, line by line, use SubprocessImporter.stream
+		"""
+		return subprocess.run(['/bin/bash', '-c', command], stdout=subprocess.PIPE, timeout=timeout).stdout
 
 if __name__ == "__main__":
 
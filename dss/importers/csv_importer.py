@@ -1,11 +1,16 @@
 from dss.importers import DefaultImporter
+from dss.importers.cache import file_digest
 import csv
+import os
 from contextlib import contextmanager
 from collections import defaultdict
 
 verbose = False
 
 class CSVImporter(DefaultImporter):
+    applies_pushdown = True
+    # Add the hash of the file's contents to the cache key, for when size and modification time can't be trusted
+    cache_content_hash = False
 
     def init(self):
         if self.get_setting('delimiter') == '\\t':
@@ -32,11 +37,50 @@ class CSVImporter(DefaultImporter):
             fieldnames = fieldnames.split(' ')
 
         with open(resolved_path) as f:
+            if self.pushdown is not None:
+                # Check the rows as lists, and only make dicts for the ones we keep
+                reader = csv.reader(f, delimiter=self.get_setting('delimiter'))
+                if not fieldnames:
+                    fieldnames = next(reader, [])
+                convert = self.pushdown.compile(fieldnames)
+                yield (row for row in map(convert, reader) if row is not None)
+                return
             reader = csv.DictReader(f, 
                 fieldnames=fieldnames,
                 delimiter=self.get_setting('delimiter'))
             yield reader
 
+    def readin_keys(self):
+        """
+        Just the key column, without making a dict for each row
+        The column is the '<branch>_key_column' setting, or idnumber
+        The tree doesn't use this for importers with a kwargs_preprocessor or filter_out, see DataStoreTree.read_keys
+        Rows that the pushdown's predicates don't match are left out, as they are from reader
+        """
+        key_column = self.get_setting('{}_key_column'.format(self._branch.name), 'idnumber')
+        fieldnames = self.get_setting('{}_columns'.format(self._branch.name), None)
+
+        with open(self.get_path()) as f:
+            reader = csv.reader(f, delimiter=self.get_setting('delimiter'))
+            fieldnames = fieldnames.split(' ') if fieldnames else next(reader, [])
+            if key_column not in fieldnames:
+                return None
+            index = fieldnames.index(key_column)
+            if self.pushdown is not None and self.pushdown.where:
+                matches = self.pushdown.check(fieldnames)
+                return set(row[index] for row in reader if len(row) > index and matches(row))
+            return set(row[index] for row in reader if len(row) > index)
+
+    def cache_key(self):
+        path = self.get_path()
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        settings = (self.get_setting('delimiter'), self.get_setting('{}_columns'.format(self._branch.name), None))
+        content = file_digest(path) if self.cache_content_hash else None
+        return self.cache_identity() + (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, content, settings)
+
 class TranslatedCSVImporter:
     """
     Make-shift 
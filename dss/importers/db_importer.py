@@ -1,5 +1,6 @@
 from dss.importers import DefaultImporter
-from sqlalchemy import create_engine
+from dss.utils import row_hash
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker
 from contextlib import contextmanager
 
@@ -10,6 +11,20 @@ class DBImporter(DefaultImporter):
 	default_port = None
 	dialect = None
 
+	# Declare the table to get readin (and readin_hashes) for free
+	table = None
+	columns = None          # None for all of them
+	# The column with the idnumber, readin gives it as idnumber
+	key_column = 'idnumber'
+	# The tracked columns that readin_hashes hashes in the database, see DataStoreTree.import_changed
+	# They have to cover every attribute the diff compares that the objects get from their rows, or the rows are read in full
+	hash_columns = None
+	# Rows are fetched by key in chunks of this many when only_keys is set
+	keys_per_query = 500
+	# A query that returns one cheap value that changes whenever the rows do, ie SELECT max(updated_at) FROM users
+	# Declare it to have the tree cache the rows, see dss.importers.cache
+	change_token_query = None
+
 	def init(self):
 		"""
 		Set up the database information
@@ -32,6 +47,118 @@ class DBImporter(DefaultImporter):
 	    finally:
 	        session.close()
 
+	def sink(self, template=None, **kwargs):
+		"""
+		A DBSink that writes to this database, for templates, see dss.importers.db_sink
+		"""
+		from dss.importers.db_sink import DBSink
+		kwargs.setdefault('key_column', self.key_column)
+		return DBSink(self.engine, template, **kwargs)
+
+	def select(self):
+		"""
+		(SELECT ... FROM ... WHERE ..., the WHERE clause, params) for the rows readin gives
+		"""
+		columns = ", ".join(self.columns) if self.columns else '*'
+		where, params = '', {}
+		if self.pushdown is not None:
+			pushed_columns, where, params = self.pushdown.sql()
+			if self.pushdown.fields:
+				columns = pushed_columns
+		return "SELECT {} FROM {}{}".format(columns, self.table, where), where, params
+
+	def as_row(self, row):
+		"""
+		The dict for a result row, with the key_column as idnumber, as readin_keys and readin_hashes give it
+		"""
+		row = dict(row._mapping)
+		if self.key_column != 'idnumber' and self.key_column in row:
+			row['idnumber'] = row.pop(self.key_column)
+		return row
+
+	def readin(self):
+		"""
+		SELECT the columns of the table, only the rows in only_keys if that is set
+		"""
+		if self.table is None:
+			return
+		query, where, params = self.select()
+		with self.engine.connect() as connection:
+			if self.only_keys is None:
+				for row in connection.execute(text(query), params):
+					yield self.as_row(row)
+				return
+			keys = list(self.only_keys)
+			for start in range(0, len(keys), self.keys_per_query):
+				chunk = keys[start:start + self.keys_per_query]
+				chunk_params = dict(params)
+				chunk_params.update({'k{}'.format(i): key for i, key in enumerate(chunk)})
+				in_keys = "{} IN ({})".format(self.key_column, ", ".join(':k{}'.format(i) for i in range(len(chunk))))
+				chunk_query = query + (" AND " if where else " WHERE ") + in_keys
+				for row in connection.execute(text(chunk_query), chunk_params):
+					yield self.as_row(row)
+
+	def row_columns(self):
+		if self.table is None:
+			return None
+		query, _, params = self.select()
+		with self.engine.connect() as connection:
+			columns = list(connection.execute(text("SELECT * FROM ({}) AS dss_columns WHERE 1 = 0".format(query)), params).keys())
+		return ['idnumber' if column == self.key_column else column for column in columns]
+
+	@property
+	def applies_pushdown(self):
+		# Only the generic readin knows about it
+		return self.table is not None
+
+	def pushdown_where(self):
+		"""
+		(WHERE clause or '', params) for the pushdown's predicates, so that the keys and hashes are of the rows readin gives
+		"""
+		if self.pushdown is None:
+			return '', {}
+		_, where, params = self.pushdown.sql()
+		return where, params
+
+	def readin_keys(self):
+		if self.table is None:
+			return None
+		where, params = self.pushdown_where()
+		with self.engine.connect() as connection:
+			return set(row[0] for row in connection.execute(text("SELECT {} FROM {}{}".format(self.key_column, self.table, where)), params))
+
+	def readin_keys_subset(self, keys):
+		if self.table is None:
+			return None
+		self.only_keys = keys
+		return self.readin()
+
+	def cache_key(self):
+		if self.change_token_query is None:
+			return None
+		with self.engine.connect() as connection:
+			token = connection.execute(text(self.change_token_query)).scalar()
+		return self.cache_identity() + (self.engine_string, self.table, self.columns, self.change_token_query, repr(token))
+
+	def hash_expression(self, columns):
+		"""
+		SQL that computes utils.row_hash of the columns for each row
+		By default a function dss_row_hash, which register_row_hash adds to sqlite connections
+		"""
+		return "dss_row_hash({})".format(", ".join(columns))
+
+	def readin_hashes(self):
+		"""
+		(idnumber, hash of the hash_columns) for every row, computed by the database
+		None if hash_columns isn't declared
+		"""
+		if self.table is None or not self.hash_columns:
+			return None
+		where, params = self.pushdown_where()
+		query = "SELECT {}, {} FROM {}{}".format(self.key_column, self.hash_expression(sorted(self.hash_columns)), self.table, where)
+		with self.engine.connect() as connection:
+			return [(row[0], row[1]) for row in connection.execute(text(query), params)]
+
 	@property
 	def engine_string(self):
 		user = self.get_setting('db_user')
@@ -45,5 +172,24 @@ class PostgresDBImporter(DBImporter):
 	default_port = 5432
 	dialect = 'postgresql'
 
+	def hash_expression(self, columns):
+		# Same as utils.row_hash, as long as the columns print the same as python's str (text, integers)
+		return "md5(concat_ws(chr(31), {}))".format(", ".join("coalesce({}::text, '')".format(c) for c in columns))
+
+class SQLiteDBImporter(DBImporter):
+	dialect = 'sqlite'
+
+	def init(self):
+		super().init()
+		event.listen(self.engine, 'connect', self.register_row_hash)
+
+	@staticmethod
+	def register_row_hash(dbapi_connection, connection_record):
+		dbapi_connection.create_function('dss_row_hash', -1, row_hash)
+
+	@property
+	def engine_string(self):
+		return 'sqlite:///{}'.format(self.get_setting('db_database'))
+
 class MoodleImporter(DBImporter):
 	pass
\ No newline at end of file
@@ -5,6 +5,21 @@ An abstract importer, can be used as is, but does nothing
 class DefaultImporter:
     reader = None
     _settings = None
+    # Set to True if rows for the same idnumber always come one after the other,
+    # which lets rows with list values be merged as they stream past, see DataStoreTree.aggregate_rows
+    sorted_by_key = False
+    only_keys = None
+    # The tree sets pushdown to the declared filter and projection (dss.datastore.pushdown) before readin,
+    # importers that apply it themselves say so with applies_pushdown, otherwise the tree applies it to the rows
+    pushdown = None
+    applies_pushdown = False
+    # The tree sets converter to the row conversion compiled from the branch's _types, see dss.datastore.converters
+    # and key_converter to the conversion of the idnumber on its own, for what readin_keys and readin_hashes give
+    converter = None
+    key_converter = None
+    # converted idnumber -> idnumber as the source has it, kept by the tree when key_converter changes them,
+    # so that only_keys is in the source's terms
+    source_keys = None
 
     def __init__(self, tree, branch):
         self._tree = tree
@@ -25,3 +40,42 @@ class DefaultImporter:
 
     def readin(self, branch):
         return []
+
+    def readin_keys(self):
+        """
+        Override to return just the idnumbers, cheaply (SELECT idnumber..., one column of a CSV)
+        None means the importer can't, and DataStoreTree.import_overlap will import everything
+        When it can, import_overlap sets self.only_keys to the idnumbers it wants in full before readin
+        Give them as they are in the source, the tree converts them to the declared type of idnumber
+        """
+        return None
+
+    def readin_keys_subset(self, keys):
+        """
+        Override to yield the rows of just these idnumbers, fetched by key where they come from
+        None means the importer can't, and the tree reads everything and drops the rows it doesn't want
+        Used by DataStoreTree.import_branch whenever it is given only_keys (import_overlap, import_changed, estimate_drift)
+        """
+        return None
+
+    def row_columns(self):
+        """
+        Override to return the names of the columns that the rows readin gives have, as the tree sees them (idnumber for the key)
+        DataStoreTree.import_changed and refresh only take a row whose hash matches as unchanged if hash_columns cover all of them,
+        None means the importer can't tell, and every row is read in full
+        """
+        return None
+
+    def cache_key(self):
+        """
+        Override to return what identifies the rows readin would give now, for the tree's import cache
+        None means they can't be cached, see dss.importers.cache
+        """
+        return None
+
+    def cache_identity(self):
+        """
+        The part of the cache key that is about the importer rather than the source
+        """
+        klass = self.__class__
+        return (klass.__module__, klass.__qualname__, self._branch.fullname, repr(self.pushdown))
@@ -0,0 +1,174 @@
+"""
+Importer that runs shell commands and streams their stdout into the branch as it is produced
+
+class UsersImporter(SubprocessImporter):
+    commands = ['export-users --campus north', 'export-users --campus south']
+    parser = 'csv'          # or 'jsonl', 'delimited', 'fixed'
+    concurrency = 2         # how many commands run at once
+    timeout = 600           # seconds per command
+
+Nothing waits for the whole output: rows are parsed line by line as the commands write them,
+and with several commands the rows of each are interleaved as they arrive.
+"""
+
+from dss.importers import DefaultImporter
+import csv
+import json
+import queue
+import subprocess
+import tempfile
+import threading
+
+
+class _Finished:
+    def __init__(self, error=None):
+        self.error = error
+
+
+class SubprocessImporter(DefaultImporter):
+    commands = None
+    parser = 'csv'
+    # csv and delimited: the column names, None to take them from the first line (csv only)
+    columns = None
+    delimiter = ','
+    # fixed: the width of each of the columns
+    widths = None
+    concurrency = 4
+    timeout = None
+    # rows held between the commands and the tree before the commands have to wait
+    queue_size = 10000
+    shell = '/bin/bash'
+
+    def get_commands(self):
+        commands = self.commands
+        if isinstance(commands, str):
+            commands = [commands]
+        return list(commands or [])
+
+    def parse(self, lines):
+        """
+        Turn an iterable of lines into an iterable of dicts, according to self.parser
+        """
+        if self.parser == 'csv':
+            yield from csv.DictReader(lines, fieldnames=self.columns, delimiter=self.delimiter)
+        elif self.parser == 'jsonl':
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+        elif self.parser == 'delimited':
+            columns = self.columns
+            for line in lines:
+                line = line.rstrip('\r\n')
+                if line:
+                    yield dict(zip(columns, line.split(self.delimiter)))
+        elif self.parser == 'fixed':
+            slices = []
+            start = 0
+            for column, width in zip(self.columns, self.widths):
+                slices.append( (column, start, start + width) )
+                start += width
+            for line in lines:
+                line = line.rstrip('\r\n')
+                if line:
+                    yield {column: line[begin:end].strip() for column, begin, end in slices}
+        else:
+            raise ValueError("Unknown parser {}, use csv, jsonl, delimited or fixed".format(self.parser))
+
+    def stream(self, command, stop=None, running=None):
+        """
+        Runs the command (no pty), yields the parsed rows as stdout produces them
+        Raises subprocess.TimeoutExpired if it runs longer than self.timeout,
+        and subprocess.CalledProcessError if it exits with an error
+        stop and running are for readin's threads: an Event that says to give up, and a set of the live processes
+        stderr goes to a temporary file rather than a pipe, which would fill up while we read stdout and hang the command
+        """
+        errors = tempfile.TemporaryFile(mode='w+')
+        process = subprocess.Popen([self.shell, '-c', command], stdout=subprocess.PIPE, stderr=errors, text=True)
+        if running is not None:
+            running.add(process)
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            process.kill()
+
+        timer = None
+        if self.timeout:
+            timer = threading.Timer(self.timeout, kill)
+            timer.daemon = True
+            timer.start()
+        try:
+            for row in self.parse(process.stdout):
+                if stop is not None and stop.is_set():
+                    process.kill()
+                    return
+                yield row
+            returncode = process.wait()
+            errors.seek(0)
+            stderr = errors.read()
+        finally:
+            if running is not None:
+                running.discard(process)
+            if timer is not None:
+                timer.cancel()
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+            errors.close()
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(command, self.timeout)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command, stderr=stderr)
+
+    def readin(self):
+        commands = self.get_commands()
+        if len(commands) == 1:
+            yield from self.stream(commands[0])
+            return
+
+        rows = queue.Queue(maxsize=self.queue_size)
+        slots = threading.Semaphore(self.concurrency)
+        stop = threading.Event()
+        running = set()
+
+        def put(item):
+            # don't block forever if the tree has stopped reading
+            while not stop.is_set():
+                try:
+                    rows.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def run(command):
+            with slots:
+                if stop.is_set():
+                    put(_Finished())
+                    return
+                try:
+                    for row in self.stream(command, stop, running):
+                        put(row)
+                except Exception as error:
+                    put(_Finished(error))
+                else:
+                    put(_Finished())
+
+        threads = [threading.Thread(target=run, args=(command, ), daemon=True) for command in commands]
+        for thread in threads:
+            thread.start()
+        try:
+            finished = 0
+            while finished < len(threads):
+                item = rows.get()
+                if isinstance(item, _Finished):
+                    finished += 1
+                    if item.error is not None:
+                        raise item.error
+                    continue
+                yield item
+        finally:
+            # an error in one command or the tree stopping early ends the rest
+            stop.set()
+            for process in list(running):
+                process.kill()
@@ -1,2 +1,3 @@
-from dss.models.base import Base
-__all__ = [Base]
\ No newline at end of file
+from dss.models.base import Base, derived_property
+from dss.models.members import Members
+__all__ = [Base, derived_property, Members]
@@ -1,22 +1,104 @@
 
-from dss.utils import define_action
+from dss.utils import row_hash
+from dss.models.comparator import get_comparator
+from dss.models.members import Members
 from collections import OrderedDict
+import datetime
+import enum
 import json
 
+
+def _fingerprint_value(value):
+    """
+    What goes into the fingerprint (see Base._kwargs) for a value json doesn't know about, and the model's _jsonencoder doesn't either:
+    dates, datetimes and enums (ie from the declared _types, see dss.datastore.converters) with their type,
+    so that two different dates never give the same fingerprint, and anything else as its repr
+    """
+    if isinstance(value, (datetime.date, datetime.time)):
+        return [value.__class__.__name__, value.isoformat()]
+    if isinstance(value, enum.Enum):
+        return [value.__class__.__qualname__, value.value]
+    if isinstance(value, (set, frozenset)):
+        try:
+            return sorted(value)
+        except TypeError:
+            return sorted(value, key=repr)
+    return [value.__class__.__qualname__, repr(value)]
+
+
+class derived_property:
+    """
+    Works like @property, but the value is computed once per object and then kept,
+    so that _kwargs, the diff and the templates all share the one computed value.
+
+    The kept values are thrown away whenever a tracked (non-underscore) attribute
+    of the object is reassigned, see Base.__setattr__
+
+    class User(Base):
+        @derived_property
+        def name(self):
+            return self.firstname + ' ' + self.lastname
+    """
+
+    def __init__(self, fget):
+        self.fget = fget
+        self.name = fget.__name__
+        self.__doc__ = fget.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        derived = getattr(obj, '_derived', None)
+        if derived is None:
+            # object.__setattr__ so that it ends up in __dict__ or in a slot named _derived, whichever the class has
+            derived = {}
+            object.__setattr__(obj, '_derived', derived)
+        try:
+            return derived[self.name]
+        except KeyError:
+            value = derived[self.name] = self.fget(obj)
+            return value
+
+    def __set__(self, obj, value):
+        # Same as a property without a setter
+        raise AttributeError("can't set attribute '{}'".format(self.name))
+
+
 class Base:
     """
     REMIND: Everything defined here has to begin (or end) with an underscore to avoid collisions in the framework.
     """
 
+    # Values kept by derived_property, made per object on first use
+    _derived = None
+
+    # Names of list or set attributes that are memberships, kept as Members, see dss.models.members
+    _members = ()
+
     # Classes in the model need to have idnumber for syncing to be meaningful
     def __init__(self, idnumber, **kwargs):
         self.idnumber = idnumber
+        for key in self._members:
+            if key in kwargs:
+                kwargs[key] = Members(kwargs[key])
         for key in kwargs:
             try:
                 setattr(self, key, kwargs[key])
             except AttributeError:
                 print("Cannot set {} {}".format(key, self))  # should be a log instead of a print
 
+    def __setattr__(self, name, value):
+        """
+        Reassigning a tracked attribute means any derived_property values could be stale
+        """
+        object.__setattr__(self, name, value)
+        if name[0] != '_':
+            derived = getattr(self, '_derived', None)
+            if derived:
+                derived.clear()
 
     # def _jsonencoder(self, obj):
     #     """
@@ -35,17 +117,21 @@ class Base:
         """
         all_properties = self._get_all_properties()
         if hasattr(self, '_jsonencoder'):
-            this = self
-            # FIXME: Let's declare this class outside of this local scope...
-            class json_encoder(json.JSONEncoder):
-                def default(self, obj):
-                    return this._jsonencoder(obj)
-            global_idnumber = json.dumps( (self.idnumber, all_properties), cls=json_encoder)
+            def default(obj):
+                encoded = self._jsonencoder(obj)
+                return _fingerprint_value(obj) if encoded is None else encoded
+            global_idnumber = json.dumps( (self.idnumber, all_properties), default=default)
         else:
-            global_idnumber = json.dumps( (self.idnumber, all_properties))
+            global_idnumber = json.dumps( (self.idnumber, all_properties), default=_fingerprint_value)
 
         return global_idnumber, all_properties
 
+    def _row_hash(self, columns):
+        """
+        Hash of just these attributes, in sorted order, to compare with the row hash a DB importer computes
+        """
+        return row_hash(*[getattr(self, column, None) for column in sorted(columns)])
+
     def _get_all_properties(self):
         ret = OrderedDict()
         keys = self.__class__._keys if hasattr(self.__class__, '_keys') else [k for k in sorted(dir(self)) if k == k.strip('_')]
@@ -90,6 +176,7 @@ class Base:
     def __sub__(self, other):
         """
         Go through each variable/property that isn't a callable and check them out
+        The attributes to check are worked out once per pair of classes, see dss.models.comparator
         """
 
         # Limitation: We don't process (yet?) for exact equivalencies across both objects
@@ -98,38 +185,9 @@ class Base:
 
         if not other:
             # This will be picked up in the key comparisons, so skip it
-            return
+            return iter(())
 
-        for attribute in [a for a in dir(self) if a == a.lstrip('_') and not callable(getattr(self, a))]:
-            
-            try:
-                this_attr = getattr(self, attribute)
-            except AttributeError:
-                yield define_action(self.idnumber, self, other, attribute, "err_no_attr(idnumber={},attribute={}, which='{}.{}')".format(self.idnumber, attribute, self._origtreename, self._branchname), True)
-                continue
-            try:
-                that_attr = getattr(other, attribute)
-            except AttributeError:
-                yield define_action(self.idnumber, self, other, attribute, "err_no_attr(idnumber={}, attribute={}, which='{}.{}')".format(self.idnumber, attribute, other._origtreename, self._branchname), True)
-                continue
-
-            if type(this_attr) != type(that_attr):
-                yield define_action(self.idnumber, self, other, attribute, "err_integrity(attribute={}, left_type='{}', right_type='{}', which='{}.{}')".format(attribute, type(this_attr), type(that_attr), self._origtreename, self._branchname), True)
-
-            if isinstance(this_attr, list):  # both are lists
-                for to_add in set(this_attr) - set(that_attr):
-                    yield define_action(other.idnumber, self, other, to_add, "add_{attribute}_to_{branch}(idnumber={idnumber}, to={to_}, attribute={attribute}, which='{which}')".format(idnumber=other.idnumber, attribute=attribute, to_=to_add, branch=other._branchname, which='{}.{}'.format(other._origtreename, other._branchname)), None)
-                for to_remove in set(that_attr) - set(this_attr):
-                    yield define_action(other.idnumber, self, other, to_remove, "remove_{attribute}_from_{branch}(idnumber={idnumber}, to={to_}, attribute={attribute}, which='{which}')".format(idnumber=other.idnumber, attribute=attribute, to_=to_remove, branch=other._branchname, which='{}.{}'.format(self._origtreename, self._branchname)), None)
-
-            elif isinstance(this_attr, set):  # both are sets
-                for to_add in this_attr - that_attr:
-                    yield define_action(other.idnumber, self, other, to_add, "add_{attribute}_to_{branch}(idnumber={idnumber}, to={to_}, attribute={attribute}, which='{which}')".format(idnumber=other.idnumber, attribute=attribute, to_=to_add, branch=other._branchname, which='{}.{}'.format(other._origtreename, other._branchname)), None)
-                for to_remove in that_attr - this_attr:
-                    yield define_action(other.idnumber, self, other, to_remove, "remove_{attribute}_from_{branch}(idnumber={idnumber}, to={to_}, attribute={attribute}, which='{which}')".format(idnumber=other.idnumber, attribute=attribute, to_=to_remove, branch=other._branchname, which='{}.{}'.format(self._origtreename, self._branchname)), None)
-
-            elif this_attr != that_attr:
-                yield define_action(self.idnumber, self, other, this_attr, "update_{}(idnumber={}, left_value={}, right_value={})".format(attribute, self.idnumber, getattr(self, attribute), getattr(other, attribute)), None)
+        return get_comparator(self, other)(self, other)
 
     def __repr__(self):
         """
@@ -0,0 +1,299 @@
+"""
+Compiled comparators used by Base.__sub__
+
+Working out which attributes of an object are tracked (dir, filtering out the
+underscores, calling callable on each one) is the same work for every instance of a class,
+so we do it once per (left class, right class) pair and keep the result around.
+
+The comparison itself is compiled too: for each tuple of tracked attributes one function is generated
+with the attributes written out (this.firstname rather than getattr(this, attribute) in a loop),
+and whatever is done with the differences is up to the collector it is given:
+ACTIONS makes the actions for the diff, COUNTS only counts them for DataStoreTree.plan
+
+Models can declare which attributes take part in the diff:
+
+class User(Base):
+    _include = ['username', 'name']   # only these are compared
+    _exclude = ['kind']               # everything but these is compared
+"""
+
+import keyword
+from dss.utils import define_action
+from dss.models.members import Members, merge_diff
+
+# (left class, right class, instance layout) -> AttributeComparator
+_comparators = {}
+
+# attributes tuple -> the compiled functions, see _compile
+_compiled = {}
+
+# stands in for the value of an attribute the object doesn't have
+MISSING = object()
+
+
+def _layout(obj):
+    """
+    The attributes set on the instance itself also show up in dir(),
+    so they are part of what makes a plan reusable
+    """
+    return tuple(getattr(obj, '__dict__', ()))
+
+
+def tracked_attributes(obj):
+    """
+    The attributes that take part in the diff, in the order they are compared
+    """
+    klass = obj.__class__
+    include = getattr(klass, '_include', None)
+    exclude = getattr(klass, '_exclude', None) or ()
+    if include is not None:
+        attributes = sorted(include)
+    else:
+        attributes = [a for a in dir(obj) if a == a.lstrip('_') and not callable(getattr(obj, a))]
+    return tuple(a for a in attributes if a not in exclude)
+
+
+def get_comparator(this, other):
+    try:
+        key = (this.__class__, other.__class__, tuple(this.__dict__))
+    except AttributeError:
+        key = (this.__class__, other.__class__, _layout(this))
+    comparator = _comparators.get(key)
+    if comparator is None:
+        comparator = _comparators[key] = AttributeComparator(tracked_attributes(this))
+    return comparator
+
+
+def clear_comparators():
+    """
+    Forget the compiled comparators, needed if model classes are changed at runtime
+    """
+    _comparators.clear()
+    _compiled.clear()
+
+
+def _diff_scalar(this, other, attribute, this_attr, that_attr):
+    if this_attr != that_attr:
+        yield define_action(this.idnumber, this, other, this_attr, "update_{}(idnumber={}, left_value={}, right_value={})".format(attribute, this.idnumber, this_attr, that_attr), None)
+
+
+def _diff_members(this, other, attribute, to_add, to_remove):
+    for to_ in to_add:
+        yield define_action(other.idnumber, this, other, to_, "add_{attribute}_to_{branch}(idnumber={idnumber}, to={to_}, attribute={attribute}, which='{which}')".format(idnumber=other.idnumber, attribute=attribute, to_=to_, branch=other._branchname, which='{}.{}'.format(other._origtreename, other._branchname)), None)
+    for to_ in to_remove:
+        yield define_action(other.idnumber, this, other, to_, "remove_{attribute}_from_{branch}(idnumber={idnumber}, to={to_}, attribute={attribute}, which='{which}')".format(idnumber=other.idnumber, attribute=attribute, to_=to_, branch=other._branchname, which='{}.{}'.format(this._origtreename, this._branchname)), None)
+
+
+def _diff_list(this, other, attribute, this_attr, that_attr):
+    this_set, that_set = set(this_attr), set(that_attr)
+    yield from _diff_members(this, other, attribute, this_set - that_set, that_set - this_set)
+
+
+def _diff_set(this, other, attribute, this_attr, that_attr):
+    yield from _diff_members(this, other, attribute, this_attr - that_attr, that_attr - this_attr)
+
+
+def _diff_sorted_members(this, other, attribute, this_attr, that_attr):
+    yield from _diff_members(this, other, attribute, *merge_diff(this_attr, that_attr))
+
+
+# Counting versions of the strategies for AttributeComparator.tally, yield (func_name, how many)
+
+def _count_scalar(this, other, attribute, this_attr, that_attr):
+    if this_attr != that_attr:
+        yield 'update_' + attribute, 1
+
+
+def _count_members(other, attribute, to_add, to_remove):
+    if to_add:
+        yield 'add_{}_to_{}'.format(attribute, other._branchname), len(to_add)
+    if to_remove:
+        yield 'remove_{}_from_{}'.format(attribute, other._branchname), len(to_remove)
+
+
+def _count_list(this, other, attribute, this_attr, that_attr):
+    this_set, that_set = set(this_attr), set(that_attr)
+    yield from _count_members(other, attribute, this_set - that_set, that_set - this_set)
+
+
+def _count_set(this, other, attribute, this_attr, that_attr):
+    yield from _count_members(other, attribute, this_attr - that_attr, that_attr - this_attr)
+
+
+def _count_sorted_members(this, other, attribute, this_attr, that_attr):
+    yield from _count_members(other, attribute, *merge_diff(this_attr, that_attr))
+
+
+_counters = {
+    _diff_scalar: _count_scalar,
+    _diff_list: _count_list,
+    _diff_set: _count_set,
+    _diff_sorted_members: _count_sorted_members,
+}
+
+
+def _strategy(value):
+    if isinstance(value, Members):
+        return _diff_sorted_members
+    if isinstance(value, list):
+        return _diff_list
+    if isinstance(value, set):
+        return _diff_set
+    return _diff_scalar
+
+
+class _Actions:
+    """
+    Collector that makes the actions of the diff
+    """
+
+    @staticmethod
+    def no_attr(this, other, attribute, on_this):
+        if on_this:
+            yield define_action(this.idnumber, this, other, attribute, "err_no_attr(idnumber={},attribute={}, which='{}.{}')".format(this.idnumber, attribute, this._origtreename, this._branchname), True)
+        else:
+            yield define_action(this.idnumber, this, other, attribute, "err_no_attr(idnumber={}, attribute={}, which='{}.{}')".format(this.idnumber, attribute, other._origtreename, this._branchname), True)
+
+    @staticmethod
+    def integrity(this, other, attribute, this_attr, that_attr):
+        yield define_action(this.idnumber, this, other, attribute, "err_integrity(attribute={}, left_type='{}', right_type='{}', which='{}.{}')".format(attribute, type(this_attr), type(that_attr), this._origtreename, this._branchname), True)
+
+    @staticmethod
+    def changed(strategy, this, other, attribute, this_attr, that_attr):
+        return strategy(this, other, attribute, this_attr, that_attr)
+
+
+class _Counts:
+    """
+    Collector that yields (func_name, how many) instead of the actions, see AttributeComparator.tally
+    """
+
+    @staticmethod
+    def no_attr(this, other, attribute, on_this):
+        yield 'err_no_attr', 1
+
+    @staticmethod
+    def integrity(this, other, attribute, this_attr, that_attr):
+        yield 'err_integrity', 1
+
+    @staticmethod
+    def changed(strategy, this, other, attribute, this_attr, that_attr):
+        return _counters[strategy](this, other, attribute, this_attr, that_attr)
+
+
+ACTIONS = _Actions()
+COUNTS = _Counts()
+
+
+def _access(obj, attribute):
+    if attribute.isidentifier() and not keyword.iskeyword(attribute):
+        return "{}.{}".format(obj, attribute)
+    return "getattr({}, {!r})".format(obj, attribute)
+
+
+def _source(attributes, from_values):
+    """
+    The source of the comparison over these attributes, reading the values of this as it goes,
+    or from_values, from the list read gave beforehand
+    """
+    name = 'compare_values' if from_values else 'compare'
+    lines = ["def {}(this, other, values, collector, strategy):".format(name)]
+    for index, attribute in enumerate(attributes):
+        if from_values:
+            lines += [
+                "    a = values[{}]".format(index),
+                "    if a is MISSING:",
+                "        yield from collector.no_attr(this, other, {!r}, True)".format(attribute),
+                "    else:",
+            ]
+        else:
+            lines += [
+                "    try:",
+                "        a = {}".format(_access('this', attribute)),
+                "    except AttributeError:",
+                "        yield from collector.no_attr(this, other, {!r}, True)".format(attribute),
+                "    else:",
+            ]
+        lines += [
+            "        try:",
+            "            b = {}".format(_access('other', attribute)),
+            "        except AttributeError:",
+            "            yield from collector.no_attr(this, other, {!r}, False)".format(attribute),
+            "        else:",
+            "            if a is not b:",
+            "                if type(a) is not type(b):",
+            "                    yield from collector.integrity(this, other, {!r}, a, b)".format(attribute),
+            "                    yield from collector.changed(strategy({0!r}, a), this, other, {0!r}, a, b)".format(attribute),
+            "                elif a != b:",
+            "                    yield from collector.changed(strategy({0!r}, a), this, other, {0!r}, a, b)".format(attribute),
+        ]
+    if not attributes:
+        lines += ["    return", "    yield"]
+    return "\n".join(lines) + "\n"
+
+
+def _compile(attributes):
+    """
+    (compare, compare_values, read) for the attributes, generated once per attributes tuple:
+    compare(this, other, None, collector, strategy) and compare_values(this, other, values, collector, strategy)
+    yield what the collector gives for each difference, in the order of the attributes,
+    read(this) is the list of the values of this, MISSING for any it doesn't have
+    """
+    compiled = _compiled.get(attributes)
+    if compiled is None:
+        namespace = {'MISSING': MISSING}
+        read = ["def read(this):", "    values = []"]
+        for attribute in attributes:
+            read += [
+                "    try:",
+                "        values.append({})".format(_access('this', attribute)),
+                "    except AttributeError:",
+                "        values.append(MISSING)",
+            ]
+        read.append("    return values")
+        source = _source(attributes, False) + _source(attributes, True) + "\n".join(read) + "\n"
+        exec(compile(source, '<comparator {}>'.format(", ".join(attributes)), 'exec'), namespace)
+        compiled = _compiled[attributes] = (namespace['compare'], namespace['compare_values'], namespace['read'])
+    return compiled
+
+
+class AttributeComparator:
+    """
+    Holds the explicit list of tracked attributes for a pair of classes,
+    the strategy (scalar, list, set or Members) used for each one, and the compiled comparison
+    """
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+        # attribute -> (type of value, strategy), filled in as values are seen
+        self.strategies = {}
+        self.compare, self.compare_values, self.read = _compile(attributes)
+
+    def strategy(self, attribute, value):
+        seen = self.strategies.get(attribute)
+        if seen is None or seen[0] is not type(value):
+            # first time we see this attribute, or its value changed type
+            seen = self.strategies[attribute] = (type(value), _strategy(value))
+        return seen[1]
+
+    def values(self, this):
+        """
+        The values of the tracked attributes of this, in order, MISSING for any it doesn't have
+        Worked out once, they can be diffed against any number of others with diff_values, see DataStoreTree.fanout
+        """
+        return self.read(this)
+
+    def __call__(self, this, other):
+        return self.compare(this, other, None, ACTIONS, self.strategy)
+
+    def diff_values(self, this, values, other):
+        """
+        Same as __call__, with the values of this already read by self.values
+        """
+        return self.compare_values(this, other, values, ACTIONS, self.strategy)
+
+    def tally(self, this, other):
+        """
+        Yields (func_name, how many) for the actions that __call__ would yield, without making them
+        """
+        return self.compare(this, other, None, COUNTS, self.strategy)
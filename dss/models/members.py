@@ -0,0 +1,61 @@
+"""
+Canonical form for membership attributes (group members, course enrolments...)
+
+Declare them on the model, on both sides of the sync:
+
+class Group(Base):
+    _members = ['members']
+
+and Base.__init__ keeps them as Members: sorted, without duplicates, and immutable,
+so they can be diffed with a single linear merge instead of building sets for every object
+"""
+
+
+def _sort_key(value):
+    # for when the values are of types that can't be compared, group them by type
+    return (type(value).__name__, value)
+
+
+class Members(tuple):
+    __slots__ = ()
+
+    def __new__(cls, values=()):
+        if isinstance(values, Members):
+            return values
+        # sorting before dropping the duplicates lets sorted make use of any runs already in the input
+        try:
+            ordered = sorted(values)
+        except TypeError:
+            ordered = sorted(values, key=_sort_key)
+        return super().__new__(cls, dict.fromkeys(ordered))
+
+    def __repr__(self):
+        return "Members({})".format(list(self))
+
+
+def merge_diff(this, that):
+    """
+    For two Members, returns (in this but not that, in that but not this), both in order
+    """
+    to_add, to_remove = [], []
+    i, j = 0, 0
+    len_this, len_that = len(this), len(that)
+    try:
+        while i < len_this and j < len_that:
+            a, b = this[i], that[j]
+            if a == b:
+                i += 1
+                j += 1
+            elif a < b:
+                to_add.append(a)
+                i += 1
+            else:
+                to_remove.append(b)
+                j += 1
+    except TypeError:
+        # mixed types that can't be compared, do it the long way
+        this_set, that_set = set(this), set(that)
+        return [a for a in this if a not in that_set], [b for b in that if b not in this_set]
+    to_add.extend(this[i:])
+    to_remove.extend(that[j:])
+    return to_add, to_remove
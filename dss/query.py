@@ -0,0 +1,273 @@
+"""
+Answers questions about imported trees over a local Unix socket, so other tools don't have to read the sources again
+
+service = QueryService([source, dest], '/tmp/mysync-query.sock')
+service.start()
+...
++source                 # or refresh
+service.publish()       # readers see the new data from here on, all at once
+
+Requests and answers are JSON, one per line:
+{"op": "get", "branch": "Source.users", "keys": ["123", "456"]}     {"objects": {"123": {...}, "456": null}}
+{"op": "get_from_attribute", "branch": "Source.users", "attribute": "username", "value": "joe", "all": false}
+{"op": "keys_startswith", "branch": "Source.users", "prefix": "12"}  {"keys": [...]}
+{"op": "diff", "source": "Source", "dest": "Dest", "branch": "users", "keys": ["123"]}   {"actions": {"123": [...]}}
+{"op": "batch", "requests": [...]}                                   {"answers": [...]}
+{"op": "branches"}
+
+Keys in requests are always JSON, so "123" finds the object whose idnumber is the int 123: they are converted with the
+branch's declared type of idnumber (see dss.datastore.converters.compile_key), or matched by their string.
+Answers are labelled with the keys as the request has them.
+Objects are given as {"idnumber", "branch", "tree", "properties"}, the values that the model's _jsonencoder can't
+handle as strings (see dss.utils.encode_object). The answers come from a published view of the stores: publish copies the branch stores
+(but not the objects) and swaps the view in with one assignment, so a refresh going on at the same time is never seen half done.
+Given the branches that were refreshed (as dss.daemon does), publish copies just those, and the rest are shared with the previous view.
+Each view encodes an object once and builds indexes for get_from_attribute and keys_startswith as they are asked for.
+A request that fails gets {"error": ...} as its answer, and the service carries on.
+"""
+
+import bisect
+import json
+import os
+import socket
+import socketserver
+import threading
+import traceback
+from dss.datastore.converters import compile_key
+from dss.utils import bind_unix_server, encode_object
+
+
+class QueryError(Exception):
+    pass
+
+
+class View:
+    """
+    What the service answers from: {branch fullname: copy of the store} and {tree name: tree}
+    Never changed once published, apart from the caches filled in as questions are asked
+    With previous and changed (branch fullnames), only the changed branches are copied,
+    the others keep the previous view's copy and indexes
+    """
+
+    def __init__(self, trees, previous=None, changed=None):
+        self.trees = {tree.__class__.__name__: tree for tree in trees}
+        self.stores = {}
+        # fullname -> the converter for keys given as JSON, and the keys by their string, made when first needed
+        self.key_converters = {}
+        self.string_keys = {}
+        self.encoded = {}
+        self.attribute_indexes = {}
+        self.sorted_keys = {}
+        for tree in trees:
+            for branch in tree.branches:
+                fullname = branch.fullname
+                if not fullname.startswith(tree.__class__.__name__ + '.'):
+                    continue
+                if previous is not None and changed is not None and fullname not in changed and fullname in previous.stores:
+                    self.stores[fullname] = previous.stores[fullname]
+                    self.key_converters[fullname] = previous.key_converters[fullname]
+                    for cache in ('sorted_keys', 'string_keys'):
+                        if fullname in getattr(previous, cache):
+                            getattr(self, cache)[fullname] = getattr(previous, cache)[fullname]
+                    continue
+                branch.materialize_all()
+                self.stores[fullname] = dict(branch.store)
+                self.key_converters[fullname] = compile_key(getattr(branch, '_types', None))
+        if previous is not None:
+            for (fullname, attribute), index in previous.attribute_indexes.items():
+                if self.stores.get(fullname) is previous.stores[fullname]:
+                    self.attribute_indexes[ (fullname, attribute) ] = index
+
+    def store(self, fullname):
+        try:
+            return self.stores[fullname]
+        except KeyError:
+            raise QueryError("No branch {}, use one of {}".format(fullname, ", ".join(self.stores)))
+
+    def key(self, fullname, key):
+        """
+        The key of the store that a key from a request stands for, the key itself if there isn't one
+        """
+        store = self.store(fullname)
+        try:
+            if key in store:
+                return key
+        except TypeError:
+            return key
+        convert = self.key_converters.get(fullname)
+        if convert is not None:
+            try:
+                converted = convert(key)
+            except ValueError:
+                pass
+            else:
+                if converted in store:
+                    return converted
+        string_keys = self.string_keys.get(fullname)
+        if string_keys is None:
+            string_keys = self.string_keys[fullname] = {str(each): each for each in store}
+        return string_keys.get(str(key), key)
+
+    def encode(self, obj):
+        if obj is None:
+            return 'null'
+        key = id(obj)
+        text = self.encoded.get(key)
+        if text is None:
+            text = self.encoded[key] = encode_object(obj)
+        return text
+
+    def attribute_index(self, fullname, attribute):
+        index = self.attribute_indexes.get( (fullname, attribute) )
+        if index is None:
+            index = {}
+            for obj in self.store(fullname).values():
+                value = getattr(obj, attribute, None)
+                try:
+                    index.setdefault(value, []).append(obj)
+                except TypeError:
+                    # lists and the like, look them up by their string
+                    index.setdefault(str(value), []).append(obj)
+            self.attribute_indexes[ (fullname, attribute) ] = index
+        return index
+
+    def keys_startswith(self, fullname, prefix):
+        keys = self.sorted_keys.get(fullname)
+        if keys is None:
+            keys = self.sorted_keys[fullname] = sorted(str(key) for key in self.store(fullname))
+        start = bisect.bisect_left(keys, prefix)
+        end = start
+        while end < len(keys) and keys[end].startswith(prefix):
+            end += 1
+        return keys[start:end]
+
+
+class QueryService:
+
+    def __init__(self, trees, socket_path, socket_mode=0o600):
+        """
+        socket_mode: permissions of the socket, by default only the user the service runs as can connect
+        """
+        self.trees = list(trees)
+        self.socket_path = socket_path
+        self.socket_mode = socket_mode
+        self.server = None
+        self.view = None
+        self.publish()
+
+    def publish(self, changed=None):
+        """
+        Take a new view of the trees and swap it in
+        changed: fullnames of the branches that have changed since the last publish, None for all of them
+        """
+        self.view = View(self.trees, self.view, changed)
+
+    def answer(self, request, view=None):
+        """
+        The answer to one request, as JSON text
+        """
+        view = view or self.view
+        try:
+            op = request.get('op')
+            if op == 'get':
+                store = view.store(request['branch'])
+                keys = request['keys'] if 'keys' in request else [request['key']]
+                return '{"objects": {' + ", ".join('{}: {}'.format(json.dumps(str(key)), view.encode(store.get(view.key(request['branch'], key)))) for key in keys) + '}}'
+            if op == 'get_from_attribute':
+                value = request['value']
+                try:
+                    found = view.attribute_index(request['branch'], request['attribute']).get(value, [])
+                except TypeError:
+                    found = view.attribute_index(request['branch'], request['attribute']).get(str(value), [])
+                if request.get('all'):
+                    return '{"objects": [' + ", ".join(view.encode(obj) for obj in found) + ']}'
+                return '{"object": ' + view.encode(found[0] if found else None) + '}'
+            if op == 'keys_startswith':
+                return json.dumps({'keys': view.keys_startswith(request['branch'], request['prefix'])})
+            if op == 'diff':
+                source_name, dest_name = request['source'] + '.' + request['branch'], request['dest'] + '.' + request['branch']
+                source, dest = view.store(source_name), view.store(dest_name)
+                actions = {}
+                for key in request['keys'] if 'keys' in request else [request['key']]:
+                    source_key, dest_key = view.key(source_name, key), view.key(dest_name, key)
+                    this, that = source.get(source_key), dest.get(dest_key)
+                    if this is None and that is None:
+                        actions[key] = None
+                    elif that is None:
+                        actions[key] = [{'func_name': 'new_' + request['branch'], 'message': "new_{}(idnumber={})".format(request['branch'], source_key)}]
+                    elif this is None:
+                        actions[key] = [{'func_name': 'old_' + request['branch'], 'message': "old_{}(idnumber={})".format(request['branch'], dest_key)}]
+                    else:
+                        actions[key] = [{'func_name': action.func_name, 'message': action.message, 'error': action.error} for action in (this - that)] if this is not that else []
+                return json.dumps({'actions': actions}, default=str)
+            if op == 'batch':
+                # all of them from the same view
+                return '{"answers": [' + ", ".join(self.answer(each, view) for each in request['requests']) + ']}'
+            if op == 'branches':
+                return json.dumps({'branches': {name: len(store) for name, store in view.stores.items()}})
+            raise QueryError("Unknown op {}".format(op))
+        except (QueryError, KeyError) as error:
+            return json.dumps({'error': str(error)})
+        except Exception as error:
+            # a bad request (or a model that can't be encoded) shouldn't take the service down
+            traceback.print_exc()
+            return json.dumps({'error': "{}: {}".format(error.__class__.__name__, error)})
+
+    def start(self):
+        self.server = bind_unix_server(QueryServer, self.socket_path, QueryHandler, self.socket_mode)
+        self.server.query_service = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        service = self.server.query_service
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError as error:
+                answer = json.dumps({'error': "Not JSON: {}".format(error)})
+            else:
+                answer = service.answer(request)
+            self.wfile.write(answer.encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class QueryServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class QueryClient:
+    """
+    Keeps the connection open, so each question costs one round trip
+    client = QueryClient('/tmp/mysync-query.sock')
+    client.get('Source.users', '123', '456')
+    """
+
+    def __init__(self, socket_path, timeout=10):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(socket_path)
+        self.file = self.socket.makefile('rwb')
+
+    def ask(self, request):
+        self.file.write(json.dumps(request).encode('utf-8') + b'\n')
+        self.file.flush()
+        return json.loads(self.file.readline())
+
+    def get(self, branch, *keys):
+        return self.ask({'op': 'get', 'branch': branch, 'keys': list(keys)})['objects']
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
@@ -11,7 +11,7 @@ class Kind(Enum):
 	administrator = 2
 	undefined = -1
 
-from dss.models import Base
+from dss.models import Base, derived_property
 
 class BaseUser(Base):
 	"""
@@ -34,7 +34,7 @@ class BaseUser(Base):
 	# properties that do not have underscore are also tracked
 	kind = Kind.undefined
 
-	@property
+	@derived_property
 	def name(self):
 		return self.firstname + ' ' + self.lastname
 
@@ -50,7 +50,7 @@ class BaseStudent(BaseUser):
 	"""
 	kind = Kind.student
 
-	@property
+	@derived_property
 	def grade(self):
 		"""
 		Remove anything from the homerooom string that isn't numerical
@@ -74,7 +74,7 @@ class LeftStudent(BaseStudent):
 	firstname + lastname + year of graduation
 	Which is a calculation
 	"""
-	@property
+	@derived_property
 	def username(self):
 		return (self.firstname + self.lastname + self._year_of_graduation()).lower().replace(' ', '')
 
@@ -1,2 +1,2 @@
-from dss.templates.default_template import DefaultTemplate
-__all__ = [DefaultTemplate]
\ No newline at end of file
+from dss.templates.default_template import DefaultTemplate, Deferred, DEFERRED
+__all__ = [DefaultTemplate, Deferred, DEFERRED]
\ No newline at end of file
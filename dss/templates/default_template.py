@@ -1,7 +1,30 @@
 debug = False
 
+class Deferred:
+    """
+    What a handler returns when it can't tell yet whether the action worked, ie it was buffered by a DBSink
+    The tree doesn't call success or fail for it, whatever buffered it does that later
+    """
+
+    def __repr__(self):
+        return 'DEFERRED'
+
+DEFERRED = Deferred()
+
 class DefaultTemplate:
 
+    def add_sink(self, sink):
+        """
+        Sinks given the template (see dss.importers.db_sink) add themselves, so that finish flushes them
+        """
+        sinks = self.__dict__.setdefault('_sinks', [])
+        if sink not in sinks:
+            sinks.append(sink)
+
+    def flush_sinks(self):
+        for sink in self.__dict__.get('_sinks', ()):
+            sink.flush()
+
     def result_bool(self, result):
         return False
 
@@ -11,6 +34,13 @@ class DefaultTemplate:
     def fail(self, action, result):
         pass
 
+    def finish(self):
+        """
+        Called once >> has applied every action, ie to flush what handlers have buffered
+        The sinks the template has are flushed after it, even if an override doesn't call this
+        """
+        self.flush_sinks()
+
     def __call__(self, action):
         debug and print(action.message)
         try:
@@ -1,15 +1,118 @@
-import re, importlib
+import heapq, os, pickle, tempfile
+import hashlib
+import json
 from collections import namedtuple
 
 ActionItem = namedtuple("ActionItem", ['idnumber', 'source', 'dest', 'attribute', 'message', 'func_name', 'error'])
 
+DanglingReference = namedtuple("DanglingReference", ['branch', 'idnumber', 'attribute', 'target', 'missing'])
+
 def define_action(idnumber, source, dest, attribute, message, error):
     func_name = message[:message.index('(')]
     return ActionItem(idnumber, source, dest, attribute, message, func_name, error)
 
+def row_hash(*values):
+    """
+    The hash of a row of values, in the canonical form that DB importers reproduce in SQL:
+    md5 of the values as text (None as empty) joined with the unit separator
+    """
+    return hashlib.md5('\x1f'.join('' if v is None else str(v) for v in values).encode('utf-8')).hexdigest()
+
+def encode_object(obj):
+    """
+    A model object as JSON text: {"idnumber", "branch", "tree", "properties"},
+    using the model's _jsonencoder for values json doesn't know about, and their string if that gives None
+    Used by the journal (dss.datastore.journal) and the query service (dss.query)
+    """
+    properties = obj._get_all_properties() if hasattr(obj, '_get_all_properties') else dict(obj.__dict__)
+
+    def default(value):
+        encoded = obj._jsonencoder(value) if hasattr(obj, '_jsonencoder') else None
+        return str(value) if encoded is None else encoded
+
+    return json.dumps({
+        'idnumber': obj.idnumber,
+        'branch': getattr(obj, '_branchname', None),
+        'tree': getattr(obj, '_origtreename', None),
+        'properties': {k: v for k, v in properties.items() if k != 'idnumber'},
+    }, default=default)
+
+def bind_unix_server(server_class, socket_path, handler_class, mode):
+    """
+    A socketserver server_class bound to the Unix socket at socket_path (removed first if it's there),
+    which has the permissions in mode from the moment it exists: the umask is set so that the socket is made with them,
+    and put back straight after, as it is the whole process's
+    Used by the daemon (dss.daemon) and the query service (dss.query)
+    """
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    previous = os.umask(0o777 & ~mode)
+    try:
+        return server_class(socket_path, handler_class)
+    finally:
+        os.umask(previous)
+
 def split_import_specifier(the_string):
     """
     Eg) 'module.submodule.Class' string return tuple 'module.submodule', 'Class'
     """
     split = the_string.split('.')
     return (".".join(split[:-1]), split[-1])
+
+class ExternalSorter:
+    """
+    Sorts what is added to it without holding it all in memory:
+    once buffer_size items are held, they are sorted and spilled to a temporary file as a run,
+    then iterating merges the runs back together as a stream
+    Items must be picklable
+    """
+
+    def __init__(self, buffer_size=100000, key=None):
+        self.buffer_size = buffer_size
+        self.key = key
+        self.buffer = []
+        self.runs = []
+
+    def add(self, item):
+        self.buffer.append(item)
+        if len(self.buffer) >= self.buffer_size:
+            self.spill()
+
+    def spill(self):
+        self.buffer.sort(key=self.key)
+        run = tempfile.TemporaryFile()
+        for start in range(0, len(self.buffer), 1000):
+            pickle.dump(self.buffer[start:start + 1000], run, pickle.HIGHEST_PROTOCOL)
+        run.seek(0)
+        self.runs.append(run)
+        self.buffer = []
+
+    @staticmethod
+    def read(run):
+        try:
+            while True:
+                try:
+                    chunk = pickle.load(run)
+                except EOFError:
+                    return
+                yield from chunk
+        finally:
+            run.close()
+
+    def __iter__(self):
+        if not self.runs:
+            self.buffer.sort(key=self.key)
+            yield from self.buffer
+            return
+        self.spill()
+        runs, self.runs = self.runs, []
+        yield from heapq.merge(*[self.read(run) for run in runs], key=self.key)
+
+def external_sort(iterable, buffer_size=100000, key=None):
+    """
+    Sorts what the iterable yields with an ExternalSorter
+    """
+    sorter = ExternalSorter(buffer_size, key)
+    for item in iterable:
+        sorter.add(item)
+    yield from sorter
@@ -0,0 +1,174 @@
+"""
+Rows with list values are merged per idnumber, whether the importer gives them sorted by key or interleaved
+(through a sort that spills to disk), and the merged branch diffs as one imported from merged rows does
+"""
+
+import unittest
+
+from dss.datastore.branch import DataStoreBranches
+from dss.datastore.tree import DataStoreTree, DataStoreTreeMeta
+from dss.importers.default_importer import DefaultImporter
+from dss.models.base import Base
+
+GROUPS = {'g{}'.format(g): ['u{}'.format(g * 10 + m) for m in range(g % 4 + 1)] for g in range(12)}
+
+
+class Group(Base):
+    pass
+
+
+class MergedImporter(DefaultImporter):
+    """
+    One row per group, with all its members
+    """
+
+    def readin(self):
+        for idnumber, members in GROUPS.items():
+            yield dict(idnumber=idnumber, name=idnumber.upper(), members=list(members))
+
+
+class InterleavedImporter(DefaultImporter):
+    """
+    One row per member, the first member of every group, then the second of every group that has one, and so on
+    """
+
+    def readin(self):
+        for position in range(max(len(members) for members in GROUPS.values())):
+            for idnumber, members in GROUPS.items():
+                if position < len(members):
+                    yield dict(idnumber=idnumber, name=idnumber.upper(), members=[members[position]])
+
+
+class SortedImporter(DefaultImporter):
+    """
+    One row per member, all those of a group one after the other
+    """
+    sorted_by_key = True
+
+    def readin(self):
+        for idnumber, members in GROUPS.items():
+            for member in members:
+                yield dict(idnumber=idnumber, name=idnumber.upper(), members=[member])
+
+
+class DestImporter(DefaultImporter):
+
+    def readin(self):
+        # g1 has lost a member and g2 has one it shouldn't, g3 has another name, g11 isn't there and g99 is old
+        for idnumber, members in GROUPS.items():
+            if idnumber == 'g11':
+                continue
+            members = {'g1': members[:1], 'g2': members + ['u99']}.get(idnumber, members)
+            yield dict(idnumber=idnumber, name='OTHER' if idnumber == 'g3' else idnumber.upper(), members=list(members))
+        yield dict(idnumber='g99', name='G99', members=[])
+
+
+class MergedBranches(DataStoreBranches):
+    _importer = __name__ + '.MergedImporter'
+
+
+class InterleavedBranches(DataStoreBranches):
+    _importer = __name__ + '.InterleavedImporter'
+
+
+class SortedBranches(DataStoreBranches):
+    _importer = __name__ + '.SortedImporter'
+
+
+class DestBranches(DataStoreBranches):
+    _importer = __name__ + '.DestImporter'
+
+
+class CountedHooks:
+    """
+    Keeps the idnumber of every object make is asked for, new or not
+    """
+    made = []
+
+    @classmethod
+    def did_make_new(cls, new, *args, **kwargs):
+        cls.made.append(new.idnumber)
+
+    @classmethod
+    def will_return_old(cls, old, *args, **kwargs):
+        cls.made.append(old.idnumber)
+
+
+class MergedGroups(MergedBranches):
+    _branchname = 'groups'
+    _klass = __name__ + '.Group'
+
+
+class InterleavedGroups(CountedHooks, InterleavedBranches):
+    _branchname = 'groups'
+    _klass = __name__ + '.Group'
+
+
+class SortedGroups(CountedHooks, SortedBranches):
+    _branchname = 'groups'
+    _klass = __name__ + '.Group'
+
+
+class DestGroups(DestBranches):
+    _branchname = 'groups'
+    _klass = __name__ + '.Group'
+
+
+class Merged(DataStoreTree):
+    _branches = __name__ + '.MergedBranches'
+
+
+class Interleaved(DataStoreTree):
+    _branches = __name__ + '.InterleavedBranches'
+
+
+class Sorted(DataStoreTree):
+    _branches = __name__ + '.SortedBranches'
+
+
+class Dest(DataStoreTree):
+    _branches = __name__ + '.DestBranches'
+
+
+class AggregateTest(unittest.TestCase):
+
+    def setUp(self):
+        DataStoreTreeMeta._store.clear()
+        DataStoreTreeMeta._storeobjects.clear()
+        self.dest = Dest()
+        +self.dest
+        merged = Merged()
+        +merged
+        self.expected = sorted(action.message for action in merged - self.dest)
+
+    def check(self, source):
+        +source
+        self.assertEqual(sorted(source.groups.keys()), sorted(GROUPS))
+        for idnumber, members in GROUPS.items():
+            self.assertEqual(source.groups.get(idnumber).members, members)
+        self.assertEqual(sorted(action.message for action in source - self.dest), self.expected)
+
+    def test_plain_diff(self):
+        self.assertIn('new_groups(idnumber=g11)', self.expected)
+        self.assertIn('update_name(idnumber=g3, left_value=G3, right_value=OTHER)', self.expected)
+        self.assertEqual(len([message for message in self.expected if message.startswith('add_members')]), 1)
+        self.assertEqual(len([message for message in self.expected if message.startswith('remove_members')]), 1)
+
+    def test_sorted_by_key(self):
+        self.check(Sorted())
+
+    def test_interleaved(self):
+        self.check(Interleaved())
+
+    def test_interleaved_spilling_to_disk(self):
+        self.check(Interleaved(sort_buffer=5))
+
+    def test_each_group_made_once(self):
+        for source in (Sorted(), Interleaved(sort_buffer=5)):
+            del CountedHooks.made[:]
+            +source
+            self.assertEqual(sorted(CountedHooks.made), sorted(GROUPS))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+"""
+The daemon over its socket: made owner-only from the start, answers status, takes refresh, reload and stop,
+and each cycle refreshes the trees and syncs them, unless the plan is out of the limits
+"""
+
+import contextlib
+import io
+import os
+import signal
+import stat
+import tempfile
+import threading
+import time
+import unittest
+
+from dss.daemon import SyncDaemon, send
+from dss.datastore.branch import DataStoreBranches
+from dss.datastore.plan import PlanOutOfRange
+from dss.datastore.tree import DataStoreTree, DataStoreTreeMeta
+from dss.importers.default_importer import DefaultImporter
+from dss.models.base import Base
+from dss.templates import DefaultTemplate
+
+SOURCE_ROWS = []
+DEST_ROWS = []
+
+
+class Staff(Base):
+    pass
+
+
+class SourceImporter(DefaultImporter):
+
+    def readin(self):
+        return iter(list(SOURCE_ROWS))
+
+
+class DestImporter(DefaultImporter):
+
+    def readin(self):
+        return iter(list(DEST_ROWS))
+
+
+class SourceBranches(DataStoreBranches):
+    _importer = __name__ + '.SourceImporter'
+
+
+class DestBranches(DataStoreBranches):
+    _importer = __name__ + '.DestImporter'
+
+
+class SourceStaff(SourceBranches):
+    _branchname = 'staff'
+    _klass = __name__ + '.Staff'
+
+
+class DestStaff(DestBranches):
+    _branchname = 'staff'
+    _klass = __name__ + '.Staff'
+
+
+class Source(DataStoreTree):
+    _branches = __name__ + '.SourceBranches'
+
+
+class Dest(DataStoreTree):
+    _branches = __name__ + '.DestBranches'
+    _template = __name__ + '.ListTemplate'
+
+
+class ListTemplate(DefaultTemplate):
+    """
+    Keeps the messages of each cycle in applied
+    """
+    applied = []
+
+    def result_bool(self, result):
+        return result is True
+
+    def write(self, action):
+        self.applied.append(action.message)
+        return True
+
+    new_staff = old_staff = update_room = write
+
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        DataStoreTreeMeta._store.clear()
+        DataStoreTreeMeta._storeobjects.clear()
+        SOURCE_ROWS[:] = [dict(idnumber=str(i), room='r{}'.format(i)) for i in range(4)]
+        DEST_ROWS[:] = [dict(idnumber=str(i), room='r{}'.format(i)) for i in range(1, 4)] + [dict(idnumber='gone', room='r9')]
+        ListTemplate.applied = []
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.socket_path = os.path.join(self.directory.name, 'daemon.sock')
+
+    def daemon(self, **kwargs):
+        daemon = SyncDaemon(Source, Dest, socket_path=self.socket_path, **kwargs)
+        self.addCleanup(daemon.shutdown)
+        return daemon
+
+    def cycle(self, daemon):
+        with contextlib.redirect_stdout(io.StringIO()):
+            daemon.cycle()
+        applied, ListTemplate.applied = sorted(ListTemplate.applied), []
+        return applied
+
+    def test_socket_is_owner_only_and_umask_is_put_back(self):
+        umask = os.umask(0o022)
+        self.addCleanup(os.umask, umask)
+        daemon = self.daemon()
+        daemon.serve()
+        self.assertEqual(stat.S_IMODE(os.stat(self.socket_path).st_mode), 0o600)
+        self.assertEqual(os.umask(0o022), 0o022)
+        status = send(self.socket_path)
+        self.assertEqual(status['state'], 'starting')
+        self.assertEqual(status['branches'], {'Source.staff': 0, 'Dest.staff': 0})
+        self.assertIn('error', send(self.socket_path, 'sing'))
+        daemon.shutdown()
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test_cycles_refresh_and_sync(self):
+        daemon = self.daemon()
+        self.assertEqual(self.cycle(daemon), ['new_staff(idnumber=0)', 'old_staff(idnumber=gone)'])
+        # the destination is as it was, the source has moved on
+        SOURCE_ROWS[1] = dict(SOURCE_ROWS[1], room='r5')
+        self.assertEqual(self.cycle(daemon), ['new_staff(idnumber=0)', 'old_staff(idnumber=gone)', 'update_room(idnumber=1, left_value=r5, right_value=r1)'])
+        self.assertEqual(daemon.info['cycles'], 2)
+        self.assertEqual(daemon.info['state'], 'idle')
+
+    def test_limits_refuse_the_cycle(self):
+        daemon = self.daemon(limits={'old_staff': 0})
+        with self.assertRaises(PlanOutOfRange):
+            self.cycle(daemon)
+        self.assertEqual(ListTemplate.applied, [])
+        self.assertEqual(daemon.info['cycles'], 0)
+
+    def test_reload_and_stop(self):
+        daemon = self.daemon()
+        daemon.serve()
+        self.assertEqual(send(self.socket_path, 'reload')['pending'], 'reload')
+        self.assertTrue(daemon.wake.is_set())
+        self.assertEqual(send(self.socket_path, 'stop')['pending'], 'stop')
+        # stop wins
+        self.assertEqual(send(self.socket_path, 'reload')['pending'], 'stop')
+
+    def test_run_until_stopped(self):
+        # run handles these itself
+        for signum in (signal.SIGTERM, signal.SIGHUP):
+            self.addCleanup(signal.signal, signum, signal.getsignal(signum))
+        daemon = self.daemon(interval=60)
+
+        def commands():
+            while daemon.info['cycles'] < 1:
+                time.sleep(0.01)
+            # not waiting out the interval
+            send(self.socket_path, 'refresh')
+            while daemon.info['cycles'] < 2:
+                time.sleep(0.01)
+            send(self.socket_path, 'stop')
+
+        thread = threading.Thread(target=commands, daemon=True)
+        thread.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            daemon.run()
+        thread.join(10)
+        self.assertEqual(daemon.info['cycles'], 2)
+        self.assertEqual(daemon.info['state'], 'stop')
+        self.assertFalse(os.path.exists(self.socket_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
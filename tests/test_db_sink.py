@@ -0,0 +1,66 @@
+"""
+A DBSink given a template is flushed when >> finishes with it, and warns if it is thrown away with writes buffered
+"""
+
+import gc
+import os
+import tempfile
+import unittest
+import warnings
+
+from sqlalchemy import create_engine, text
+from dss.importers.db_sink import DBSink
+from dss.templates import DefaultTemplate
+
+
+class Template(DefaultTemplate):
+
+    def __init__(self, engine):
+        self.succeeded = []
+        self.sink = DBSink(engine, self, batch_size=100)
+
+    def success(self, action, result):
+        self.succeeded.append(action)
+
+    def finish(self):
+        # doesn't call super().finish(), the tree flushes the sink anyway
+        pass
+
+
+class DBSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = create_engine('sqlite:///' + os.path.join(self.directory.name, 'users.sqlite'))
+        with self.engine.begin() as connection:
+            connection.execute(text("CREATE TABLE users (idnumber TEXT PRIMARY KEY, username TEXT)"))
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def count(self):
+        with self.engine.connect() as connection:
+            return connection.execute(text("SELECT count(*) FROM users")).scalar()
+
+    def test_finish_flushes(self):
+        from dss.datastore.tree import DataStoreTree
+        template = Template(self.engine)
+        template.sink.insert('users', {'idnumber': '1', 'username': 'one'}, 'new_users(idnumber=1)')
+        self.assertEqual(self.count(), 0)
+        DataStoreTree.finish_template(template)
+        self.assertEqual(self.count(), 1)
+        self.assertEqual(template.succeeded, ['new_users(idnumber=1)'])
+
+    def test_warns_when_dropped_unflushed(self):
+        sink = DBSink(self.engine)
+        sink.insert('users', {'idnumber': '1', 'username': 'one'})
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            del sink
+            gc.collect()
+        self.assertTrue(any(issubclass(warning.category, RuntimeWarning) for warning in caught))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+The import cache keeps the rows as the importer gives them, so what the kwargs_preprocessor and _types do to them is never stale
+"""
+
+import csv
+import os
+import tempfile
+import unittest
+
+from dss.datastore.branch import DataStoreBranches
+from dss.datastore.tree import DataStoreTree, DataStoreTreeMeta
+from dss.importers.csv_importer import CSVImporter
+from dss.models.base import Base
+
+# what the preprocessor looks up, as another branch would give it
+HOMEROOMS = {'1': 'north'}
+
+
+class Student(Base):
+    pass
+
+
+class StudentsCSV(CSVImporter):
+
+    def kwargs_preprocessor(self, kwargs):
+        kwargs['homeroom'] = HOMEROOMS.get(kwargs['idnumber'])
+        return kwargs
+
+
+class CacheBranches(DataStoreBranches):
+    _importer = __name__ + '.StudentsCSV'
+
+
+class Students(CacheBranches):
+    _branchname = 'students'
+    _klass = __name__ + '.Student'
+    _types = {'idnumber': lambda value: int(value)}
+
+
+class School(DataStoreTree):
+    _branches = __name__ + '.CacheBranches'
+
+
+class ImportCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        DataStoreTreeMeta._store.clear()
+        DataStoreTreeMeta._storeobjects.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, 'students.csv')
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['idnumber', 'name'])
+            writer.writerows([('1', 'one'), ('2', 'two')])
+        StudentsCSV._settings = {'path': path, 'delimiter': ','}
+        self.cache = os.path.join(self.directory.name, 'cache')
+
+    def tearDown(self):
+        HOMEROOMS.clear()
+        HOMEROOMS['1'] = 'north'
+        self.directory.cleanup()
+
+    def import_school(self):
+        DataStoreTreeMeta._store.clear()
+        school = School(cache=self.cache)
+        +school
+        return school
+
+    def test_preprocessor_runs_on_cached_rows(self):
+        self.assertEqual(self.import_school().students.get(1).homeroom, 'north')
+        self.assertEqual(len(School(cache=self.cache).import_cache.entries()), 1)
+        HOMEROOMS['1'] = 'south'
+        self.assertEqual(self.import_school().students.get(1).homeroom, 'south')
+
+    def test_key_is_the_same_every_run(self):
+        school = School(cache=self.cache)
+        key = school.importer_for(school.students).cache_key()
+        # nothing that changes from one process to the next, like the address of the _types callables
+        self.assertNotIn(' at 0x', repr(key))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+"""
+import_changed only shares the other tree's object when the row would make that object here
+"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from dss.datastore.branch import DataStoreBranches
+from dss.datastore.tree import DataStoreTree, DataStoreTreeMeta
+from dss.importers.db_importer import SQLiteDBImporter
+from dss.importers.default_importer import DefaultImporter
+from dss.models.base import Base
+
+ROWS = [('1', 'one', 'a'), ('2', 'two', 'b'), ('3', 'three', 'c')]
+
+
+class Member(Base):
+    pass
+
+
+class NamedMember(Base):
+    """
+    Works out its username, where the destination has it in a column
+    """
+
+    @property
+    def username(self):
+        return self.name + 'x'
+
+
+class StaleMember(Base):
+    pass
+
+
+class SourceImporter(DefaultImporter):
+
+    def readin(self):
+        for idnumber, name, team in ROWS:
+            yield dict(idnumber=idnumber, name=name, team=team)
+
+
+class DestImporter(SQLiteDBImporter):
+    table = 'members'
+    hash_columns = ['name', 'team']
+
+
+class SourceBranches(DataStoreBranches):
+    _importer = __name__ + '.SourceImporter'
+
+
+class DestBranches(DataStoreBranches):
+    _importer = __name__ + '.DestImporter'
+
+
+class SourceMembers(SourceBranches):
+    _branchname = 'members'
+    _klass = __name__ + '.Member'
+
+
+class DestMembers(DestBranches):
+    _branchname = 'members'
+    _klass = __name__ + '.Member'
+
+
+class ChangedSource(DataStoreTree):
+    _branches = __name__ + '.SourceBranches'
+
+
+class ChangedDest(DataStoreTree):
+    _branches = __name__ + '.DestBranches'
+
+
+class NamedBranches(DataStoreBranches):
+    _importer = __name__ + '.SourceImporter'
+
+
+class NamedSourceMembers(NamedBranches):
+    _branchname = 'members'
+    _klass = __name__ + '.NamedMember'
+
+
+class NamedSource(DataStoreTree):
+    _branches = __name__ + '.NamedBranches'
+
+
+class StaleImporter(SQLiteDBImporter):
+    table = 'named'
+    hash_columns = ['name', 'team']
+
+
+class StaleBranches(DataStoreBranches):
+    _importer = __name__ + '.StaleImporter'
+
+
+class StaleMembers(StaleBranches):
+    _branchname = 'members'
+    _klass = __name__ + '.StaleMember'
+
+
+class StaleDest(DataStoreTree):
+    _branches = __name__ + '.StaleBranches'
+
+
+class KeyedImporter(SQLiteDBImporter):
+    table = 'keyed'
+    key_column = 'member_id'
+    hash_columns = ['name', 'team']
+
+
+class KeyedBranches(DataStoreBranches):
+    _importer = __name__ + '.KeyedImporter'
+
+
+class KeyedMembers(KeyedBranches):
+    _branchname = 'members'
+    _klass = __name__ + '.Member'
+
+
+class KeyedDest(DataStoreTree):
+    _branches = __name__ + '.KeyedBranches'
+
+
+class ImportChangedTest(unittest.TestCase):
+
+    def setUp(self):
+        DataStoreTreeMeta._store.clear()
+        DataStoreTreeMeta._storeobjects.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        database = os.path.join(self.directory.name, 'dest.sqlite')
+        with sqlite3.connect(database) as connection:
+            connection.execute('CREATE TABLE members (idnumber TEXT, name TEXT, team TEXT)')
+            # 3 is in another team
+            connection.executemany("INSERT INTO members VALUES (?, ?, ?)", ROWS[:2] + [('3', 'three', 'z')])
+            connection.execute('CREATE TABLE keyed (member_id TEXT, name TEXT, team TEXT)')
+            connection.executemany("INSERT INTO keyed VALUES (?, ?, ?)", ROWS[:2] + [('3', 'three', 'z')])
+            connection.execute('CREATE TABLE named (idnumber TEXT, name TEXT, team TEXT, username TEXT)')
+            connection.executemany("INSERT INTO named VALUES (?, ?, ?, ?)", [row + (row[1] + 'x', ) for row in ROWS[1:]] + [('1', 'one', 'a', 'WRONG')])
+        connection.close()
+        DestImporter._settings = KeyedImporter._settings = StaleImporter._settings = {'db_database': database}
+        self.addCleanup(setattr, DestImporter, 'hash_columns', DestImporter.hash_columns)
+        self.addCleanup(self.directory.cleanup)
+
+    def messages(self, dest_import, source_class=ChangedSource, dest_class=ChangedDest):
+        source, dest = source_class(), dest_class()
+        +source
+        dest_import(dest, source)
+        return source, dest, sorted(action.message for action in source - dest)
+
+    def test_matches_share_the_object(self):
+        source, dest, messages = self.messages(ChangedDest.import_changed)
+        self.assertIs(dest.members.get('1'), source.members.get('1'))
+        self.assertEqual(messages, ['update_team(idnumber=3, left_value=c, right_value=z)'])
+
+    def test_hash_columns_that_miss_a_compared_attribute(self):
+        DestImporter.hash_columns = ['name']
+        source, dest, messages = self.messages(ChangedDest.import_changed)
+        self.assertEqual(messages, ['update_team(idnumber=3, left_value=c, right_value=z)'])
+
+    def test_column_the_hash_misses(self):
+        # the source works out username, the destination has a stale one in a column that hash_columns leave out
+        _, _, expected = self.messages(lambda dest, source: +dest, NamedSource, StaleDest)
+        self.assertEqual(expected, ['update_username(idnumber=1, left_value=onex, right_value=WRONG)'])
+        DataStoreTreeMeta._store.clear()
+        source, dest, messages = self.messages(StaleDest.import_changed, NamedSource, StaleDest)
+        self.assertEqual(messages, expected)
+        # not the source's object, which is of another class
+        self.assertIs(dest.members.get('1').__class__, StaleMember)
+        self.assertEqual(dest.members.get('1').username, 'WRONG')
+
+    def test_key_column(self):
+        dest = KeyedDest()
+        +dest
+        self.assertEqual(set(dest.members.keys()), {'1', '2', '3'})
+        DataStoreTreeMeta._store.clear()
+        source, dest = ChangedSource(), KeyedDest()
+        +source
+        dest.import_changed(source)
+        self.assertIs(dest.members.get('1'), source.members.get('1'))
+        self.assertEqual(sorted(action.message for action in source - dest), ['update_team(idnumber=3, left_value=c, right_value=z)'])
+
+    def test_filter_out_applies_to_matches(self):
+        DestImporter.filter_out = lambda self, **row: row['idnumber'] == '1'
+        self.addCleanup(delattr, DestImporter, 'filter_out')
+        _, full, expected = self.messages(lambda dest, source: +dest)
+        DataStoreTreeMeta._store.clear()
+        _, dest, messages = self.messages(ChangedDest.import_changed)
+        self.assertNotIn('1', dest.members.keys())
+        self.assertEqual(messages, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
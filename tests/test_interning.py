@@ -0,0 +1,165 @@
+"""
+Interned values are only ever replaced by an equal value of the same type,
+each branch keeps its own tables, and trees that intern diff the same as those that don't
+"""
+
+import unittest
+
+from dss.datastore.branch import DataStoreBranches
+from dss.datastore.interning import Interner
+from dss.datastore.tree import DataStoreTree, DataStoreTreeMeta
+from dss.importers.default_importer import DefaultImporter
+from dss.models.base import Base
+
+
+def rows(names, teams):
+    # the strings are built as the rows are read, so only interning makes them the same object
+    for i, (name, team) in enumerate(zip(names, teams)):
+        yield dict(idnumber=str(i), name=''.join(['n', name]), team=''.join(['t', team]))
+
+
+class Pupil(Base):
+    pass
+
+
+class SourceImporter(DefaultImporter):
+
+    def readin(self):
+        return rows('abcdef', '112233')
+
+
+class DestImporter(DefaultImporter):
+
+    def readin(self):
+        # every name differs, and 5 is in another team
+        return rows('ABCDEF', '112234')
+
+
+class SourceBranches(DataStoreBranches):
+    _importer = __name__ + '.SourceImporter'
+
+
+class DestBranches(DataStoreBranches):
+    _importer = __name__ + '.DestImporter'
+
+
+class SourcePupils(SourceBranches):
+    _branchname = 'pupils'
+    _klass = __name__ + '.Pupil'
+
+
+class DestPupils(DestBranches):
+    _branchname = 'pupils'
+    _klass = __name__ + '.Pupil'
+
+
+class Source(DataStoreTree):
+    _branches = __name__ + '.SourceBranches'
+
+
+class Dest(DataStoreTree):
+    _branches = __name__ + '.DestBranches'
+
+
+class InterningSourceBranches(DataStoreBranches):
+    _importer = __name__ + '.SourceImporter'
+
+
+class InterningDestBranches(DataStoreBranches):
+    _importer = __name__ + '.DestImporter'
+
+
+class InterningSourcePupils(InterningSourceBranches):
+    _branchname = 'pupils'
+    _klass = __name__ + '.Pupil'
+
+
+class InterningDestPupils(InterningDestBranches):
+    _branchname = 'pupils'
+    _klass = __name__ + '.Pupil'
+
+
+class InterningSource(DataStoreTree):
+    _branches = __name__ + '.InterningSourceBranches'
+    _intern = ['team']
+    _interner = Interner()
+
+
+class InterningDest(DataStoreTree):
+    _branches = __name__ + '.InterningDestBranches'
+    _intern = ['team']
+    _interner = InterningSource._interner
+
+
+class InterningTest(unittest.TestCase):
+
+    def test_types_stay_apart(self):
+        interner = Interner()
+        row = interner.row_function(['flag'])
+        for value in (1, 1.0, True, 0, False, '1'):
+            interned = row({'idnumber': 'a', 'flag': value})['flag']
+            self.assertIs(type(interned), type(value))
+            self.assertEqual(interned, value)
+
+    def test_equal_values_are_shared(self):
+        interner = Interner()
+        first = interner.value('homeroom', ''.join(['10', 'B']))
+        self.assertIs(interner.value('homeroom', ''.join(['10', 'B'])), first)
+
+    def test_threshold_is_per_branch(self):
+        interner = Interner()
+        many, few = interner.row_function(['homeroom'], 2, 'Tree.many'), interner.row_function(['homeroom'], 2, 'Tree.few')
+        for homeroom in ('1', '2', '3'):
+            many({'idnumber': homeroom, 'homeroom': homeroom})
+        self.assertIn(('Tree.many', 'homeroom'), interner.disabled)
+        first = few({'idnumber': 'a', 'homeroom': ''.join(['1', '0'])})['homeroom']
+        self.assertIs(few({'idnumber': 'b', 'homeroom': ''.join(['1', '0'])})['homeroom'], first)
+
+    def test_clear_branch(self):
+        interner = Interner()
+        kept = interner.value('homeroom', ''.join(['10', 'B']), branch='Tree.kept')
+        interner.value('homeroom', ''.join(['10', 'B']), branch='Tree.cleared')
+        interner.value('homeroom', ''.join(['11', 'C']), branch='Tree.cleared')
+        interner.clear_branch('Tree.cleared')
+        self.assertEqual(interner.branches(), {'Tree.kept'})
+        self.assertEqual(set(value for value, count in interner.pool['homeroom'].values()), {'10B'})
+        self.assertIs(interner.value('homeroom', ''.join(['10', 'B']), branch='Tree.cleared'), kept)
+
+
+class TreeInterningTest(unittest.TestCase):
+
+    def setUp(self):
+        DataStoreTreeMeta._store.clear()
+        DataStoreTreeMeta._storeobjects.clear()
+        InterningSource._interner.clear()
+
+    def diff(self, source_class, dest_class):
+        source, dest = source_class(), dest_class()
+        +source
+        +dest
+        return source, dest, sorted(action.message for action in source - dest)
+
+    def test_trees_share_values_and_diff_the_same(self):
+        _, _, expected = self.diff(Source, Dest)
+        self.setUp()
+        source, dest, messages = self.diff(InterningSource, InterningDest)
+        self.assertEqual(messages, expected)
+        self.assertIn('update_team(idnumber=5, left_value=t3, right_value=t4)', messages)
+        self.assertIs(source.pupils.get('0').team, dest.pupils.get('0').team)
+        self.assertIs(source.pupils.get('0').team, source.pupils.get('1').team)
+
+    def test_removed_branch_drops_its_tables(self):
+        source, dest, _ = self.diff(InterningSource, InterningDest)
+        interner = InterningSource._interner
+        self.assertEqual(interner.branches(), {source.pupils.fullname, dest.pupils.fullname})
+        -dest
+        self.assertEqual(interner.branches(), {source.pupils.fullname})
+        self.assertNotIn((str, 't4'), interner.pool['team'])
+        del DataStoreTreeMeta._store[source.pupils.fullname]
+        InterningSource.prune_storeobjects()
+        self.assertEqual(interner.branches(), set())
+        self.assertEqual(interner.pool['team'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+"""
+A sync through the journal that dies partway resumes where it stopped, and the plan writes each object once
+"""
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from dss.datastore.branch import DataStoreBranches
+from dss.datastore.tree import DataStoreTree, DataStoreTreeMeta
+from dss.importers.default_importer import DefaultImporter
+from dss.models.base import Base
+from dss.templates import DefaultTemplate
+
+SOURCE_ROWS = [dict(idnumber=str(i), name='name{}'.format(i), team='team{}'.format(i % 3)) for i in range(10)]
+# 0-3 have another name and team, 4-7 are the same, 8-9 are new, and gone0-1 are old
+DEST_ROWS = [dict(idnumber=str(i), name='other{}'.format(i), team='other') for i in range(4)] \
+    + SOURCE_ROWS[4:8] \
+    + [dict(idnumber='gone{}'.format(i), name='gone', team='gone') for i in range(2)]
+
+
+class Player(Base):
+    pass
+
+
+class SourceImporter(DefaultImporter):
+
+    def readin(self):
+        return iter(SOURCE_ROWS)
+
+
+class DestImporter(DefaultImporter):
+
+    def readin(self):
+        return iter(DEST_ROWS)
+
+
+class SourceBranches(DataStoreBranches):
+    _importer = __name__ + '.SourceImporter'
+
+
+class DestBranches(DataStoreBranches):
+    _importer = __name__ + '.DestImporter'
+
+
+class SourcePlayers(SourceBranches):
+    _branchname = 'players'
+    _klass = __name__ + '.Player'
+
+
+class DestPlayers(DestBranches):
+    _branchname = 'players'
+    _klass = __name__ + '.Player'
+
+
+class Source(DataStoreTree):
+    _branches = __name__ + '.SourceBranches'
+
+
+class Dest(DataStoreTree):
+    _branches = __name__ + '.DestBranches'
+
+
+class LoggingTemplate(DefaultTemplate):
+    """
+    Appends each message it is given to log, and dies without a word after crash_after of them
+    """
+    log = None
+    crash_after = None
+
+    def __init__(self):
+        self.applied = 0
+
+    def result_bool(self, result):
+        return result is True
+
+    def write(self, action):
+        with open(self.log, 'a') as f:
+            f.write(action.message + '\n')
+        self.applied += 1
+        if self.applied == self.crash_after:
+            os._exit(0)
+        return True
+
+    new_players = old_players = update_name = update_team = write
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        DataStoreTreeMeta._store.clear()
+        DataStoreTreeMeta._storeobjects.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.journal = os.path.join(self.directory.name, 'journal.jsonl')
+        LoggingTemplate.log = os.path.join(self.directory.name, 'applied.log')
+        self.source, self.dest = Source(journal=self.journal), Dest()
+        self.dest._template = LoggingTemplate
+        with contextlib.redirect_stdout(io.StringIO()):
+            +self.source
+            +self.dest
+        self.expected = sorted(action.message for action in self.source - self.dest)
+
+    def sync(self, crash_after=None):
+        LoggingTemplate.crash_after = crash_after
+        self.addCleanup(setattr, LoggingTemplate, 'crash_after', None)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.source >> self.dest
+        return output.getvalue()
+
+    def crash(self, after):
+        """
+        Sync in a child process that dies after applying that many actions
+        """
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.sync(after)
+            finally:
+                os._exit(1)
+        _, status = os.waitpid(pid, 0)
+        # 0 is the template's exit, 1 would mean the sync finished before it
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+
+    def applied(self):
+        with open(LoggingTemplate.log) as f:
+            return f.read().splitlines()
+
+    def entries(self):
+        with open(self.journal) as f:
+            return [json.loads(line) for line in f]
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "needs fork")
+    def test_resume_after_a_crash(self):
+        self.crash(5)
+        self.assertEqual(len(self.applied()), 5)
+        output = self.sync()
+        self.assertIn("Resuming", output)
+        applied = self.applied()
+        self.assertEqual(sorted(set(applied)), self.expected)
+        # only the action the crash came in the middle of is applied again
+        self.assertEqual(len(applied), len(self.expected) + 1)
+        self.assertEqual(applied[4], applied[5])
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "needs fork")
+    def test_resume_after_the_trees_changed(self):
+        self.crash(1)
+        # a key with actions still pending changed since the plan was made
+        self.addCleanup(SOURCE_ROWS.__setitem__, 3, SOURCE_ROWS[3])
+        SOURCE_ROWS[3] = dict(SOURCE_ROWS[3], team='moved')
+        DataStoreTreeMeta._store.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            +self.source
+            +self.dest
+        output = self.sync()
+        self.assertIn("starting over", output)
+        self.assertIn('update_team(idnumber=3, left_value=moved, right_value=other)', self.applied())
+
+    def test_plan_writes_each_object_once(self):
+        self.sync()
+        entries = self.entries()
+        objects = [entry for entry in entries if 'object' in entry]
+        actions = [entry['action'] for entry in entries if 'action' in entry]
+        self.assertEqual(len(actions), len(self.expected))
+        # 0-3 have two actions each and both their objects, the new and old ones one
+        self.assertEqual(len(objects), 4 * 2 + 2 + 2)
+        self.assertEqual(len(set(entry['object'] for entry in objects)), len(objects))
+        self.assertTrue(all(isinstance(action['source'], (int, type(None))) for action in actions))
+        self.assertEqual(sorted(self.applied()), self.expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+"""
+Lazy branches keep their rows as RawRows until an object is asked for, and diff the same as branches that don't
+"""
+
+import unittest
+
+from dss.datastore.branch import DataStoreBranches, RawRow
+from dss.datastore.tree import DataStoreTree, DataStoreTreeMeta
+from dss.importers.default_importer import DefaultImporter
+from dss.models.base import Base
+
+
+def source_rows():
+    for i in range(50):
+        yield dict(idnumber=str(i), name='name{}'.format(i), grade=str(i % 5))
+
+
+def dest_rows():
+    # 0-9 aren't there, every seventh has another grade, and gone0-4 are old
+    for i in range(10, 50):
+        yield dict(idnumber=str(i), name='name{}'.format(i), grade='x' if i % 7 == 0 else str(i % 5))
+    for i in range(5):
+        yield dict(idnumber='gone{}'.format(i), name='gone', grade='0')
+
+
+class Learner(Base):
+    pass
+
+
+class SourceImporter(DefaultImporter):
+
+    def readin(self):
+        return source_rows()
+
+
+class DestImporter(DefaultImporter):
+
+    def readin(self):
+        return dest_rows()
+
+
+class SourceBranches(DataStoreBranches):
+    _importer = __name__ + '.SourceImporter'
+
+
+class DestBranches(DataStoreBranches):
+    _importer = __name__ + '.DestImporter'
+
+
+class LazySourceBranches(DataStoreBranches):
+    _importer = __name__ + '.SourceImporter'
+
+
+class LazyDestBranches(DataStoreBranches):
+    _importer = __name__ + '.DestImporter'
+
+
+class SourceLearners(SourceBranches):
+    _branchname = 'learners'
+    _klass = __name__ + '.Learner'
+
+
+class DestLearners(DestBranches):
+    _branchname = 'learners'
+    _klass = __name__ + '.Learner'
+
+
+class LazySourceLearners(LazySourceBranches):
+    _branchname = 'learners'
+    _klass = __name__ + '.Learner'
+    _lazy = True
+
+
+class LazyDestLearners(LazyDestBranches):
+    _branchname = 'learners'
+    _klass = __name__ + '.Learner'
+    _lazy = True
+
+
+class Source(DataStoreTree):
+    _branches = __name__ + '.SourceBranches'
+
+
+class Dest(DataStoreTree):
+    _branches = __name__ + '.DestBranches'
+
+
+class LazySource(DataStoreTree):
+    _branches = __name__ + '.LazySourceBranches'
+
+
+class LazyDest(DataStoreTree):
+    _branches = __name__ + '.LazyDestBranches'
+
+
+class LazyTest(unittest.TestCase):
+
+    def setUp(self):
+        DataStoreTreeMeta._store.clear()
+        DataStoreTreeMeta._storeobjects.clear()
+
+    def trees(self, source_class, dest_class):
+        source, dest = source_class(), dest_class()
+        +source
+        +dest
+        return source, dest
+
+    def messages(self, source_class, dest_class):
+        source, dest = self.trees(source_class, dest_class)
+        return sorted(action.message for action in source - dest)
+
+    def raw_rows(self, tree):
+        return sum(1 for value in tree.learners.store.values() if isinstance(value, RawRow))
+
+    def test_actions_are_the_plain_diff(self):
+        expected = self.messages(Source, Dest)
+        self.assertEqual(len(expected), 10 + 6 + 5)
+        for source_class, dest_class in ((LazySource, Dest), (Source, LazyDest), (LazySource, LazyDest)):
+            self.setUp()
+            self.assertEqual(self.messages(source_class, dest_class), expected)
+
+    def test_rows_stay_raw_until_asked_for(self):
+        source, dest = self.trees(LazySource, LazyDest)
+        self.assertEqual(self.raw_rows(source), 50)
+        learner = source.learners.get('3')
+        self.assertIsInstance(learner, Learner)
+        self.assertEqual((learner.name, learner.grade), ('name3', '3'))
+        self.assertIs(source.learners.store['3'], learner)
+        self.assertEqual(self.raw_rows(source), 49)
+
+    def test_plan_leaves_them_raw(self):
+        source, dest = self.trees(Source, Dest)
+        expected = source.plan(dest).totals()
+        self.setUp()
+        source, dest = self.trees(LazySource, LazyDest)
+        self.assertEqual(source.plan(dest).totals(), expected)
+        self.assertEqual((self.raw_rows(source), self.raw_rows(dest)), (50, 45))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+"""
+The ordered diff gives the plain diff's actions in an order that doesn't depend on the importers',
+also when its sort spills to disk
+"""
+
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+from dss import utils
+from dss.datastore.branch import DataStoreBranches
+from dss.datastore.tree import DataStoreTree, DataStoreTreeMeta
+from dss.importers.default_importer import DefaultImporter
+from dss.models.base import Base
+from dss.utils import ExternalSorter
+
+
+def source_rows():
+    for i in range(30):
+        yield dict(idnumber=str(i), name='name{}'.format(i), clubs=['chess', 'choir', 'club{}'.format(i % 4)])
+
+
+def dest_rows():
+    # 0-5 aren't there, every fourth has other clubs, every fifth another name, and gone0-4 are old
+    for i in range(6, 30):
+        yield dict(idnumber=str(i), name='other' if i % 5 == 0 else 'name{}'.format(i), clubs=['art', 'club{}'.format(i % 4)] if i % 4 == 0 else ['chess', 'choir', 'club{}'.format(i % 4)])
+    for i in range(5):
+        yield dict(idnumber='gone{}'.format(i), name='gone', clubs=[])
+
+
+class Pupil(Base):
+    pass
+
+
+class ShuffledImporter(DefaultImporter):
+    """
+    Gives the rows in another order for every seed
+    """
+    seed = 0
+    rows = None
+
+    def readin(self):
+        rows = list(self.rows())
+        random.Random(self.seed).shuffle(rows)
+        return iter(rows)
+
+
+class SourceImporter(ShuffledImporter):
+    rows = staticmethod(source_rows)
+
+
+class DestImporter(ShuffledImporter):
+    rows = staticmethod(dest_rows)
+
+
+class SourceBranches(DataStoreBranches):
+    _importer = __name__ + '.SourceImporter'
+
+
+class DestBranches(DataStoreBranches):
+    _importer = __name__ + '.DestImporter'
+
+
+class SourcePupils(SourceBranches):
+    _branchname = 'pupils'
+    _klass = __name__ + '.Pupil'
+
+
+class DestPupils(DestBranches):
+    _branchname = 'pupils'
+    _klass = __name__ + '.Pupil'
+
+
+class Source(DataStoreTree):
+    _branches = __name__ + '.SourceBranches'
+
+
+class Dest(DataStoreTree):
+    _branches = __name__ + '.DestBranches'
+
+
+class ExternalSorterTest(unittest.TestCase):
+
+    def test_spilled_runs_merge_in_order(self):
+        items = list(range(100))
+        random.Random(1).shuffle(items)
+        sorter = ExternalSorter(buffer_size=7, key=lambda item: -item)
+        for item in items:
+            sorter.add(item)
+        self.assertEqual(len(sorter.runs), 100 // 7)
+        self.assertEqual(list(sorter), sorted(items, reverse=True))
+
+
+class OrderedTest(unittest.TestCase):
+
+    def setUp(self):
+        DataStoreTreeMeta._store.clear()
+        DataStoreTreeMeta._storeobjects.clear()
+        self.addCleanup(setattr, ShuffledImporter, 'seed', 0)
+
+    def trees(self, seed, **kwargs):
+        DataStoreTreeMeta._store.clear()
+        ShuffledImporter.seed = seed
+        source, dest = Source(**kwargs), Dest()
+        +source
+        +dest
+        return source, dest
+
+    def messages(self, seed, **kwargs):
+        source, dest = self.trees(seed, **kwargs)
+        return [action.message for action in source - dest]
+
+    def test_same_actions_as_the_plain_diff(self):
+        expected = sorted(self.messages(0))
+        self.assertIn("add_clubs_to_pupils(idnumber=8, to=chess, attribute=clubs, which='Dest.pupils')", expected)
+        self.assertIn('update_name(idnumber=10, left_value=name10, right_value=other)', expected)
+        source, dest = self.trees(0, ordered=True, sort_buffer=4)
+        # the diff's own sort, not the import's (list values are aggregated with one too)
+        with mock.patch.object(utils.tempfile, 'TemporaryFile', wraps=tempfile.TemporaryFile) as spilled:
+            ordered = [action.message for action in source - dest]
+        self.assertTrue(spilled.called)
+        self.assertEqual(sorted(ordered), expected)
+
+    def test_order_is_the_same_for_any_input_order_and_buffer(self):
+        expected = self.messages(0, ordered=True)
+        for seed, sort_buffer in ((1, 4), (2, 100000), (3, 1)):
+            self.assertEqual(self.messages(seed, ordered=True, sort_buffer=sort_buffer), expected)
+        tiers = [message.split('_')[0] for message in expected]
+        self.assertEqual(tiers[:6], ['new'] * 6)
+        self.assertEqual(tiers[-5:], ['old'] * 5)
+        self.assertNotIn('new', tiers[6:])
+        self.assertNotIn('old', tiers[:-5])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+"""
+The declared predicates give the same rows whichever way they are read: a CSV or a database, whole rows or just the keys
+"""
+
+import csv
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from dss.datastore.pushdown import Pushdown
+from dss.importers.csv_importer import CSVImporter
+from dss.importers.db_importer import SQLiteDBImporter
+
+ROWS = [('1', '9', 'a'), ('2', '10', 'b'), ('3', '11', 'c'), ('4', '', 'd')]
+
+
+class Branch:
+    name = 'users'
+    fullname = 'Tree.users'
+
+
+class UsersCSVImporter(CSVImporter):
+    pass
+
+
+class UsersDBImporter(SQLiteDBImporter):
+    table = 'users'
+
+
+class PushdownTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        csv_path = os.path.join(self.directory.name, 'users.csv')
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['idnumber', 'grade', 'name'])
+            writer.writerows(ROWS)
+        database = os.path.join(self.directory.name, 'users.sqlite')
+        with sqlite3.connect(database) as connection:
+            connection.execute("CREATE TABLE users (idnumber TEXT, grade INTEGER, name TEXT)")
+            connection.executemany("INSERT INTO users VALUES (?, ?, ?)", [(i, int(g) if g else None, n) for i, g, n in ROWS])
+        connection.close()
+        UsersCSVImporter._settings = {'path': csv_path, 'delimiter': ','}
+        UsersDBImporter._settings = {'db_database': database}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def importers(self, where):
+        for klass in (UsersCSVImporter, UsersDBImporter):
+            importer = klass(None, Branch)
+            importer.pushdown = Pushdown(where=where)
+            yield importer
+
+    def rows(self, importer):
+        if importer.reader is not None and not isinstance(importer, SQLiteDBImporter):
+            with importer.reader() as reader:
+                return set(row['idnumber'] for row in reader)
+        return set(row['idnumber'] for row in importer.readin())
+
+    def test_numbers_compare_as_numbers(self):
+        for where, expected in (
+            ([('grade', '>=', 10)], {'2', '3'}),
+            ([('grade', '<', 10)], {'1'}),
+            ([('grade', 'in', [9, 11])], {'1', '3'}),
+            ([('grade', '==', None)], {'4'}),
+            ([('grade', '!=', 10)], {'1', '3'}),
+            ([('grade', '!=', None)], {'1', '2', '3'}),
+        ):
+            for importer in self.importers(where):
+                name = "{} {}".format(importer.__class__.__name__, where)
+                self.assertEqual(self.rows(importer), expected, name)
+                self.assertEqual(importer.readin_keys(), expected, name)
+
+    def test_unknown_field(self):
+        importer = UsersCSVImporter(None, Branch)
+        importer.pushdown = Pushdown(where=[('grades', '>=', 10)])
+        with self.assertRaises(ValueError):
+            importer.readin_keys()
+        with self.assertRaises(ValueError):
+            Pushdown(where=[('grades', '>=', 10)]).matches({'idnumber': '1', 'grade': '10'})
+
+
+if __name__ == '__main__':
+    unittest.main()
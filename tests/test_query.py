@@ -0,0 +1,164 @@
+"""
+The query service over its socket: owner-only from the start, keys from JSON find int idnumbers,
+and its diff gives what the trees' diff does
+"""
+
+import json
+import os
+import socket
+import stat
+import tempfile
+import unittest
+
+from dss.datastore.branch import DataStoreBranches
+from dss.datastore.tree import DataStoreTree, DataStoreTreeMeta
+from dss.importers.default_importer import DefaultImporter
+from dss.models.base import Base
+from dss.query import QueryClient, QueryService
+
+SOURCE_ROWS = [dict(idnumber=str(i), name='name{}'.format(i)) for i in (1, 2, 3)]
+# 1 is new, 3 has another name, 4 is old
+DEST_ROWS = [dict(idnumber='2', name='name2'), dict(idnumber='3', name='other'), dict(idnumber='4', name='name4')]
+
+
+class Teacher(Base):
+    pass
+
+
+class Room(Base):
+    pass
+
+
+class SourceImporter(DefaultImporter):
+
+    def readin(self):
+        return iter(SOURCE_ROWS)
+
+
+class DestImporter(DefaultImporter):
+
+    def readin(self):
+        return iter(DEST_ROWS)
+
+
+class RoomImporter(DefaultImporter):
+
+    def readin(self):
+        # int idnumbers without a declared type
+        for number in (101, 102):
+            yield dict(idnumber=number, floor=number // 100)
+
+
+class SourceBranches(DataStoreBranches):
+    _importer = __name__ + '.SourceImporter'
+
+
+class DestBranches(DataStoreBranches):
+    _importer = __name__ + '.DestImporter'
+
+
+class SourceTeachers(SourceBranches):
+    _branchname = 'teachers'
+    _klass = __name__ + '.Teacher'
+    _types = {'idnumber': int}
+
+
+class SourceRooms(SourceBranches):
+    _branchname = 'rooms'
+    _klass = __name__ + '.Room'
+    _importer = __name__ + '.RoomImporter'
+
+
+class DestTeachers(DestBranches):
+    _branchname = 'teachers'
+    _klass = __name__ + '.Teacher'
+    _types = {'idnumber': int}
+
+
+class DestRooms(DestBranches):
+    _branchname = 'rooms'
+    _klass = __name__ + '.Room'
+    _importer = __name__ + '.RoomImporter'
+
+
+class Source(DataStoreTree):
+    _branches = __name__ + '.SourceBranches'
+
+
+class Dest(DataStoreTree):
+    _branches = __name__ + '.DestBranches'
+
+
+class QueryTest(unittest.TestCase):
+
+    def setUp(self):
+        DataStoreTreeMeta._store.clear()
+        DataStoreTreeMeta._storeobjects.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.socket_path = os.path.join(self.directory.name, 'query.sock')
+        self.source, self.dest = Source(), Dest()
+        +self.source
+        +self.dest
+        self.service = QueryService([self.source, self.dest], self.socket_path).start()
+        self.addCleanup(self.service.stop)
+        self.client = QueryClient(self.socket_path)
+        self.addCleanup(self.client.close)
+
+    def test_socket_is_owner_only_and_umask_is_put_back(self):
+        self.service.stop()
+        umask = os.umask(0o022)
+        self.addCleanup(os.umask, umask)
+        self.service.start()
+        self.assertEqual(stat.S_IMODE(os.stat(self.socket_path).st_mode), 0o600)
+        self.assertEqual(os.umask(0o022), 0o022)
+
+    def test_get_int_idnumbers(self):
+        objects = self.client.get('Source.teachers', '1', 3, '99')
+        self.assertEqual(sorted(objects), ['1', '3', '99'])
+        self.assertEqual(objects['1']['idnumber'], 1)
+        self.assertEqual(objects['3']['properties']['name'], 'name3')
+        self.assertIsNone(objects['99'])
+        # not declared, found by their string
+        self.assertEqual(self.client.get('Source.rooms', '101')['101']['properties']['floor'], 1)
+
+    def test_diff_is_the_trees_diff(self):
+        expected = {}
+        # the rooms are the same on both sides
+        for action in self.source - self.dest:
+            expected.setdefault(str(action.idnumber), []).append(action.message)
+        answer = self.client.ask({'op': 'diff', 'source': 'Source', 'dest': 'Dest', 'branch': 'teachers', 'keys': ['1', '2', '3', '4', '5']})
+        actions = answer['actions']
+        self.assertEqual(actions['2'], [])
+        self.assertIsNone(actions['5'])
+        self.assertEqual({key: [action['message'] for action in actions[key]] for key in ('1', '3', '4')}, expected)
+
+    def test_batch_branches_and_errors(self):
+        answer = self.client.ask({'op': 'batch', 'requests': [
+            {'op': 'branches'},
+            {'op': 'keys_startswith', 'branch': 'Source.rooms', 'prefix': '10'},
+            {'op': 'get_from_attribute', 'branch': 'Dest.teachers', 'attribute': 'name', 'value': 'other'},
+            {'op': 'sing'},
+        ]})
+        branches, keys, found, error = answer['answers']
+        self.assertEqual(branches['branches'], {'Source.teachers': 3, 'Source.rooms': 2, 'Dest.teachers': 3, 'Dest.rooms': 2})
+        self.assertEqual(keys['keys'], ['101', '102'])
+        self.assertEqual(found['object']['idnumber'], 3)
+        self.assertIn('error', error)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as raw:
+            raw.connect(self.socket_path)
+            raw.sendall(b'not json\n')
+            with raw.makefile('r') as f:
+                self.assertIn('error', json.loads(f.readline()))
+
+    def test_published_view(self):
+        DEST_ROWS.append(dict(idnumber='5', name='name5'))
+        self.addCleanup(DEST_ROWS.pop)
+        self.dest.refresh()
+        self.assertIsNone(self.client.get('Dest.teachers', '5')['5'])
+        self.service.publish(changed={'Dest.teachers'})
+        self.assertEqual(self.client.get('Dest.teachers', '5')['5']['idnumber'], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
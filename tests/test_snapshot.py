@@ -0,0 +1,131 @@
+"""
+A snapshot diffs like the tree it was made from, and what is done to it (del_key, modify, another model class)
+shows in its own diff without leaking into the original
+"""
+
+import unittest
+
+from dss.datastore.branch import DataStoreBranches
+from dss.datastore.tree import DataStoreTree, DataStoreTreeMeta
+from dss.importers.default_importer import DefaultImporter
+from dss.models.base import Base
+
+
+def source_rows():
+    for i in range(8):
+        yield dict(idnumber=str(i), name='Name{}'.format(i), room='r{}'.format(i % 3))
+
+
+def dest_rows():
+    # 0 isn't there, 5 is in another room and gone is old
+    for i in range(1, 8):
+        yield dict(idnumber=str(i), name='Name{}'.format(i), room='x' if i == 5 else 'r{}'.format(i % 3))
+    yield dict(idnumber='gone', name='Gone', room='r0')
+
+
+class Member(Base):
+    pass
+
+
+class ShoutingMember(Member):
+    """
+    The same rows, seen with names in capitals
+    """
+
+    @property
+    def name(self):
+        return self.__dict__['name'].upper()
+
+
+class SourceImporter(DefaultImporter):
+
+    def readin(self):
+        return source_rows()
+
+
+class DestImporter(DefaultImporter):
+
+    def readin(self):
+        return dest_rows()
+
+
+class SourceBranches(DataStoreBranches):
+    _importer = __name__ + '.SourceImporter'
+
+
+class DestBranches(DataStoreBranches):
+    _importer = __name__ + '.DestImporter'
+
+
+class SourceMembers(SourceBranches):
+    _branchname = 'members'
+    _klass = __name__ + '.Member'
+
+
+class DestMembers(DestBranches):
+    _branchname = 'members'
+    _klass = __name__ + '.Member'
+
+
+class Source(DataStoreTree):
+    _branches = __name__ + '.SourceBranches'
+
+
+class Dest(DataStoreTree):
+    _branches = __name__ + '.DestBranches'
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        DataStoreTreeMeta._store.clear()
+        DataStoreTreeMeta._storeobjects.clear()
+        self.source, self.dest = Source(), Dest()
+        +self.source
+        +self.dest
+        self.expected = self.messages(self.source)
+
+    def messages(self, source):
+        return sorted(action.message for action in source - self.dest)
+
+    def assertOriginalUntouched(self):
+        self.assertEqual(self.messages(self.source), self.expected)
+        self.assertEqual(len(self.source.members.keys()), 8)
+
+    def test_diffs_as_the_original(self):
+        self.assertEqual(self.expected, ['new_members(idnumber=0)', 'old_members(idnumber=gone)', 'update_room(idnumber=5, left_value=r2, right_value=x)'])
+        snap = self.source.snapshot()
+        self.assertEqual(self.messages(snap), self.expected)
+        -snap
+        self.assertOriginalUntouched()
+
+    def test_del_key(self):
+        snap = self.source.snapshot()
+        snap.members.del_key('0')
+        snap.members.del_key('3')
+        self.assertEqual(self.messages(snap), ['old_members(idnumber=3)', 'old_members(idnumber=gone)', 'update_room(idnumber=5, left_value=r2, right_value=x)'])
+        self.assertIsNotNone(self.source.members.get('3'))
+        self.assertOriginalUntouched()
+
+    def test_modify(self):
+        snap = self.source.snapshot()
+        member = snap.members.modify('5')
+        member.room = 'x'
+        member = snap.members.modify('6')
+        member.room = 'y'
+        self.assertEqual(self.messages(snap), ['new_members(idnumber=0)', 'old_members(idnumber=gone)', 'update_room(idnumber=6, left_value=y, right_value=r0)'])
+        self.assertEqual(self.source.members.get('5').room, 'r2')
+        self.assertEqual(self.source.members.get('6').room, 'r0')
+        self.assertOriginalUntouched()
+
+    def test_another_model_class(self):
+        snap = self.source.snapshot(klass={'members': ShoutingMember})
+        messages = self.messages(snap)
+        self.assertIn('update_name(idnumber=1, left_value=NAME1, right_value=Name1)', messages)
+        self.assertEqual(len([message for message in messages if message.startswith('update_name')]), 7)
+        self.assertIs(type(self.source.members.get('1')), Member)
+        self.assertOriginalUntouched()
+
+
+if __name__ == '__main__':
+    unittest.main()
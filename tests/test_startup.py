@@ -0,0 +1,46 @@
+"""
+What importing the package costs: the importers are loaded when first used (see dss.importers),
+so a sync that doesn't use a database never loads sqlalchemy
+Each check runs in a fresh interpreter, as whatever the other tests import is already in sys.modules here
+"""
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ('sqlalchemy', 'dss.importers.csv_importer', 'dss.importers.db_importer', 'dss.importers.db_sink', 'dss.importers.subprocess_importer')
+
+
+def loaded_after(statement):
+    """
+    The heavy modules in sys.modules after running statement in a new interpreter
+    """
+    code = "import sys, json\n{}\nprint(json.dumps(sorted(m for m in sys.modules if m.split('.')[0] == 'sqlalchemy' or m in {!r})))".format(statement, HEAVY)
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+    return set(json.loads(output.decode('utf-8').splitlines()[-1]))
+
+
+class StartupTest(unittest.TestCase):
+
+    def test_importers_package_loads_no_importer(self):
+        self.assertEqual(loaded_after("import dss.importers"), set())
+
+    def test_tree_loads_no_importer(self):
+        self.assertEqual(loaded_after("import dss.datastore.tree"), set())
+
+    def test_csv_only_sync_loads_no_sqlalchemy(self):
+        self.assertEqual(loaded_after("from dss.importers import CSVImporter"), {'dss.importers.csv_importer'})
+
+    def test_importer_loaded_on_first_use(self):
+        self.assertIn('sqlalchemy', loaded_after("from dss.importers import DBImporter"))
+
+    def test_define_a_tree_within_budget(self):
+        # benchmarks/startup.py with a budget loose enough for a busy machine, it exits non-zero over it
+        subprocess.check_call([sys.executable, os.path.join(ROOT, 'benchmarks', 'startup.py'), '--runs', '3', '--budget', '1.0'], stdout=subprocess.DEVNULL)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Branches that declare dates and enums in _types: a CSV tree and a DB tree give the same typed values,
+diff only where the values really differ, and objects with different dates are never taken for the same one
+"""
+
+import csv
+import datetime
+import enum
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from dss.datastore.branch import DataStoreBranches
+from dss.datastore.tree import DataStoreTree, DataStoreTreeMeta
+from dss.importers.csv_importer import CSVImporter
+from dss.importers.db_importer import SQLiteDBImporter
+from dss.models.base import Base
+
+CSV_ROWS = [('1', '2020-09-01', 'student'), ('2', '2021-01-15', 'teacher'), ('3', '', 'student')]
+# 2 enrolled on another day
+DB_ROWS = [('1', '2020-09-01', 'student'), ('2', '2021-02-15', 'teacher'), ('3', None, 'student')]
+
+
+class Kind(enum.Enum):
+    student = 's'
+    teacher = 't'
+
+
+class User(Base):
+    pass
+
+
+class NamingUser(Base):
+    """
+    A _jsonencoder that only knows about some types, like dss.sample's
+    """
+
+    def _jsonencoder(self, obj):
+        if isinstance(obj, Kind):
+            return obj.name
+
+
+class UsersCSV(CSVImporter):
+    pass
+
+
+class UsersDB(SQLiteDBImporter):
+    table = 'users'
+
+
+TYPES = {'enrolled': 'date', 'kind': Kind}
+
+
+class CSVBranches(DataStoreBranches):
+    _importer = __name__ + '.UsersCSV'
+
+
+class DBBranches(DataStoreBranches):
+    _importer = __name__ + '.UsersDB'
+
+
+class CSVUsers(CSVBranches):
+    _branchname = 'users'
+    _klass = __name__ + '.User'
+    _types = TYPES
+
+
+class DBUsers(DBBranches):
+    _branchname = 'users'
+    _klass = __name__ + '.User'
+    _types = TYPES
+
+
+class CSVTree(DataStoreTree):
+    _branches = __name__ + '.CSVBranches'
+
+
+class DBTree(DataStoreTree):
+    _branches = __name__ + '.DBBranches'
+
+
+class TypedDatesTest(unittest.TestCase):
+
+    def setUp(self):
+        DataStoreTreeMeta._store.clear()
+        DataStoreTreeMeta._storeobjects.clear()
+        CSVUsers._klass = DBUsers._klass = __name__ + '.User'
+        self.directory = tempfile.TemporaryDirectory()
+        csv_path = os.path.join(self.directory.name, 'users.csv')
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['idnumber', 'enrolled', 'kind'])
+            writer.writerows(CSV_ROWS)
+        database = os.path.join(self.directory.name, 'users.sqlite')
+        with sqlite3.connect(database) as connection:
+            connection.execute("CREATE TABLE users (idnumber TEXT, enrolled TEXT, kind TEXT)")
+            connection.executemany("INSERT INTO users VALUES (?, ?, ?)", DB_ROWS)
+        connection.close()
+        UsersCSV._settings = {'path': csv_path, 'delimiter': ','}
+        UsersDB._settings = {'db_database': database}
+
+    def tearDown(self):
+        CSVUsers._klass = DBUsers._klass = __name__ + '.User'
+        self.directory.cleanup()
+
+    def diff(self):
+        source, dest = CSVTree(), DBTree()
+        +source
+        +dest
+        return source, dest, sorted(action.message for action in source - dest)
+
+    def test_csv_and_db_diff_on_the_changed_date(self):
+        source, dest, messages = self.diff()
+        self.assertEqual(source.users.get('1').enrolled, datetime.date(2020, 9, 1))
+        self.assertIs(dest.users.get('2').kind, Kind.teacher)
+        self.assertIsNone(dest.users.get('3').enrolled)
+        self.assertEqual(messages, ['update_enrolled(idnumber=2, left_value=2021-01-15, right_value=2021-02-15)'])
+
+    def test_jsonencoder_that_gives_none(self):
+        CSVUsers._klass = DBUsers._klass = __name__ + '.NamingUser'
+        source, dest, messages = self.diff()
+        # the same row in both is one object, the ones with different dates aren't
+        self.assertIs(source.users.get('1'), dest.users.get('1'))
+        self.assertIsNot(source.users.get('2'), dest.users.get('2'))
+        self.assertEqual(messages, ['update_enrolled(idnumber=2, left_value=2021-01-15, right_value=2021-02-15)'])
+
+
+if __name__ == '__main__':
+    unittest.main()
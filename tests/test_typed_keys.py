@@ -0,0 +1,173 @@
+"""
+Branches that declare a type for idnumber (_types = {'idnumber': int}) get the same keys
+from the key-only paths (readin_keys, readin_hashes, readin_keys_subset) as from a full import
+"""
+
+import csv
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from dss.datastore.branch import DataStoreBranches
+from dss.datastore.tree import DataStoreTree, DataStoreTreeMeta
+from dss.importers.csv_importer import CSVImporter
+from dss.importers.db_importer import SQLiteDBImporter
+from dss.importers.default_importer import DefaultImporter
+from dss.models.base import Base
+
+ROWS = [(1, 'one'), (2, 'two'), (3, 'three'), (4, 'four')]
+# as the destination has them: 4 is gone, 5 is extra, 2 has another name
+DEST_ROWS = [('1', 'one'), ('2', 'deux'), ('3', 'three'), ('5', 'five')]
+
+
+class User(Base):
+    pass
+
+
+class SourceImporter(DefaultImporter):
+
+    def readin(self):
+        for idnumber, name in ROWS:
+            yield dict(idnumber=idnumber, name=name)
+
+    def readin_keys(self):
+        return [idnumber for idnumber, _ in ROWS]
+
+
+class DestDBImporter(SQLiteDBImporter):
+    table = 'users'
+    hash_columns = ['name']
+
+
+class DestCSVImporter(CSVImporter):
+    pass
+
+
+class SourceBranches(DataStoreBranches):
+    _importer = __name__ + '.SourceImporter'
+
+
+class DBBranches(DataStoreBranches):
+    _importer = __name__ + '.DestDBImporter'
+
+
+class CSVBranches(DataStoreBranches):
+    _importer = __name__ + '.DestCSVImporter'
+
+
+class SourceUsers(SourceBranches):
+    _branchname = 'users'
+    _klass = __name__ + '.User'
+
+
+class DBUsers(DBBranches):
+    _branchname = 'users'
+    _klass = __name__ + '.User'
+    _types = {'idnumber': int}
+
+
+class CSVUsers(CSVBranches):
+    _branchname = 'users'
+    _klass = __name__ + '.User'
+    _types = {'idnumber': int}
+
+
+class Source(DataStoreTree):
+    _branches = __name__ + '.SourceBranches'
+
+
+class DBDest(DataStoreTree):
+    _branches = __name__ + '.DBBranches'
+
+
+class CSVDest(DataStoreTree):
+    _branches = __name__ + '.CSVBranches'
+
+
+class TypedKeysTest(unittest.TestCase):
+
+    def setUp(self):
+        DataStoreTreeMeta._store.clear()
+        DataStoreTreeMeta._storeobjects.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.directory.name, 'dest.sqlite')
+        with sqlite3.connect(self.database) as connection:
+            connection.execute("CREATE TABLE users (idnumber TEXT, name TEXT)")
+            connection.executemany("INSERT INTO users VALUES (?, ?)", DEST_ROWS)
+        connection.close()
+        self.csv_path = os.path.join(self.directory.name, 'users.csv')
+        with open(self.csv_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['idnumber', 'name'])
+            writer.writerows(DEST_ROWS)
+        DestDBImporter._settings = {'db_database': self.database}
+        DestCSVImporter._settings = {'path': self.csv_path, 'delimiter': ','}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def messages(self, this, other):
+        return sorted(action.message for action in this - other)
+
+    def expected(self):
+        source, dest = Source(), DBDest()
+        +source
+        +dest
+        return self.messages(source, dest)
+
+    def test_full_import_is_typed(self):
+        dest = DBDest()
+        +dest
+        self.assertEqual(set(dest.users.keys()), {1, 2, 3, 5})
+        self.assertEqual(self.expected(), [
+            'new_users(idnumber=4)',
+            'old_users(idnumber=5)',
+            'update_name(idnumber=2, left_value=two, right_value=deux)',
+        ])
+
+    def test_import_overlap(self):
+        expected = self.expected()
+        DataStoreTreeMeta._store.clear()
+        for dest_class in (DBDest, CSVDest):
+            source, dest = Source(), dest_class()
+            +source
+            dest.import_overlap(source)
+            self.assertEqual(set(dest.users.keys()), {1, 2, 3, 5}, dest_class.__name__)
+            self.assertEqual(self.messages(source, dest), expected, dest_class.__name__)
+
+    def test_import_changed(self):
+        expected = self.expected()
+        DataStoreTreeMeta._store.clear()
+        source, dest = Source(), DBDest()
+        +source
+        dest.import_changed(source)
+        self.assertEqual(set(dest.users.keys()), {1, 2, 3, 5})
+        # the rows whose hash matches share the source's object
+        self.assertIs(dest.users.get(1), source.users.get(1))
+        self.assertEqual(self.messages(source, dest), expected)
+
+    def test_refresh(self):
+        dest = DBDest()
+        self.assertEqual(dest.refresh(), ['users'])
+        unchanged = dest.users.get(1)
+        with sqlite3.connect(self.database) as connection:
+            connection.execute("UPDATE users SET name = 'dos' WHERE idnumber = '2'")
+            connection.execute("DELETE FROM users WHERE idnumber = '5'")
+        connection.close()
+        dest.refresh()
+        self.assertEqual(set(dest.users.keys()), {1, 2, 3})
+        self.assertIs(dest.users.get(1), unchanged)
+        self.assertEqual(dest.users.get(2).name, 'dos')
+
+    def test_estimate_drift(self):
+        source, dest = Source(), DBDest()
+        estimates = source.estimate_drift(dest, rate=1)['users']
+        self.assertEqual(estimates['new'].count, 1)
+        self.assertEqual(estimates['old'].count, 1)
+        self.assertEqual(estimates['changed'].count, 1)
+        self.assertTrue(estimates['new'].exact)
+
+
+if __name__ == '__main__':
+    unittest.main()